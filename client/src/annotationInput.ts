@@ -10,6 +10,16 @@ import * as vscode from 'vscode';
 import { ShowMessageNotification } from 'vscode-languageserver-protocol';
 import { sleep } from './utils';
 
+// Receives the partial results of the query in progress, if the query dialog is open
+let partialResultsHandler: ((result) => Promise<void>) | null = null;
+
+// Called when the language server forwards the first results of a query before it completes
+export function onPartialQueryResults(result) {
+    if (partialResultsHandler) {
+        partialResultsHandler(result);
+    }
+}
+
 /**
  * A multi-step input using window.createQuickPick() and window.createInputBox().
  * 
@@ -57,6 +67,8 @@ export async function multiStepInput(context: ExtensionContext, initialEntity: s
     }
 
     async function inputQuery(input: MultiStepInput, state: Partial<State>) {
+        // results of stale queries are ignored by onQueryResults
+        partialResultsHandler = (result) => input.onQueryResults(result);
         const pick = await input.showQuickPick({
             title,
             step: 2,
@@ -67,6 +79,7 @@ export async function multiStepInput(context: ExtensionContext, initialEntity: s
             initialValue: state.initialEntity,
             shouldResume: shouldResume,
             onInputChanged: (value) => onQueryUpdated(state.database['id'], value, input),
+            onMore: (item) => sendQuery(state.database['id'], item['query'], item['page'], input),
         });
         state.entity = pick;
     }
@@ -80,7 +93,12 @@ export async function multiStepInput(context: ExtensionContext, initialEntity: s
         } else {
             return;
         }
-        commands.executeCommand('antimony.sendQuery', database, query).then(async (result) => {
+        sendQuery(database, query, 0, input);
+    }
+
+    function sendQuery(database: string, query: string, page: number, input: MultiStepInput) {
+        input.expectPage(page);
+        commands.executeCommand('antimony.sendQuery', database, query, page).then(async (result) => {
             await input.onQueryResults(result);
         });
     }
@@ -92,7 +110,12 @@ export async function multiStepInput(context: ExtensionContext, initialEntity: s
         });
     }
 
-    const state = await collectInputs();
+    let state: State;
+    try {
+        state = await collectInputs();
+    } finally {
+        partialResultsHandler = null;
+    }
     return {
         'database': state.database.label,
         'entity': state.entity
@@ -125,6 +148,8 @@ interface QuickPickParameters<T extends QuickPickItem> {
     initialValue?: string;
     shouldResume: () => Thenable<boolean>;
     onInputChanged: (v: string) => void;
+    // called instead of resolving when the "show more" item is picked
+    onMore?: (item: T) => void;
 }
 
 interface InputBoxParameters {
@@ -148,6 +173,9 @@ export class MultiStepInput {
     current?: QuickInput;
     private steps: InputStep[] = [];
     private lastErrorMillis = 0;
+    // Page of the query results being received, and the items of the pages before it
+    private page = 0;
+    private previousItems: QuickPickItem[] = [];
 
     private async stepThrough<T>(start: InputStep) {
         let step: InputStep | void = start;
@@ -178,7 +206,7 @@ export class MultiStepInput {
     }
 
     async showQuickPick<T extends QuickPickItem, P extends QuickPickParameters<T>>(
-        { title, step, totalSteps, items, activeItem, placeholder, buttons, initialValue, shouldResume, onInputChanged }: P) {
+        { title, step, totalSteps, items, activeItem, placeholder, buttons, initialValue, shouldResume, onInputChanged, onMore }: P) {
         const disposables: Disposable[] = [];
         try {
             return await new Promise<T | (P extends { buttons: (infer I)[] } ? I : never)>((resolve, reject) => {
@@ -207,7 +235,13 @@ export class MultiStepInput {
                             resolve(<any>item);
                         }
                     }),
-                    input.onDidChangeSelection(items => resolve(items[0])),
+                    input.onDidChangeSelection(items => {
+                        if (onMore && items[0] && items[0]['more']) {
+                            onMore(items[0]);
+                        } else {
+                            resolve(items[0]);
+                        }
+                    }),
                     input.onDidHide(() => {
                         (async () => {
                             reject(shouldResume && await shouldResume() ? InputFlowAction.resume : InputFlowAction.cancel);
@@ -231,6 +265,15 @@ export class MultiStepInput {
         return 'items' in input;
     }
 
+    // Called before a page of results is requested; the items of the earlier pages are kept
+    expectPage(page: number) {
+        this.page = page;
+        if (this.current && this.instanceOfQuickPick(this.current)) {
+            this.previousItems = page === 0 ? [] : this.current.items.filter((item) => !item['more']);
+            this.current.busy = page > 0;
+        }
+    }
+
     async onQueryResults(result) {
         // TODO display a banner saying 'no results' if there aren't any results
         // Or display a progress bar when querying, just so that the user can distinguish
@@ -250,14 +293,26 @@ export class MultiStepInput {
                     return;
                 }
 
-                if (this.current.value === result.query) {
-                    this.current.items = result.items.map((item) => {
+                if (this.current.value === result.query && (result.page || 0) === this.page) {
+                    const items = result.items.map((item) => {
                         item['label'] = item['name'];
                         item['detail'] = 'detail';
                         item['description'] = 'description';
                         item['alwaysShow'] = true;
                         return item;
                     });
+                    // partial results have no has_more; the complete page follows
+                    if (result.has_more) {
+                        items.push({
+                            label: '$(chevron-down) Show more results',
+                            alwaysShow: true,
+                            more: true,
+                            query: result.query,
+                            page: this.page + 1,
+                        });
+                    }
+                    this.current.items = this.previousItems.concat(items);
+                    this.current.busy = false;
                 }
             }
         }
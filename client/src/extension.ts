@@ -15,11 +15,13 @@ import {
 	ServerOptions,
 	TransportKind
 } from 'vscode-languageclient/node';
-import { multiStepInput } from './annotationInput';
+import { multiStepInput, onPartialQueryResults } from './annotationInput';
 
 let client: LanguageClient = null;
 let curPythonInterp: string | null = null;
 let lastChangeInterp = 0;
+// settings that are read when the language server starts
+const restartSettings = ['bio-ide.pythonInterpreter', 'bio-ide.chebiOntologyFile', 'bio-ide.indexWorkspace'];
 
 
 // Provides the CodeLens link to the usage guide if the file is empty.
@@ -94,6 +96,18 @@ async function startLSClient(context: ExtensionContext) {
 		documentSelector: [
 			{ scheme: "file", language: "antimony" },
 		],
+		// notify the server of setting changes, see restartSettings
+		synchronize: {
+			configurationSection: 'bio-ide',
+			// keep the workspace index and the import graph up to date with the files on disk
+			fileEvents: workspace.createFileSystemWatcher('**/*.ant'),
+		},
+		// settings needed before the first request, see restartSettings
+		initializationOptions: {
+			prefetchAnnotations: workspace.getConfiguration('bio-ide').get('prefetchAnnotations'),
+			chebiOntologyFile: workspace.getConfiguration('bio-ide').get('chebiOntologyFile'),
+			indexWorkspace: workspace.getConfiguration('bio-ide').get('indexWorkspace'),
+		},
 	};
 
 	// Create the language client and start the client.
@@ -107,6 +121,11 @@ async function startLSClient(context: ExtensionContext) {
 	// Start the client. This will also launch the server
 	const clientDisposable = client.start();
 	context.subscriptions.push(clientDisposable);
+
+	const startedClient = client;
+	startedClient.onReady().then(() => {
+		startedClient.onNotification('antimony/queryPartialResults', onPartialQueryResults);
+	});
 }
 
 export async function activate(context: ExtensionContext) {
@@ -119,8 +138,8 @@ export async function activate(context: ExtensionContext) {
 	decorateDocument(window.activeTextEditor?.document);
 	workspace.onDidChangeConfiguration(async (e) => {
 		// restart the language server using the new Python interpreter, if the related
-		// setting was changed
-		if (!e.affectsConfiguration('bio-ide')) {
+		// setting was changed. Other settings are applied by the running server.
+		if (!restartSettings.some(setting => e.affectsConfiguration(setting))) {
 			return;
 		}
 		let curTime = Date.now();
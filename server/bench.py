@@ -0,0 +1,115 @@
+"""Benchmark of the antimony.sendQuery handler against the local stand-in web services.
+
+Record the exchanges of some queries with the live services first:
+    python server/bench.py record fixtures.jsonl glucose ATP insulin
+then replay them under concurrent load, without network access:
+    python server/bench.py run fixtures.jsonl glucose ATP insulin --clients 8 --requests 200
+
+Author: Gary Geng
+"""
+
+import os
+import sys
+
+
+# Temporary, before both packages are published
+EXTENSION_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(EXTENSION_ROOT, "stibium_src"))
+sys.path.append(os.path.join(EXTENSION_ROOT, "stibium_server_src"))
+
+from stibium_server.cache import TTLCache
+from stibium_server.fixtures import FixtureRecorder
+from stibium_server.standin import StandInServer
+from stibium_server.webservices import WebServices
+
+import main
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import time
+
+
+DATABASES = ('chebi', 'uniprot')
+
+
+class _Client:
+    '''Stands in for the LanguageServer passed to the command handlers'''
+    def send_notification(self, method, params=None):
+        pass
+
+
+def record(args):
+    main.services = WebServices()
+    with FixtureRecorder(args.fixtures):
+        for database, query in itertools.product(args.databases, args.queries):
+            result = main.query_species(_Client(), [database, query])
+            print('{} {!r}: {}'.format(database, query, result.get('error') or len(result['items'])))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(args):
+    # one stand-in per service: the rate limiters and circuit breakers are shared by host and
+    # port, as the real services do not share theirs
+    standins = [StandInServer(args.fixtures, latency=args.latency, jitter=args.jitter,
+                              error_rate=args.error_rate, seed=seed) for seed in range(2)]
+    for standin in standins:
+        standin.start()
+    main.services = WebServices(chebi_url=standins[0].service_urls()['chebi_url'],
+                                uniprot_url=standins[1].service_urls()['uniprot_url'])
+    if not args.cache:
+        # measure the web queries, not the result cache
+        main.services.results_cache = TTLCache(maxsize=0)
+
+    jobs = list(itertools.product(args.databases, args.queries))
+    # warm up: fetch the WSDL and open the connections
+    for job in jobs:
+        main.query_species(_Client(), list(job))
+
+    def timed(job):
+        start = time.perf_counter()
+        result = main.query_species(_Client(), list(job))
+        return time.perf_counter() - start, 'error' in result
+
+    schedule = [jobs[i % len(jobs)] for i in range(args.requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        results = list(executor.map(timed, schedule))
+    elapsed = time.perf_counter() - start
+    for standin in standins:
+        standin.stop()
+
+    latencies = sorted(lat for lat, _ in results)
+    errors = sum(1 for _, err in results if err)
+    print('{} requests, {} clients, {} errors, {} fixture misses'.format(
+        len(results), args.clients, errors, sum(standin.misses for standin in standins)))
+    print('throughput: {:.1f} req/s'.format(len(results) / elapsed))
+    print('latency (ms): p50 {:.1f}  p90 {:.1f}  p99 {:.1f}  max {:.1f}'.format(
+        *(1000 * percentile(latencies, p) for p in (50, 90, 99, 100))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=('record', 'run'))
+    parser.add_argument('fixtures', help='fixture file (JSON lines)')
+    parser.add_argument('queries', nargs='+')
+    parser.add_argument('--databases', nargs='+', choices=DATABASES, default=list(DATABASES))
+    parser.add_argument('--clients', type=int, default=8, help='concurrent queries')
+    parser.add_argument('--requests', type=int, default=200, help='total number of queries')
+    parser.add_argument('--latency', type=float, default=0., help='stand-in latency (seconds)')
+    parser.add_argument('--jitter', type=float, default=0., help='stand-in random extra latency')
+    parser.add_argument('--error-rate', type=float, default=0., help='stand-in error probability')
+    parser.add_argument('--cache', action='store_true', help='keep the query result cache on')
+    args = parser.parse_args()
+
+    if args.mode == 'record':
+        record(args)
+    else:
+        run(args)
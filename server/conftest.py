@@ -0,0 +1,14 @@
+"""pytest configuration of the server tests.
+"""
+
+import os
+import sys
+
+
+# Temporary, before both packages are published
+EXTENSION_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(EXTENSION_ROOT, "stibium_src"))
+sys.path.append(os.path.join(EXTENSION_ROOT, "stibium_server_src"))
+
+# test.py is a scratch script, not a test module
+collect_ignore = ["test.py"]
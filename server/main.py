@@ -16,18 +16,36 @@ sys.path.append(os.path.join(EXTENSION_ROOT, "stibium_server_src"))
 from stibium.api import AntCompletion, AntCompletionKind
 from stibium.types import Issue, IssueSeverity
 
-from stibium_server.utils import AntFile, pygls_range, sb_position, get_antfile, sb_range
+from stibium_server.annotations import AnnotationResolver, UNRESOLVED
+from stibium_server.bioservices.sessions import get_session_pool, pool_parameters
+from stibium_server.bioservices.settings import reload_config
+from stibium_server.autoannotate import AutoAnnotateJob
+from stibium_server.cache import TTLCache
+from stibium_server.indexer import IndexedSymbol, WorkspaceIndexer
+from stibium_server.lexer import KEYWORDS
+from stibium_server.ontology import ChEBIOntology
+from stibium_server.prefetch import Prefetcher, unannotated_species_names
+from stibium_server.symsearch import SymbolSearchIndex
+from stibium_server.symindex import SymbolRecord
+from stibium_server.utils import LineIndex, antfile_cache, get_antfile, pygls_lsp_range, sb_range
 from stibium_server.webservices import NetworkError, WebServices
+from stibium_server.workspace import ImportIssue, WorkspaceModel
 
 import logging
+import re
 from dataclasses import dataclass
-from pygls.features import (CODE_LENS, COMPLETION, DEFINITION, HOVER, SIGNATURE_HELP, TEXT_DOCUMENT_DID_CHANGE,
-                            TEXT_DOCUMENT_DID_OPEN, TEXT_DOCUMENT_DID_SAVE, WORKSPACE_EXECUTE_COMMAND)
+from pygls.features import (CODE_LENS, CODE_LENS_RESOLVE, COMPLETION, DEFINITION, DOCUMENT_HIGHLIGHT, DOCUMENT_SYMBOL, HOVER, INITIALIZE, INITIALIZED, PREPARE_RENAME,
+                            REFERENCES, RENAME, SIGNATURE_HELP, TEXT_DOCUMENT_DID_CHANGE,
+                            TEXT_DOCUMENT_DID_CLOSE, TEXT_DOCUMENT_DID_OPEN, TEXT_DOCUMENT_DID_SAVE, WORKSPACE_DID_CHANGE_CONFIGURATION,
+                            WORKSPACE_DID_CHANGE_WATCHED_FILES, WORKSPACE_EXECUTE_COMMAND, WORKSPACE_SYMBOL)
 from pygls.server import LanguageServer
-from pygls.types import (CompletionItem, CompletionItemKind, CompletionList, CompletionParams, Diagnostic, DiagnosticSeverity,
-                         DidChangeTextDocumentParams,
-                         DidOpenTextDocumentParams, DidSaveTextDocumentParams, Hover, InsertTextFormat, Location, MarkupContent, MarkupKind,
-                         TextDocumentContentChangeEvent, TextDocumentPositionParams)
+from pygls.uris import from_fs_path, to_fs_path
+from pygls.types import (CodeLens, CodeLensParams, Command, CompletionItem, CompletionItemKind, CompletionList, CompletionParams, ConfigurationItem, ConfigurationParams,
+                         Diagnostic, DiagnosticSeverity, DidChangeConfigurationParams, DidChangeTextDocumentParams, DidCloseTextDocumentParams,
+                         DidChangeWatchedFiles, DidOpenTextDocumentParams, DidSaveTextDocumentParams, DocumentHighlight, DocumentHighlightKind, DocumentSymbol,
+                         DocumentSymbolParams, Hover, InitializeParams, InsertTextFormat, Location, MarkupContent, MarkupKind,
+                         Position, Range, ReferenceParams, RenameParams, SymbolInformation, SymbolKind, TextDocumentContentChangeEvent, TextDocumentPositionParams,
+                         TextEdit, WorkspaceEdit, WorkspaceSymbolParams)
 import threading
 import time
 
@@ -39,42 +57,160 @@ logging.basicConfig(filename='bio-idek.log', filemode='w', level=logging.DEBUG)
 '''=====Server-related Code===='''
 server = LanguageServer()
 services = WebServices()
+resolver = AnnotationResolver(services)
+prefetcher = Prefetcher(services)
+ontology = ChEBIOntology(services)
+workspace = WorkspaceModel()
+indexer = WorkspaceIndexer()
+symbol_search = SymbolSearchIndex()
+indexer.add_listener(symbol_search.update_file)
 
 
-def to_diagnostic(issue: Issue):
+def to_diagnostic(issue: Issue, lines: LineIndex):
     '''Convert the Stibium Issue object to a pygls Diagnostic object'''
     severity = DiagnosticSeverity.Error
     if issue.severity == IssueSeverity.Warning:
         severity = DiagnosticSeverity.Warning
 
     return Diagnostic(
-        range=pygls_range(issue.range),
+        range=lines.pygls_range(issue.range),
         message=issue.message,
         severity=severity
     )
 
 
-def _publish_diagnostics(uri: str) -> AntFile:
+def import_diagnostic(issue: ImportIssue):
+    return Diagnostic(
+        range=pygls_lsp_range(issue.range),
+        message=issue.message,
+        severity=DiagnosticSeverity.Error if issue.is_error else DiagnosticSeverity.Warning
+    )
+
+
+# Analysis whose diagnostics were last published, by URI
+published = dict()
+
+
+def _publish_diagnostics(uri: str, force: bool = False):
+    '''Publish the diagnostics of a document, unless they were published for this version
+    already. force publishes them anyway, e.g. when the imports of the document may resolve
+    differently.'''
     doc = server.workspace.get_document(uri)
-    antfile = get_antfile(doc)
-    errors = antfile.get_issues()
-    diagnostics = [to_diagnostic(e) for e in errors]
+    analyzed = antfile_cache.get(doc)
+    if published.get(uri) is analyzed and not force:
+        # this version was analyzed and published already, e.g. saved right after a change
+        return
+    published[uri] = analyzed
+    dependents = workspace.update(doc.path, analyzed.source)
+    indexer.update_text(doc.path, analyzed.source)
+    diagnostics = [to_diagnostic(e, analyzed.lines) for e in analyzed.issues]
+    diagnostics.extend(import_diagnostic(issue) for issue in workspace.import_issues(doc.path))
     server.publish_diagnostics(uri, diagnostics)
-    return antfile
+    _recheck_dependents(dependents)
+    index = analyzed.index
+    # fetch the names of the annotated entities in the background, for hover
+    resolver.resolve_document(index)
+    # search for the unannotated species in the background, if enabled
+    prefetcher.prefetch_document(index)
+
+
+def _recheck_dependents(paths):
+    '''Publish the diagnostics of the open documents that import a file whose imports or
+    definitions changed'''
+    if not paths:
+        return
+    for uri, doc in list(server.workspace.documents.items()):
+        if WorkspaceModel.normalize(doc.path) in paths:
+            _publish_diagnostics(uri, force=True)
+
+
+@server.feature(INITIALIZE)
+def initialize(ls: LanguageServer, params: InitializeParams):
+    '''Read the settings the client passes as initializationOptions'''
+    roots = [to_fs_path(folder.uri) for folder in ls.workspace.folders.values()]
+    if not roots and ls.workspace.root_path:
+        roots = [ls.workspace.root_path]
+    workspace.set_roots(roots)
+    options = params.initializationOptions
+    if getattr(options, 'indexWorkspace', True) and roots:
+        indexer.start(roots)
+    if getattr(options, 'prefetchAnnotations', False):
+        prefetcher.enable()
+    ontology_file = getattr(options, 'chebiOntologyFile', None)
+    if ontology_file:
+        threading.Thread(target=_load_ontology, args=(ontology_file,), daemon=True).start()
+
+
+# bio-ide.webServices settings and the bioservices parameters they set. Settings left to null keep
+# the value of the bioservices configuration file.
+WEB_SERVICE_SETTINGS = {
+    'timeout': 'general.timeout',
+    'connectTimeout': 'general.connect_timeout',
+    'maxRetries': 'general.max_retries',
+    'concurrentRequests': 'general.async_concurrent',
+}
+
+
+@server.feature(INITIALIZED)
+def initialized(ls: LanguageServer, params):
+    _fetch_configuration(ls)
+
+
+@server.feature(WORKSPACE_DID_CHANGE_CONFIGURATION)
+def did_change_configuration(ls: LanguageServer, params: DidChangeConfigurationParams):
+    '''Apply the settings that don't need a restart of the server'''
+    _fetch_configuration(ls)
+
+
+def _fetch_configuration(ls: LanguageServer):
+    ls.get_configuration(ConfigurationParams([ConfigurationItem(section='bio-ide')]),
+                         callback=_apply_configuration)
+
+
+def _apply_configuration(config):
+    settings = config[0] if config else None
+    if settings is None:
+        return
+    if getattr(settings, 'prefetchAnnotations', False):
+        prefetcher.enable()
+    else:
+        prefetcher.disable()
+
+    web_services = getattr(settings, 'webServices', None)
+    values = dict()
+    for name, key in WEB_SERVICE_SETTINGS.items():
+        value = getattr(web_services, name, None)
+        if value is not None:
+            values[key] = value
+    # start over from the configuration file, so that settings reset to null are undone;
+    # the values are set before the new configuration is published, in a single swap
+    config = reload_config(values)
+    # the executors of the concurrent requests are sized on each call, the connection pool is not
+    get_session_pool(config).configure(**pool_parameters(config))
+
+
+def _load_ontology(path: str):
+    try:
+        ontology.graph.load_obo(path)
+        logging.info('Loaded %d ChEBI ontology terms from %s', len(ontology.graph), path)
+    except (OSError, UnicodeDecodeError):
+        logging.exception('Could not load the ChEBI ontology from %s', path)
 
 
 @server.feature(TEXT_DOCUMENT_DID_OPEN)
 def did_open(ls: LanguageServer, params: DidOpenTextDocumentParams):
     """Text document did open notification."""
-    antfile = _publish_diagnostics(params.textDocument.uri)
+    _publish_diagnostics(params.textDocument.uri)
 
 
 @server.feature(COMPLETION)
 def completions(params: CompletionParams):
     text_doc = server.workspace.get_document(params.textDocument.uri)
+    lines = antfile_cache.get(text_doc).lines
+    # the cached analysis has no parse tree; completion parses the document again
     antfile = get_antfile(text_doc)
     # TODO better isolation; no pygls stuff in antfile
-    ant_completions = antfile.completions(sb_position(params.position))
+    ant_completions = antfile.completions(lines.sb_position(params.position))
 
     # TODO move this function to utils
     def map_completion(ant_compl: AntCompletion):
@@ -91,82 +227,324 @@ def completions(params: CompletionParams):
     return CompletionList(False, items)
 
 
+# on a thread, since hover may wait HOVER_FETCH_BUDGET for annotation metadata
+@server.thread()
 @server.feature(HOVER)
 def hover(params: TextDocumentPositionParams):
     text_doc = server.workspace.get_document(params.textDocument.uri)
-    antfile = get_antfile(text_doc)
-    symbols, range_ = antfile.symbols_at(sb_position(params.position))
-    if not symbols:
+    analyzed = antfile_cache.get(text_doc)
+    index, lines = analyzed.index, analyzed.lines
+    position = lines.sb_position(params.position)
+    found = index.symbol_at(position.line, position.column)
+    if found is None:
         return None
 
-    assert range_ is not None
-
-    # TODO fix the interface
-    sym = symbols[0]
-    text = sym.help_str()
+    record, span = found
+    text = record.help
+    annotations = _annotations_markdown(record)
+    if annotations:
+        text += '\n\n---\n' + annotations
     contents = MarkupContent(MarkupKind.Markdown, text)
     return Hover(
         contents=contents,
-        range=pygls_range(range_),
+        range=pygls_lsp_range(lines.lsp_span(span)),
     )
 
 
+# Maximum time (seconds) hover waits for annotation metadata that is not cached yet. Whatever
+# arrives later is cached and shown by the next hover.
+HOVER_FETCH_BUDGET = 0.05
+
+
+def _annotations_markdown(record: SymbolRecord) -> str:
+    '''List the annotations of the symbol, with the entity names that are cached or that can be
+    fetched within HOVER_FETCH_BUDGET.'''
+    uris = record.annotations
+    if not uris:
+        return ''
+    entities = resolver.lookup_many(uris, budget=HOVER_FETCH_BUDGET)
+    lines = list()
+    for uri, entity in zip(uris, entities):
+        if entity is UNRESOLVED or entity is None:
+            lines.append('* {}'.format(uri))
+        else:
+            lines.append('* **{}** ([{}]({}))'.format(entity['name'], entity['id'], uri))
+    return '\n'.join(lines)
+
+
 @server.feature(DEFINITION)
 def definition(params):
     text_doc = server.workspace.get_document(params.textDocument.uri)
-    antfile = get_antfile(text_doc)
-    srclocations, range_ = antfile.goto(sb_position(params.position))
-
-    definitions = [Location(
-        loc.path,
-        pygls_range(loc.range)) for loc in srclocations]
+    analyzed = antfile_cache.get(text_doc)
+    index, lines = analyzed.index, analyzed.lines
+    position = lines.sb_position(params.position)
+    found = index.symbol_at(position.line, position.column)
+    declarations = found[0].declarations if found is not None else ()
+    definitions = [Location(params.textDocument.uri, pygls_lsp_range(lines.lsp_span(span)))
+                   for span in declarations]
+    if not definitions:
+        # a model or function defined in an imported file
+        found = workspace.find_definition(text_doc.path, text_doc.word_at_position(params.position))
+        if found is not None:
+            path, found_definition = found
+            definitions = [Location(from_fs_path(path), pygls_lsp_range(found_definition.range))]
     # If no definitions, return None
     return definitions or None
 
 
+def _usages_at(params: TextDocumentPositionParams):
+    '''The symbol at the position, the spans of all its occurrences in the document, the spans of
+    its definitions, and the line index to convert them; None if there is no symbol there'''
+    text_doc = server.workspace.get_document(params.textDocument.uri)
+    analyzed = antfile_cache.get(text_doc)
+    index, lines = analyzed.index, analyzed.lines
+    position = lines.sb_position(params.position)
+    found = index.symbol_at(position.line, position.column)
+    if found is None:
+        return None
+    record, span = found
+    return record, span, index.spans_of(record), set(record.declarations), lines
+
+
+@server.feature(REFERENCES)
+def references(params: ReferenceParams):
+    found = _usages_at(params)
+    if found is None:
+        return None
+    _, _, spans, definitions, lines = found
+    include_declaration = getattr(params.context, 'includeDeclaration', True)
+    return [Location(params.textDocument.uri, pygls_lsp_range(lines.lsp_span(span)))
+            for span in spans if include_declaration or span not in definitions]
+
+
+@server.feature(DOCUMENT_HIGHLIGHT)
+def document_highlight(params: TextDocumentPositionParams):
+    found = _usages_at(params)
+    if found is None:
+        return None
+    _, _, spans, definitions, lines = found
+    return [DocumentHighlight(pygls_lsp_range(lines.lsp_span(span)),
+                              DocumentHighlightKind.Write if span in definitions else DocumentHighlightKind.Read)
+            for span in spans]
+
+
+NAME_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+@server.feature(PREPARE_RENAME)
+def prepare_rename(params: TextDocumentPositionParams):
+    '''The range of the name to rename. pygls only advertises renameProvider as a boolean, so not
+    all clients ask for this.'''
+    found = _usages_at(params)
+    if found is None:
+        return None
+    _, span, _, _, lines = found
+    return pygls_lsp_range(lines.lsp_span(span))
+
+
+@server.feature(RENAME)
+def rename(params: RenameParams):
+    if not NAME_PATTERN.fullmatch(params.newName):
+        raise ValueError("'{}' is not a valid Antimony name".format(params.newName))
+    if params.newName in KEYWORDS:
+        raise ValueError("'{}' is an Antimony keyword".format(params.newName))
+    found = _usages_at(params)
+    if found is None:
+        return None
+    _, _, spans, _, lines = found
+    edits = [TextEdit(pygls_lsp_range(lines.lsp_span(span)), params.newName) for span in spans]
+    return WorkspaceEdit(changes={params.textDocument.uri: edits})
+
+
+# Symbol types that get a code lens
+LENS_TYPES = ('Species', 'Reaction')
+# Unresolved code lenses by (uri, version), and resolved titles by (uri, version, scope, name)
+code_lenses = TTLCache(maxsize=32)
+code_lens_titles = TTLCache(maxsize=4096)
+
+
+@server.feature(CODE_LENS)
+def code_lens(params: CodeLensParams):
+    '''Lenses over the species and reactions, without their titles; the client resolves the ones
+    that are visible, see resolve_code_lens'''
+    uri = params.textDocument.uri
+    text_doc = server.workspace.get_document(uri)
+    key = (uri, text_doc.version)
+    lenses = code_lenses.get(key)
+    if lenses is None:
+        analyzed = antfile_cache.get(text_doc)
+        index, lines = analyzed.index, analyzed.lines
+        lenses = list()
+        for record in index.symbols:
+            span = index.first_span(record) if record.type in LENS_TYPES else None
+            if span is None:
+                continue
+            data = {'uri': uri, 'version': text_doc.version, 'scope': record.scope, 'name': record.name}
+            lenses.append(CodeLens(pygls_lsp_range(lines.lsp_span(span)), data=data))
+        code_lenses.put(key, lenses)
+    return lenses
+
+
+@server.feature(CODE_LENS_RESOLVE)
+def resolve_code_lens(lens: CodeLens):
+    '''Count the references and annotations of the symbol of a lens'''
+    data = lens.data
+    key = (data.uri, data.version, data.scope, data.name)
+    title = code_lens_titles.get(key)
+    if title is None:
+        text_doc = server.workspace.get_document(data.uri)
+        index = antfile_cache.get(text_doc).index
+        record = index.get(data.name, data.scope)
+        # the symbol is gone if the document changed since the lenses were computed; a resolved
+        # lens needs a command, or VS Code shows a placeholder instead
+        title = _lens_title(index, record) if record is not None else '0 references'
+        if text_doc.version == data.version:
+            code_lens_titles.put(key, title)
+    range_ = Range(Position(lens.range.start.line, lens.range.start.character),
+                   Position(lens.range.end.line, lens.range.end.character))
+    # lenses without a command are not clickable
+    return CodeLens(range_, Command(title, ''), data._asdict())
+
+
+def _lens_title(index, record) -> str:
+    # the first occurrence is the one the lens is on
+    references = max(0, index.usage_count(record) - 1)
+    title = '{} reference{}'.format(references, '' if references == 1 else 's')
+    if record.annotations:
+        return '{} | annotated ({})'.format(title, len(record.annotations))
+    return title + ' | not annotated'
+
+
+# LSP kind of each kind of indexed symbol
+SYMBOL_KINDS = {
+    'Model': SymbolKind.Module,
+    'Function': SymbolKind.Function,
+    'Species': SymbolKind.Variable,
+    'Compartment': SymbolKind.Namespace,
+    'Reaction': SymbolKind.Event,
+    'Parameter': SymbolKind.Constant,
+}
+
+
+@server.feature(DOCUMENT_SYMBOL)
+def document_symbols(params: DocumentSymbolParams):
+    '''Models and functions, with the symbols they define as children'''
+    text_doc = server.workspace.get_document(params.textDocument.uri)
+    # indexed already, unless it changed since the last diagnostics
+    indexer.update_text(text_doc.path, text_doc.source)
+
+    def document_symbol(symbol: IndexedSymbol, children=None):
+        range_ = pygls_lsp_range(symbol.range)
+        return DocumentSymbol(symbol.name, SYMBOL_KINDS.get(symbol.kind, SymbolKind.Variable),
+                              range_, range_, detail=symbol.kind, children=children)
+
+    symbols = indexer.symbols(text_doc.path)
+    scoped = dict()
+    for symbol in symbols:
+        if symbol.scope:
+            scoped.setdefault(symbol.scope, list()).append(document_symbol(symbol))
+    return [document_symbol(symbol, scoped.get(symbol.name) if symbol.kind == 'Model' else None)
+            for symbol in symbols if not symbol.scope]
+
+
+@server.feature(WORKSPACE_SYMBOL)
+def workspace_symbols(params: WorkspaceSymbolParams):
+    '''Best matches of the query among the symbols of the indexed and open files'''
+    return [SymbolInformation(symbol.name, SYMBOL_KINDS.get(symbol.kind, SymbolKind.Variable),
+                              Location(from_fs_path(path), pygls_lsp_range(symbol.range)),
+                              container_name=symbol.scope or None)
+            for path, symbol in symbol_search.search(params.query)]
+
+
 # Performance trick: don't re-parse as soon as DidChange is issued, but wait for 0.5 seconds. If
-# the user makes any more changes within that 0.5 seconds, don't actually perform the work.
+# the user makes any more changes to the same document within that 0.5 seconds, don't actually
+# perform the work. Each document has its own timer, so editing one document does not hold back
+# the diagnostics of another.
 lock = threading.Lock()
-latest_millis = 0
+pending_timers = dict()
 
 @server.thread()
 @server.feature(TEXT_DOCUMENT_DID_CHANGE)
 def did_change(ls: LanguageServer, params: DidChangeTextDocumentParams):
     """Text document did open notification."""
-    global latest_millis
+    uri = params.textDocument.uri
 
-    def callback(millis):
+    def callback():
         with lock:
-            if millis < latest_millis:
+            if pending_timers.get(uri) is not timer:
                 return
-            assert millis == latest_millis
-        _publish_diagnostics(params.textDocument.uri)
-
-    cur_millis = int(time.time() * 1000)
+            del pending_timers[uri]
+        _publish_diagnostics(uri)
 
+    timer = threading.Timer(0.5, callback)
     with lock:
-        latest_millis = max(cur_millis, latest_millis)
+        previous = pending_timers.get(uri)
+        if previous is not None:
+            previous.cancel()
+        pending_timers[uri] = timer
+    timer.start()
+
 
-    t = threading.Timer(0.5, lambda: callback(cur_millis))
-    t.start()
+@server.feature(TEXT_DOCUMENT_DID_CLOSE)
+def did_close(ls: LanguageServer, params: DidCloseTextDocumentParams):
+    uri = params.textDocument.uri
+    with lock:
+        timer = pending_timers.pop(uri, None)
+    if timer is not None:
+        timer.cancel()
+    published.pop(uri, None)
+    antfile_cache.discard(uri)
+    # the file on disk replaces the closed document
+    path = to_fs_path(uri)
+    indexer.close(path)
+    _recheck_dependents(workspace.close(path))
+
+
+@server.feature(WORKSPACE_DID_CHANGE_WATCHED_FILES)
+def did_change_watched_files(ls: LanguageServer, params: DidChangeWatchedFiles):
+    '''Files changed on disk, e.g. by git or another editor'''
+    for change in params.changes:
+        path = to_fs_path(change.uri)
+        indexer.enqueue(path)
+        _recheck_dependents(workspace.file_changed(path))
 
 
 @server.feature(TEXT_DOCUMENT_DID_SAVE)
 def did_save(ls, params: DidSaveTextDocumentParams):
     """Text document did open notification."""
-    antfile = _publish_diagnostics(params.textDocument.uri)
+    _publish_diagnostics(params.textDocument.uri)
+
+
+# Streaming queries notify the client after the first result and then every this many results
+PARTIAL_RESULTS_EVERY = 5
 
 
 @server.thread()
 @server.command('antimony.sendQuery')
 def query_species(ls: LanguageServer, args):
+    # the user is searching; don't compete with the prefetcher
+    prefetcher.defer()
     try:
         database = args[0]
         query = args[1]
+        # optional page number, for "show more"
+        page = args[2] if len(args) > 2 else 0
+        has_more = False
         if database == 'chebi':
-            results = services.annot_search_chebi(query)
+            results = services.annot_search_chebi(query, page)
+            has_more = services.has_more_chebi(query, page)
         elif database == 'uniprot':
-            results = services.annot_search_uniprot(query)
+            results = list()
+            for item in services.iter_search_uniprot(query, page):
+                results.append(item)
+                # Forward the first rows while the rest of the response is still being received
+                if len(results) % PARTIAL_RESULTS_EVERY == 1:
+                    ls.send_notification('antimony/queryPartialResults', {
+                        'query': query,
+                        'page': page,
+                        'items': results,
+                    })
+            has_more = services.has_more_uniprot(query, page)
         else:
             # This is not supposed to happen
             raise SystemError("Unknown database '{}'".format(database))
@@ -174,6 +552,95 @@ def query_species(ls: LanguageServer, args):
         return {
             'query': query,
             'items': results,
+            'page': page,
+            'has_more': has_more,
+        }
+    except NetworkError:
+        return {
+            'error': 'Connection Error'
+        }
+
+
+# Minimum time (seconds) between two progress notifications of an auto-annotation job
+AUTO_ANNOTATE_PROGRESS_INTERVAL = 0.2
+
+# Running auto-annotation jobs by document URI
+auto_annotate_jobs = dict()
+auto_annotate_lock = threading.Lock()
+
+
+@server.thread()
+@server.command('antimony.autoAnnotate')
+def auto_annotate(ls: LanguageServer, args):
+    '''Search annotation candidates for all the unannotated species of the document args[0].
+
+    args[1] optionally lists the databases to search. Progress is reported with
+    antimony/autoAnnotateProgress notifications and the job can be stopped with
+    antimony.cancelAutoAnnotate; the candidates found until then are still returned.
+    '''
+    uri = args[0]
+    databases = args[1] if len(args) > 1 else ('chebi', 'uniprot')
+    # unlike the prefetcher, the short names are searched too
+    names = unannotated_species_names(antfile_cache.get(server.workspace.get_document(uri)).index,
+                                      min_length=0)
+
+    last_report = 0
+
+    def progress(done, total):
+        nonlocal last_report
+        # the job is using the rate limits already
+        prefetcher.defer()
+        now = time.monotonic()
+        if done == total or now - last_report >= AUTO_ANNOTATE_PROGRESS_INTERVAL:
+            last_report = now
+            ls.send_notification('antimony/autoAnnotateProgress', {
+                'uri': uri,
+                'done': done,
+                'total': total,
+            })
+
+    job = AutoAnnotateJob(services, names, databases, progress=progress)
+    with auto_annotate_lock:
+        previous = auto_annotate_jobs.get(uri)
+        if previous is not None:
+            previous.cancel()
+        auto_annotate_jobs[uri] = job
+    try:
+        species = job.run()
+    finally:
+        with auto_annotate_lock:
+            if auto_annotate_jobs.get(uri) is job:
+                del auto_annotate_jobs[uri]
+
+    return {
+        'uri': uri,
+        'species': species,
+        'cancelled': job.cancelled,
+        'errors': job.errors,
+    }
+
+
+@server.command('antimony.cancelAutoAnnotate')
+def cancel_auto_annotate(ls: LanguageServer, args):
+    '''Cancel the auto-annotation job of the document args[0]; return whether there was one'''
+    with auto_annotate_lock:
+        job = auto_annotate_jobs.get(args[0])
+    if job is None:
+        return False
+    job.cancel()
+    return True
+
+
+@server.thread()
+@server.command('antimony.ontologyNeighbors')
+def ontology_neighbors(ls: LanguageServer, args):
+    '''Return the broader and narrower ChEBI terms of the entity args[0]'''
+    chebi_id = args[0]
+    try:
+        return {
+            'id': chebi_id,
+            'broader': ontology.broader(chebi_id),
+            'narrower': ontology.narrower(chebi_id),
         }
     except NetworkError:
         return {
@@ -185,17 +652,16 @@ def query_species(ls: LanguageServer, args):
 def get_annotated(ls: LanguageServer, args):
     '''Return the list of annotated names as ranges'''
     text = args[0]
-    antfile = AntFile('', text)
-    qnames = antfile.analyzer.table.get_all_qnames()
-    annotated = [q for q in qnames if antfile.get_annotations(q)]
-    ranges = [pygls_range(a.name.range) for a in annotated]
+    # the client asks again for the same text whenever the active editor changes
+    analyzed = antfile_cache.get_text(text)
+    index, lines = analyzed.index, analyzed.lines
     range_objs = [
         {
-            'line': r.start.line,
-            'column': r.start.character,
-            'end_line': r.end.line,
-            'end_column': r.end.character,
-            } for r in ranges
+            'line': line,
+            'column': column,
+            'end_line': end_line,
+            'end_column': end_column,
+            } for line, column, end_line, end_column in map(lines.lsp_span, index.annotated_spans())
     ]
     return range_objs
 
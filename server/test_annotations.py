@@ -0,0 +1,64 @@
+"""Tests of the background resolution of annotation URIs.
+"""
+
+import pytest
+
+pytest.importorskip('stibium.api')
+
+from stibium_server.annotations import UNRESOLVED, AnnotationResolver
+
+import threading
+import time
+
+
+GLUCOSE = 'http://identifiers.org/chebi/CHEBI:17234'
+WATER = 'http://identifiers.org/chebi/CHEBI:15377'
+
+
+class Services:
+    '''Stands in for WebServices; the ChEBI entities are returned after delay seconds'''
+    def __init__(self, delay=0.):
+        self.delay = delay
+        self.fetched = list()
+        self.released = threading.Event()
+
+    def chebi_entities(self, ids):
+        self.fetched.append(list(ids))
+        self.released.wait(self.delay)
+        return [{'id': id_, 'name': 'entity ' + id_} for id_ in ids]
+
+    def uniprot_entries(self, ids):
+        return []
+
+
+def test_cached_uris_are_not_fetched():
+    services = Services()
+    resolver = AnnotationResolver(services)
+    resolver.cache.put(('chebi', 'CHEBI:17234'), {'id': 'CHEBI:17234', 'name': 'glucose'})
+    assert resolver.lookup_many([GLUCOSE, 'http://example.org/x'], budget=1) == \
+        [{'id': 'CHEBI:17234', 'name': 'glucose'}, UNRESOLVED]
+    assert services.fetched == []
+
+
+def test_budget():
+    services = Services(delay=5)
+    resolver = AnnotationResolver(services)
+    start = time.monotonic()
+    # the fetch takes longer than the budget: nothing is waited for past it
+    assert resolver.lookup_many([GLUCOSE, WATER], budget=0.05) == [UNRESOLVED, UNRESOLVED]
+    assert time.monotonic() - start < 1
+    # without a budget, nothing is waited for at all, and the batch in flight is not fetched again
+    start = time.monotonic()
+    assert resolver.lookup_many([GLUCOSE], budget=0) == [UNRESOLVED]
+    assert time.monotonic() - start < 0.05
+    assert services.fetched == [['CHEBI:17234', 'CHEBI:15377']]
+    # the result of the fetch is there for the next call
+    services.released.set()
+    resolver.lookup_many([WATER], budget=1)
+    assert resolver.lookup(WATER)['name'] == 'entity CHEBI:15377'
+
+
+def test_fast_fetches_are_waited_for():
+    services = Services()
+    resolver = AnnotationResolver(services)
+    assert resolver.lookup_many([GLUCOSE], budget=1)[0]['name'] == 'entity CHEBI:17234'
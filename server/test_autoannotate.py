@@ -0,0 +1,83 @@
+"""Tests of the bulk search of annotation candidates.
+"""
+
+from stibium_server.autoannotate import AutoAnnotateJob
+from stibium_server.bioservices.ratelimit import TokenBucket
+from stibium_server.webservices import NetworkError
+
+import threading
+
+
+class Services:
+    '''Stands in for WebServices: a name has the candidates in found, or none; names in
+    failing raise a NetworkError'''
+    def __init__(self, found=(), failing=(), cached=()):
+        self.found = dict(found)
+        self.failing = set(failing)
+        self.cached = set(cached)
+        self.searches = list()
+        self.limiters = {'chebi': TokenBucket(1000), 'uniprot': TokenBucket(1000)}
+        self.lock = threading.Lock()
+
+    def _search(self, database, name):
+        with self.lock:
+            self.searches.append((name, database))
+        if name in self.failing:
+            raise NetworkError()
+        return [{'id': '{}:{}'.format(database, i)} for i in range(self.found.get(name, 0))]
+
+    def annot_search_chebi(self, query):
+        return self._search('chebi', query)
+
+    def iter_search_uniprot(self, query):
+        yield from self._search('uniprot', query)
+
+    def is_cached(self, database, query):
+        return query in self.cached
+
+    def limiter(self, database):
+        return self.limiters[database]
+
+
+def test_candidates_and_progress():
+    services = Services(found={'Na': 2, 'glucose': 8})
+    reports = list()
+    job = AutoAnnotateJob(services, ['Na', 'glucose', 'Na'], limit=5,
+                          progress=lambda done, total: reports.append((done, total)))
+    species = job.run()
+    assert species == {
+        'Na': {'chebi': [{'id': 'chebi:0'}, {'id': 'chebi:1'}],
+               'uniprot': [{'id': 'uniprot:0'}, {'id': 'uniprot:1'}]},
+        'glucose': {'chebi': [{'id': 'chebi:%d' % i} for i in range(5)],
+                    'uniprot': [{'id': 'uniprot:%d' % i} for i in range(5)]},
+    }
+    # once per search, duplicates searched once
+    assert reports == [(done, 4) for done in range(1, 5)]
+    assert sorted(services.searches) == sorted((name, database) for name in ('Na', 'glucose')
+                                               for database in ('chebi', 'uniprot'))
+    assert job.errors == 0 and not job.cancelled
+
+
+def test_no_candidates():
+    services = Services(found={'ATP': 1}, failing={'K'})
+    job = AutoAnnotateJob(services, ['x', 'K', 'ATP'], databases=('chebi',))
+    # names without candidates are left out, whether nothing was found or the search failed
+    assert job.run() == {'ATP': {'chebi': [{'id': 'chebi:0'}]}}
+    assert job.errors == 1
+
+
+def test_cancel():
+    services = Services(found={name: 1 for name in 'ABCDE'})
+    reports = list()
+
+    def progress(done, total):
+        reports.append(done)
+        job.cancel()
+
+    job = AutoAnnotateJob(services, list('ABCDE'), databases=('chebi',), max_workers=1,
+                          progress=progress)
+    species = job.run()
+    # the searches after the cancellation are not made, the candidates found are returned
+    assert job.cancelled and reports == [1]
+    assert services.searches == [('A', 'chebi')]
+    assert species == {'A': {'chebi': [{'id': 'chebi:0'}]}}
@@ -0,0 +1,69 @@
+"""Tests of the TTL cache shared by the server features.
+"""
+
+from stibium_server.cache import TTLCache
+
+import threading
+import time
+
+
+def test_get_and_put():
+    cache = TTLCache()
+    assert cache.get('a') is None and cache.get('a', 1) == 1
+    cache.put('a', None)
+    # a cached None is not a miss
+    assert 'a' in cache and cache.get('a', 1) is None
+    cache.put('a', 2)
+    assert cache.get('a') == 2 and len(cache) == 1
+
+
+def test_least_recently_used_are_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert 'a' in cache and 'b' not in cache and 'c' in cache
+    assert len(cache) == 2
+
+
+def test_zero_size_caches_nothing():
+    cache = TTLCache(maxsize=0)
+    cache.put('a', 1)
+    assert 'a' not in cache and len(cache) == 0
+
+
+def test_entries_expire():
+    cache = TTLCache(ttl=0.05)
+    cache.put('a', 1)
+    cache.put('b', 2, ttl=10)
+    assert cache.get('a') == 1
+    time.sleep(0.06)
+    assert cache.get('a') is None and cache.get('b') == 2
+    # expired entries are dropped when read
+    assert len(cache) == 1
+
+
+def test_pop_and_clear():
+    cache = TTLCache()
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.pop('a') == 1 and cache.pop('a', 'gone') == 'gone'
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_concurrent_use():
+    cache = TTLCache(maxsize=50)
+
+    def work(offset):
+        for i in range(2000):
+            cache.put(offset + i % 100, i)
+            cache.get(offset + (i * 7) % 100)
+
+    threads = [threading.Thread(target=work, args=(offset,)) for offset in (0, 1000, 2000, 3000)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) == 50
@@ -0,0 +1,113 @@
+"""Tests of the code lenses over the species and reactions.
+"""
+
+import pytest
+
+pytest.importorskip('stibium.api')
+
+import main
+from main import _lens_title, code_lens, resolve_code_lens
+from stibium_server.cache import TTLCache
+from stibium_server.symindex import SymbolIndex
+from stibium_server.utils import LineIndex
+
+from stibium.types import SrcPosition, SrcRange
+
+from pygls.protocol import deserialize_message
+from pygls.types import CodeLens, CodeLensParams, TextDocumentIdentifier, TextDocumentItem
+from pygls.workspace import Workspace
+from types import SimpleNamespace
+
+
+URI = 'file:///m.ant'
+TEXT = 'J1: S1 -> S2; k*S1\nk = 1\n'
+# (name, type, annotations, spans) of the symbols of TEXT
+SYMBOLS = [
+    ('J1', 'Reaction', (), [(1, 1, 1, 3)]),
+    ('S1', 'Species', ('http://identifiers.org/chebi/CHEBI:17234',), [(1, 5, 1, 7), (1, 17, 1, 19)]),
+    ('S2', 'Species', (), [(1, 11, 1, 13)]),
+    ('k', 'Parameter', (), [(1, 15, 1, 16), (2, 1, 2, 2)]),
+]
+
+
+def build(symbols):
+    index = SymbolIndex()
+    for name, type_, annotations, spans in symbols:
+        record = index.add_symbol(name, '', type_, annotations)
+        for line, column, end_line, end_column in spans:
+            index.add_occurrence(record, SrcRange(SrcPosition(line, column),
+                                                  SrcPosition(end_line, end_column)))
+    index.freeze()
+    return index
+
+
+class Analyses:
+    '''Stands in for antfile_cache: the symbols of each version of the document are given'''
+    def __init__(self, symbols_by_version):
+        self.symbols_by_version = symbols_by_version
+        self.analyzed = list()
+
+    def get(self, document, source=None):
+        self.analyzed.append(document.version)
+        return SimpleNamespace(index=build(self.symbols_by_version[document.version]),
+                               lines=LineIndex(document.source))
+
+
+@pytest.fixture
+def analyses(monkeypatch):
+    analyses = Analyses({1: SYMBOLS, 2: SYMBOLS[:1] + SYMBOLS[2:]})
+    monkeypatch.setattr(main.server.lsp, 'workspace', Workspace('file:///'))
+    monkeypatch.setattr(main, 'antfile_cache', analyses)
+    monkeypatch.setattr(main, 'code_lenses', TTLCache(maxsize=32))
+    monkeypatch.setattr(main, 'code_lens_titles', TTLCache(maxsize=4096))
+    open_version(1)
+    return analyses
+
+
+def open_version(version):
+    main.server.workspace.put_document(TextDocumentItem(URI, 'antimony', version, TEXT))
+
+
+def lenses():
+    return code_lens(CodeLensParams(TextDocumentIdentifier(URI)))
+
+
+def resolve(lens):
+    # as the client sends it back
+    return resolve_code_lens(CodeLens(lens.range, data=deserialize_message(lens.data))).command.title
+
+
+def test_lens_title():
+    index = build(SYMBOLS + [('S3', 'Species', ('a', 'b'), [(3, 1, 3, 3), (4, 1, 4, 3),
+                                                            (5, 1, 5, 3)])])
+    assert _lens_title(index, index.get('S1')) == '1 reference | annotated (1)'
+    assert _lens_title(index, index.get('S2')) == '0 references | not annotated'
+    assert _lens_title(index, index.get('S3')) == '2 references | annotated (2)'
+
+
+def test_lenses_are_cached_by_version(analyses):
+    first = lenses()
+    assert [lens.data['name'] for lens in first] == ['J1', 'S1', 'S2']
+    assert (first[1].range.start.line, first[1].range.start.character) == (0, 4)
+    assert lenses() is first and analyses.analyzed == [1]
+    open_version(2)
+    second = lenses()
+    assert [lens.data['name'] for lens in second] == ['J1', 'S2']
+    assert analyses.analyzed == [1, 2]
+
+
+def test_resolve(analyses):
+    first = lenses()
+    assert resolve(first[1]) == '1 reference | annotated (1)'
+    assert resolve(first[1]) == '1 reference | annotated (1)'
+    # the title is cached for the version
+    assert analyses.analyzed == [1, 1]
+
+
+def test_resolve_after_edit(analyses):
+    s1 = lenses()[1]
+    # S1 is gone from the version the lens is resolved against
+    open_version(2)
+    assert resolve(s1) == '0 references'
+    # the title of an outdated lens is not cached
+    assert len(main.code_lens_titles) == 0
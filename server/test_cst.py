@@ -0,0 +1,109 @@
+"""Tests of the compact concrete syntax tree.
+"""
+
+from stibium_server.cst import CompactTree, CompactTreeBuilder
+
+from lark import Lark, Token, Tree
+
+
+GRAMMAR = r'''
+root: stmt*
+stmt: NAME "=" expr ";"
+?expr: NAME | NUMBER | call | expr OP expr
+call: NAME "(" [expr ("," expr)*] ")"
+OP: "+" | "*"
+%import common.CNAME -> NAME
+%import common.NUMBER
+%import common.WS
+%ignore WS
+'''
+SOURCE = 'a = f(b, 2) + c;\nx = 1;\n'
+
+
+def parse(source=SOURCE):
+    return Lark(GRAMMAR, start='root', parser='lalr', keep_all_tokens=True).parse(source)
+
+
+def shape(tree, source):
+    '''(kind, text, children) of a lark tree, as a CompactTree should have it'''
+    if isinstance(tree, Token):
+        return (tree.type, str(tree), ())
+    children = tuple(shape(child, source) for child in tree.children)
+    tokens = [child for child in tree.scan_values(lambda value: isinstance(value, Token))]
+    text = source[tokens[0].pos_in_stream:tokens[-1].end_pos] if tokens else ''
+    return (tree.data, text, children)
+
+
+def view_shape(node):
+    return (node.kind, node.text, tuple(view_shape(child) for child in node.children))
+
+
+def test_from_lark():
+    lark_tree = parse()
+    tree = CompactTree.from_lark(lark_tree, SOURCE)
+    assert view_shape(tree.root) == shape(lark_tree, SOURCE)
+    assert len(tree) == len(list(lark_tree.iter_subtrees())) + \
+        len(list(lark_tree.scan_values(lambda value: isinstance(value, Token))))
+
+
+def test_parents_and_tokens():
+    tree = CompactTree.from_lark(parse(), SOURCE)
+    assert tree.root.parent is None
+    for i in range(1, len(tree)):
+        node = tree.node(i)
+        assert node in node.parent.children
+    call = next(tree.nodes_of_kind('call'))
+    assert [token.text for token in call.tokens()] == ['f', '(', 'b', ',', '2', ')']
+    assert [token.text for token in tree.root.tokens()][-4:] == ['x', '=', '1', ';']
+    assert list(tree.nodes_of_kind('missing')) == []
+
+
+def test_node_at():
+    tree = CompactTree.from_lark(parse(), SOURCE)
+    offset = SOURCE.index('b')
+    assert tree.token_at(offset).text == 'b'
+    assert tree.node_at(offset).parent.kind == 'call'
+    # whitespace between the tokens of a call
+    assert tree.token_at(offset + 2) is None
+    assert tree.node_at(offset + 2).kind == 'call'
+    # before the first token and after the last
+    assert tree.node_at(len(SOURCE) - 1) is None
+    assert tree.node_at(-1) is None
+
+
+def test_builder():
+    source = 'model m\n  x = 1\nend\n'
+    builder = CompactTreeBuilder(source)
+    builder.open('model')
+    builder.token('MODEL', 0, 5)
+    builder.token('NAME', 6, 7)
+    builder.open('stmt')
+    builder.token('NAME', 10, 11)
+    builder.token('NUMBER', 14, 15)
+    builder.finish()
+    # an empty node takes its end as its start
+    builder.open('annotations')
+    builder.finish(end=15)
+    builder.token('END', 16, 19)
+    tree = builder.build()
+    assert view_shape(tree.root) == ('model', 'model m\n  x = 1\nend', (
+        ('MODEL', 'model', ()), ('NAME', 'm', ()),
+        ('stmt', 'x = 1', (('NAME', 'x', ()), ('NUMBER', '1', ()))),
+        ('annotations', '', ()),
+        ('END', 'end', ())))
+    assert tree.kinds.count('NAME') == 1
+
+
+def test_deep_trees():
+    depth = 5000
+    source = 'x' * depth
+    tree = Tree('root', [])
+    node = tree
+    for i in range(depth):
+        child = Tree('nest', [Token('X', 'x', pos_in_stream=i, end_pos=i + 1)])
+        node.children.append(child)
+        node = child
+    compact = CompactTree.from_lark(tree, source)
+    assert len(compact) == 2 * depth + 1
+    assert compact.root.end == depth
+    assert compact.node_at(depth - 1).text == 'x'
@@ -0,0 +1,168 @@
+"""Tests of the background workspace indexer and its symbol extraction.
+"""
+
+import pytest
+
+pytest.importorskip('stibium.api')
+
+from stibium_server.indexer import WorkspaceIndexer, extract_symbols, outline
+
+import os
+import threading
+import time
+
+
+MODEL = '''// a model
+model *cell()
+  compartment C; species S1 in C, $S2
+  J1: S1 + E -> S2; k1*S1*E; k1 = 0.1
+  S1 identity "http://identifiers.org/chebi/CHEBI:17234"
+  const k2 = 3
+end
+function f(x)
+  x^2
+end
+top = 1
+'''
+
+
+def by_name(symbols):
+    return {(symbol.scope, symbol.name): symbol for symbol in symbols}
+
+
+def test_outline():
+    tree = outline('model m()\n  a = 1; S1 -> S2; k*S1\nend\nb = 2\n')
+    assert [node.kind for node in tree.root.children] == ['model', 'statement']
+    model = tree.root.children[0]
+    statements = [node.text for node in model.children if node.kind == 'statement']
+    # the semicolon after the arrow separates the rate law, not the statements
+    assert statements == ['model m()', 'a = 1;', 'S1 -> S2; k*S1']
+
+
+def test_extract_symbols():
+    symbols = by_name(extract_symbols(MODEL))
+    assert {key: symbol.kind for key, symbol in symbols.items()} == {
+        ('', 'cell'): 'Model', ('cell', 'C'): 'Compartment', ('cell', 'S1'): 'Species',
+        ('cell', 'S2'): 'Species', ('cell', 'J1'): 'Reaction', ('cell', 'E'): 'Species',
+        ('cell', 'k1'): 'Parameter', ('cell', 'k2'): 'Parameter', ('', 'f'): 'Function',
+        ('', 'top'): 'Parameter'}
+    assert symbols[('cell', 'S1')].annotations == ('http://identifiers.org/chebi/CHEBI:17234',)
+    # the range of the first occurrence, in LSP coordinates
+    assert symbols[('cell', 'S1')].range == (2, 25, 2, 27)
+    assert symbols[('', 'cell')].range == (1, 7, 1, 11)
+
+
+def wait_for(condition, timeout=5.):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+class Listener:
+    def __init__(self):
+        self.events = list()
+        self.lock = threading.Lock()
+
+    def __call__(self, path, symbols):
+        with self.lock:
+            self.events.append((os.path.basename(path), None if symbols is None else
+                                sorted(symbol.name for symbol in symbols)))
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    root = tmp_path / 'workspace'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'node_modules').mkdir()
+    (root / 'a.ant').write_text('a = 1\n')
+    (root / 'sub' / 'b.ant').write_text('model b()\nend\n')
+    (root / 'node_modules' / 'c.ant').write_text('c = 1\n')
+    (root / 'notes.txt').write_text('d = 1\n')
+    return root
+
+
+def test_scan_and_file_events(workspace, tmp_path):
+    indexer = WorkspaceIndexer(str(tmp_path / 'index.json'), pause=0)
+    listener = Listener()
+    indexer.add_listener(listener)
+    indexer.start([str(workspace)])
+    wait_for(lambda: len(indexer.files) == 2)
+    assert sorted(listener.events) == [('a.ant', ['a']), ('b.ant', ['b'])]
+
+    path = str(workspace / 'a.ant')
+    (workspace / 'a.ant').write_text('a = 1\nz = 2\n')
+    indexer.enqueue(path)
+    wait_for(lambda: len(indexer.symbols(path)) == 2)
+    os.remove(path)
+    indexer.enqueue(path)
+    wait_for(lambda: not indexer.symbols(path))
+    assert listener.events[-1] == ('a.ant', None)
+
+
+def test_open_documents(workspace, tmp_path):
+    indexer = WorkspaceIndexer(str(tmp_path / 'index.json'), pause=0)
+    indexer.start([str(workspace)])
+    wait_for(lambda: len(indexer.files) == 2)
+    path = str(workspace / 'a.ant')
+    indexer.update_text(path, 'unsaved = 1\n')
+    # the open document takes precedence over the file
+    indexer.enqueue(path)
+    time.sleep(0.05)
+    assert [symbol.name for symbol in indexer.symbols(path)] == ['unsaved']
+    indexer.close(path)
+    wait_for(lambda: [symbol.name for symbol in indexer.symbols(path)] == ['a'])
+
+
+def test_close_before_start(tmp_path):
+    indexer = WorkspaceIndexer(str(tmp_path / 'index.json'), pause=0)
+    listener = Listener()
+    indexer.add_listener(listener)
+    path = str(tmp_path / 'a.ant')
+    indexer.update_text(path, 'unsaved = 1\n')
+    indexer.close(path)
+    # nothing would index the file, so the document is forgotten and nothing is queued
+    assert not indexer._queue and not indexer.symbols(path)
+    assert listener.events == [('a.ant', ['unsaved']), ('a.ant', None)]
+    indexer.close(str(tmp_path / 'other.ant'))
+    assert not indexer._queue
+
+
+def test_document_opened_while_indexed(workspace, tmp_path, monkeypatch):
+    indexer = WorkspaceIndexer(str(tmp_path / 'index.json'), pause=0)
+    path = str(workspace / 'a.ant')
+    import stibium_server.indexer as module
+
+    def extract(text):
+        if text == 'a = 1\n':
+            # the document is opened while its file is extracted
+            monkeypatch.setattr(module, 'extract_symbols', extract_symbols)
+            indexer.update_text(path, 'unsaved = 1\n')
+        return extract_symbols(text)
+
+    monkeypatch.setattr(module, 'extract_symbols', extract)
+    indexer._index_file(os.path.normcase(path))
+    assert [symbol.name for symbol in indexer.symbols(path)] == ['unsaved']
+
+
+def test_saved_index_is_reused(workspace, tmp_path, monkeypatch):
+    index_path = str(tmp_path / 'index.json')
+    indexer = WorkspaceIndexer(index_path, pause=0)
+    indexer.start([str(workspace)])
+    wait_for(lambda: len(indexer.files) == 2)
+    indexer._save()
+
+    extracted = list()
+    import stibium_server.indexer as module
+    monkeypatch.setattr(module, 'extract_symbols',
+                        lambda text: extracted.append(text) or extract_symbols(text))
+    # touched but not changed, changed, and unchanged
+    os.utime(str(workspace / 'a.ant'), ns=(0, 0))
+    (workspace / 'sub' / 'b.ant').write_text('model b2()\nend\n')
+    restarted = WorkspaceIndexer(index_path, pause=0)
+    listener = Listener()
+    restarted.add_listener(listener)
+    restarted.start([str(workspace)])
+    wait_for(lambda: ('b.ant', ['b2']) in listener.events)
+    assert extracted == ['model b2()\nend\n']
+    assert [symbol.name for symbol in restarted.symbols(str(workspace / 'a.ant'))] == ['a']
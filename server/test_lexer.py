@@ -0,0 +1,72 @@
+"""Tests of the fast lexer: relex() must agree with lexing the edited text from scratch.
+"""
+
+from stibium_server.lexer import COMMENT, NAME, NEWLINE, NUMBER, OP, lex, relex
+
+import random
+
+
+# fragments that edits and texts are made of, biased towards the ones that change the tokens
+# around them: line ends, comment and string delimiters, escapes, and pieces of numbers
+FRAGMENTS = ('', '\n', '\r\n', '\r', 'x', 'ab', ' ', '->', '/*', '*/', '/* ', ' */', '*/\n', '"',
+             '\\', '\\"', '//', '#', '1', '.5e', 'e3', '\nA = 1;\n', '"s"', 'model m\n', ';')
+
+
+def tokens_of(tokens, text):
+    return [(kind, text[start:end]) for kind, start, end in tokens]
+
+
+def edit(text, start, old_end, insert):
+    return text[:start] + insert + text[old_end:], start + len(insert)
+
+
+def test_relex_extends_unterminated_comment():
+    text = 'A = 1\n/* note\n'
+    new_text, new_end = edit(text, 14, 14, 'more')
+    tokens = relex(lex(text), new_text, 14, 14, new_end)
+    assert tokens_of(tokens, new_text)[-1] == (COMMENT, '/* note\nmore')
+    assert list(tokens) == list(lex(new_text))
+
+
+def test_relex_newline_after_unterminated_comment():
+    text = 'mo/*l end1()\n\r\n'
+    new_text, new_end = edit(text, 15, 15, '\r\n')
+    assert list(relex(lex(text), new_text, 15, 15, new_end)) == list(lex(new_text))
+
+
+def test_relex_terminating_comment_relexes_rest():
+    text = 'a /* x\ny\nz = 1\n'
+    new_text, new_end = edit(text, 6, 6, ' */')
+    tokens = relex(lex(text), new_text, 6, 6, new_end)
+    assert (NAME, 'y') in tokens_of(tokens, new_text)
+    assert list(tokens) == list(lex(new_text))
+
+
+def test_relex_reuses_tokens_after_edit():
+    text = ''.join('S{0} = {0}\n'.format(i) for i in range(100))
+    tokens = lex(text)
+    new_text, new_end = edit(text, 0, 2, 'glucose')
+    relexed = relex(tokens, new_text, 0, 2, new_end)
+    assert list(relexed) == list(lex(new_text))
+    assert tokens_of(relexed, new_text)[0] == (NAME, 'glucose')
+    assert tokens_of(relexed, new_text)[-4:] == [(NAME, 'S99'), (OP, '='), (NUMBER, '99'),
+                                                 (NEWLINE, '\n')]
+
+
+def test_relex_matches_lex_on_random_edits():
+    rng = random.Random(0)
+
+    def fragments(count):
+        return ''.join(rng.choice(FRAGMENTS) for _ in range(count))
+
+    for _ in range(5000):
+        text = fragments(rng.randint(0, 12))
+        tokens = lex(text)
+        for _ in range(4):
+            start = rng.randint(0, len(text))
+            old_end = min(len(text), start + rng.randint(0, 4))
+            new_text, new_end = edit(text, start, old_end, fragments(rng.randint(0, 3)))
+            tokens = relex(tokens, new_text, start, old_end, new_end)
+            assert list(tokens) == list(lex(new_text)), (text, start, old_end, new_text)
+            text = new_text
+
@@ -0,0 +1,69 @@
+"""Tests of LineIndex: conversions between offsets, LSP positions (UTF-16 columns) and stibium
+positions (code point columns).
+"""
+
+import pytest
+
+pytest.importorskip('stibium.types')
+
+from stibium_server.utils import LineIndex
+
+from pygls.types import Position
+from stibium.types import SrcPosition, SrcRange
+
+
+# 𝑥 (U+1D465) is outside the BMP: one code point, two UTF-16 code units
+TEXT = 'a = 1\n𝑥 = 𝑥𝑥 + b\n\nc = "é"\n'
+
+
+def utf16_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def test_lines():
+    lines = LineIndex(TEXT)
+    assert len(lines) == 5
+    assert lines.position(0) == Position(0, 0)
+    assert lines.position(len(TEXT)) == Position(4, 0)
+    assert lines.offset(Position(2, 0)) == TEXT.index('\n\n') + 1
+
+
+def test_round_trips():
+    lines = LineIndex(TEXT)
+    for offset in range(len(TEXT) + 1):
+        position = lines.position(offset)
+        line_start = TEXT.rfind('\n', 0, offset) + 1
+        assert position.character == utf16_length(TEXT[line_start:offset])
+        assert lines.offset(position) == offset
+        srcpos = lines.sb_position(position)
+        assert srcpos.column == offset - line_start + 1
+        assert lines.pygls_position(srcpos) == position
+
+
+def test_utf16_columns():
+    lines = LineIndex(TEXT)
+    # b on the second line is after three astral characters
+    column = '𝑥 = 𝑥𝑥 + b'.index('b')
+    assert lines.utf16_column(1, column) == column + 3
+    assert lines.code_point_column(1, column + 3) == column
+    # é is in the BMP
+    assert lines.utf16_column(3, 6) == 6
+    # between the two halves of a surrogate pair
+    assert lines.code_point_column(1, 1) == 1
+    assert lines.code_point_column(1, 6) == 5
+
+
+def test_ranges():
+    lines = LineIndex(TEXT)
+    start = TEXT.index('b')
+    assert lines.lsp_range(start, start + 1) == (1, 12, 1, 13)
+    assert lines.lsp_span((2, 10, 2, 11)) == (1, 12, 1, 13)
+    # 𝑥𝑥
+    srcrange = SrcRange(SrcPosition(2, 5), SrcPosition(2, 7))
+    lsp = lines.pygls_range(srcrange)
+    assert (lsp.start, lsp.end) == (Position(1, 5), Position(1, 9))
+
+
+def test_positions_past_the_end():
+    lines = LineIndex('ab\ncd')
+    assert lines.offset(Position(7, 1)) == 4
@@ -0,0 +1,130 @@
+"""Tests of the in-memory ChEBI ontology graph.
+"""
+
+from stibium_server.ontology import ChEBIOntology, OntologyGraph
+
+import gzip
+
+
+OBO = '''format-version: 1.2
+ontology: chebi
+
+[Term]
+id: CHEBI:24431
+name: chemical entity
+
+[Term]
+id: CHEBI:23367
+name: molecular entity
+is_a: CHEBI:24431 ! chemical entity
+
+[Term]
+id: CHEBI:16646
+name: carbohydrate
+is_a: CHEBI:23367 ! molecular entity
+relationship: has_role CHEBI:78295 ! food component
+
+[Term]
+id: CHEBI:17234
+name: glucose
+is_a: CHEBI:16646 ! carbohydrate
+
+[Term]
+id: CHEBI:99999
+name: withdrawn
+is_obsolete: true
+is_a: CHEBI:16646
+
+[Typedef]
+id: has_role
+name: has role
+'''
+
+
+def load(tmp_path, text=OBO, name='chebi.obo'):
+    path = tmp_path / name
+    if name.endswith('.gz'):
+        with gzip.open(str(path), 'wt', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        path.write_text(text, encoding='utf-8')
+    graph = OntologyGraph()
+    graph.load_obo(str(path))
+    return graph
+
+
+def test_load_obo(tmp_path):
+    graph = load(tmp_path)
+    assert len(graph) == 4 and 'CHEBI:99999' not in graph
+    assert graph.names['CHEBI:17234'] == 'glucose'
+    assert graph.parents('CHEBI:16646') == [('CHEBI:23367', 'is a'), ('CHEBI:78295', 'has role')]
+    assert graph.parents('CHEBI:16646', ['has role']) == [('CHEBI:78295', 'has role')]
+    assert graph.children('CHEBI:16646') == [('CHEBI:17234', 'is a')]
+    assert graph.is_complete('CHEBI:17234') and not graph.is_complete('CHEBI:78295')
+
+
+def test_load_gzipped_obo(tmp_path):
+    assert len(load(tmp_path, name='chebi.obo.gz')) == 4
+
+
+def test_ancestors_and_descendants(tmp_path):
+    graph = load(tmp_path)
+    assert graph.ancestors('CHEBI:17234') == ['CHEBI:16646', 'CHEBI:23367', 'CHEBI:24431']
+    assert graph.ancestors('CHEBI:17234', relations=('is a', 'has role')) == \
+        ['CHEBI:16646', 'CHEBI:23367', 'CHEBI:78295', 'CHEBI:24431']
+    assert graph.descendants('CHEBI:24431') == ['CHEBI:23367', 'CHEBI:16646', 'CHEBI:17234']
+
+
+def test_cycles():
+    graph = OntologyGraph()
+    graph.add_edge('A', 'B', 'is a')
+    graph.add_edge('B', 'C', 'is a')
+    graph.add_edge('C', 'A', 'is a')
+    assert graph.ancestors('A') == ['B', 'C']
+
+
+class Services:
+    '''Stands in for WebServices.chebi_ontology: a chain CHEBI:0 <- CHEBI:1 <- ...'''
+    def __init__(self, length=200):
+        self.length = length
+        self.fetched = list()
+
+    def chebi_ontology(self, chebi_id):
+        self.fetched.append(chebi_id)
+        number = int(chebi_id.split(':')[1])
+        if number >= self.length:
+            return None
+        parents = [('CHEBI:{}'.format(number - 1), 'p{}'.format(number - 1), 'is a')] \
+            if number else []
+        children = [('CHEBI:{}'.format(number + 1), 'p{}'.format(number + 1), 'is a')] \
+            if number + 1 < self.length else []
+        return {'id': chebi_id, 'name': 'p{}'.format(number), 'parents': parents,
+                'children': children}
+
+
+def test_nodes_are_fetched_once():
+    services = Services()
+    ontology = ChEBIOntology(services)
+    assert ontology.broader('CHEBI:5') == \
+        [{'id': 'CHEBI:4', 'name': 'p4', 'prefix': 'chebi', 'relation': 'is a'}]
+    assert [item['id'] for item in ontology.narrower('CHEBI:5')] == ['CHEBI:6']
+    assert services.fetched == ['CHEBI:5']
+    ontology.ancestors('CHEBI:5')
+    assert services.fetched == ['CHEBI:{}'.format(i) for i in range(5, -1, -1)]
+
+
+def test_unknown_ids_are_not_fetched_again():
+    services = Services(length=1)
+    ontology = ChEBIOntology(services)
+    assert ontology.broader('CHEBI:7') == []
+    assert ontology.broader('CHEBI:7') == []
+    assert services.fetched == ['CHEBI:7']
+
+
+def test_queries_fetch_a_bounded_number_of_nodes():
+    services = Services()
+    ontology = ChEBIOntology(services)
+    descendants = ontology.descendants('CHEBI:0')
+    assert len(services.fetched) == ChEBIOntology.MAX_FETCH
+    # the children of the last node fetched are known, but not fetched
+    assert descendants == ['CHEBI:{}'.format(i) for i in range(1, ChEBIOntology.MAX_FETCH + 1)]
@@ -0,0 +1,120 @@
+"""Tests of the background prefetch of annotation candidates.
+"""
+
+import pytest
+
+pytest.importorskip('stibium.types')
+
+import stibium_server.prefetch as prefetch
+from stibium_server.prefetch import Prefetcher, unannotated_species_names
+from stibium_server.symindex import SymbolIndex
+from stibium_server.webservices import NetworkError
+
+import threading
+import time
+
+
+class Services:
+    '''Stands in for WebServices; the searches of names in failing raise a NetworkError'''
+    def __init__(self, cached=(), failing=()):
+        self.cached = set(cached)
+        self.failing = set(failing)
+        self.prefetched = list()
+        self.lock = threading.Lock()
+
+    def is_cached(self, database, query):
+        return query in self.cached
+
+    def prefetch(self, database, query):
+        with self.lock:
+            self.prefetched.append((database, query))
+        if query in self.failing:
+            raise NetworkError()
+
+
+def wait_for(condition, timeout=5.):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def species_index(*names):
+    index = SymbolIndex()
+    for name in names:
+        index.add_symbol(name, '', 'Species')
+    index.freeze()
+    return index
+
+
+def test_unannotated_species_names():
+    index = SymbolIndex()
+    for name, type_, annotations in [('glucose', 'Species', ()), ('Na', 'Species', ()),
+                                     ('ATP', 'Species', ('chebi/15422',)), ('k1', 'Parameter', ()),
+                                     ('O2', 'Species', ())]:
+        index.add_symbol(name, '', type_, annotations)
+    index.freeze()
+    # the prefetcher skips the short names, the auto-annotation searches them all
+    assert unannotated_species_names(index) == ['glucose']
+    assert unannotated_species_names(index, min_length=0) == ['glucose', 'Na', 'O2']
+
+
+def test_disabled_until_enabled():
+    services = Services()
+    prefetcher = Prefetcher(services, rate=1000, idle_delay=0)
+    prefetcher.prefetch_document(species_index('glucose'))
+    prefetcher.enqueue(['glucose'])
+    assert not prefetcher._queue and prefetcher._thread is None
+    prefetcher.enable()
+    prefetcher.prefetch_document(species_index('glucose'))
+    wait_for(lambda: len(services.prefetched) == 2)
+    prefetcher.disable()
+    prefetcher.enqueue(['water'])
+    time.sleep(0.05)
+    assert services.prefetched == [('chebi', 'glucose'), ('uniprot', 'glucose')]
+
+
+def test_queue(monkeypatch):
+    monkeypatch.setattr(prefetch, 'MAX_QUEUED', 5)
+    services = Services(cached={'ATP'})
+    prefetcher = Prefetcher(services, rate=1000, idle_delay=60)
+    prefetcher.enable()
+    # held off, so that the queue fills up
+    prefetcher.defer()
+    prefetcher.enqueue(['glucose', ' Glucose', 'ATP', 'water', 'pyruvate', 'lactate'])
+    # duplicates and cached searches are not queued, and names past MAX_QUEUED are dropped
+    assert list(prefetcher._queue) == [('chebi', 'glucose'), ('uniprot', 'glucose'),
+                                       ('chebi', 'water'), ('uniprot', 'water'),
+                                       ('chebi', 'pyruvate')]
+    prefetcher.disable()
+    assert not prefetcher._queue
+    assert services.prefetched == []
+
+
+def test_rate():
+    services = Services()
+    prefetcher = Prefetcher(services, databases=('chebi',), rate=20, idle_delay=0)
+    start = time.monotonic()
+    prefetcher.enable()
+    prefetcher.enqueue(['a1', 'a2', 'a3', 'a4', 'a5'])
+    wait_for(lambda: len(services.prefetched) == 5)
+    # in order, one token at a time after the first
+    assert [name for _, name in services.prefetched] == ['a1', 'a2', 'a3', 'a4', 'a5']
+    assert time.monotonic() - start >= 0.19
+
+
+def test_defer():
+    services = Services(failing={'glucose'})
+    prefetcher = Prefetcher(services, databases=('chebi',), rate=1000, idle_delay=0.3)
+    prefetcher.enable()
+    start = time.monotonic()
+    # a search of the user holds off prefetching for idle_delay
+    prefetcher.defer()
+    prefetcher.enqueue(['glucose', 'water'])
+    wait_for(lambda: len(services.prefetched) == 1)
+    assert time.monotonic() - start >= 0.3
+    # so does a network error
+    time.sleep(0.15)
+    assert services.prefetched == [('chebi', 'glucose')]
+    wait_for(lambda: len(services.prefetched) == 2)
+    assert time.monotonic() - start >= 0.6
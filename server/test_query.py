@@ -0,0 +1,62 @@
+"""Tests of the antimony.sendQuery command.
+"""
+
+import pytest
+
+pytest.importorskip('stibium.api')
+
+import main
+from main import PARTIAL_RESULTS_EVERY, query_species
+
+from types import SimpleNamespace
+
+
+class Client:
+    '''Stands in for the LanguageServer; records the notifications as they are sent, and how
+    many results services had sent by then'''
+    def __init__(self, services):
+        self.services = services
+        self.notifications = list()
+        self.received = list()
+
+    def send_notification(self, method, params=None):
+        self.notifications.append((method, dict(params, items=list(params['items']))))
+        self.received.append(self.services.received)
+
+
+class Services:
+    '''Stands in for WebServices, with count UniProt results for any query'''
+    def __init__(self, count):
+        self.count = count
+        self.received = 0
+
+    def iter_search_uniprot(self, query, page=0):
+        for i in range(self.count):
+            self.received += 1
+            yield {'id': 'P{:05}'.format(i)}
+
+    def has_more_uniprot(self, query, page=0):
+        return True
+
+
+def test_partial_results(monkeypatch):
+    count = 2 * PARTIAL_RESULTS_EVERY + 3
+    services = Services(count)
+    monkeypatch.setattr(main, 'services', services)
+    monkeypatch.setattr(main, 'prefetcher', SimpleNamespace(defer=lambda: None))
+    client = Client(services)
+    result = query_species(client, ['uniprot', 'kinase', 1])
+    ids = ['P{:05}'.format(i) for i in range(count)]
+    assert [item['id'] for item in result['items']] == ids
+    assert result['page'] == 1 and result['has_more']
+    # after the first result, then every PARTIAL_RESULTS_EVERY results, each with all the
+    # results so far, in order
+    sizes = [1, PARTIAL_RESULTS_EVERY + 1, 2 * PARTIAL_RESULTS_EVERY + 1]
+    assert [method for method, _ in client.notifications] == \
+        ['antimony/queryPartialResults'] * len(sizes)
+    assert [[item['id'] for item in params['items']] for _, params in client.notifications] == \
+        [ids[:size] for size in sizes]
+    assert all(params['query'] == 'kinase' and params['page'] == 1
+               for _, params in client.notifications)
+    # sent while the other results are still being received
+    assert client.received == sizes
@@ -0,0 +1,55 @@
+"""Tests of the local ranking of annotation candidates.
+"""
+
+from stibium_server.ranking import rank_chebi, score_candidate
+
+from types import SimpleNamespace
+
+
+def entity(chebi_id, name, stars=0, search_score=0.):
+    return SimpleNamespace(chebiId=chebi_id, chebiAsciiName=name, entityStar=stars,
+                           searchScore=search_score)
+
+
+def test_exact_then_prefix_then_substring():
+    scores = [score_candidate('glucose', name)
+              for name in ('glucose', 'glucose 6-phosphate', 'D-glucose', 'fructose')]
+    assert scores == sorted(scores, reverse=True)
+    assert len(set(scores)) == 4
+
+
+def test_case_and_whitespace_are_ignored():
+    assert score_candidate(' ATP ', 'atp') == score_candidate('atp', 'atp')
+
+
+def test_names_with_fewer_other_words_first():
+    assert score_candidate('alpha glucose', 'alpha-D-glucose') > \
+        score_candidate('alpha glucose', 'alpha-D-glucose 1-phosphate dipotassium salt')
+
+
+def test_stars_and_search_score_break_ties():
+    assert score_candidate('atp', 'ATP', stars=3) > score_candidate('atp', 'ATP', stars=2)
+    assert score_candidate('atp', 'ATP', search_score=2.) > \
+        score_candidate('atp', 'ATP', search_score=1.)
+
+
+def test_rank_chebi():
+    entities = [
+        entity('CHEBI:4167', 'D-glucopyranose', stars=3, search_score=5.),
+        entity('CHEBI:17234', 'glucose', stars=3, search_score=3.),
+        entity('CHEBI:4170', 'D-glucose 6-phosphate', stars=3, search_score=4.),
+    ]
+    ranked = rank_chebi('glucose', entities)
+    assert [item['id'] for item in ranked] == ['CHEBI:17234', 'CHEBI:4170', 'CHEBI:4167']
+    assert ranked[0] == {'id': 'CHEBI:17234', 'name': 'glucose', 'prefix': 'chebi'}
+
+
+def test_rank_chebi_keeps_the_service_order_of_equal_scores():
+    entities = [entity('CHEBI:{}'.format(i), 'glucose') for i in range(5)]
+    assert [item['id'] for item in rank_chebi('glucose', entities)] == \
+        ['CHEBI:{}'.format(i) for i in range(5)]
+
+
+def test_rank_chebi_without_star_or_score():
+    ranked = rank_chebi('atp', [SimpleNamespace(chebiId='CHEBI:15422', chebiAsciiName='ATP')])
+    assert ranked == [{'id': 'CHEBI:15422', 'name': 'ATP', 'prefix': 'chebi'}]
@@ -0,0 +1,150 @@
+"""Tests of the token-bucket rate limiter shared by the web services.
+"""
+
+from stibium_server.bioservices.ratelimit import TokenBucket, get_limiter, submit_throttled
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+
+def test_burst_then_rate():
+    bucket = TokenBucket(rate=20, capacity=3)
+    start = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.04
+    for _ in range(4):
+        bucket.acquire()
+    # 4 tokens at 20 per second
+    assert time.monotonic() - start == pytest.approx(0.2, abs=0.08)
+    metrics = bucket.metrics()
+    assert metrics['acquired'] == 7 and metrics['throttled_calls'] == 4
+    assert metrics['throttled_time'] == pytest.approx(0.2, abs=0.05)
+
+
+def test_refill_is_capped_by_capacity():
+    bucket = TokenBucket(rate=100, capacity=2)
+    time.sleep(0.1)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.metrics()['acquired'] == 2
+
+
+def test_timeout():
+    bucket = TokenBucket(rate=2, capacity=1)
+    assert bucket.acquire()
+    start = time.monotonic()
+    # the next token is 0.5 s away
+    assert not bucket.acquire(timeout=0.1)
+    assert time.monotonic() - start < 0.05
+    # giving up does not consume the token
+    assert bucket.acquire(timeout=0.6)
+    assert bucket.metrics()['acquired'] == 2
+
+
+def test_concurrent_callers_are_spaced():
+    bucket = TokenBucket(rate=50, capacity=1)
+    times = list()
+    lock = threading.Lock()
+
+    def call():
+        bucket.acquire()
+        with lock:
+            times.append(time.monotonic())
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=call) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # one token at once, then 9 at 50 per second
+    assert max(times) - start == pytest.approx(0.18, abs=0.08)
+    assert bucket.metrics()['acquired'] == 10
+
+
+def test_acquire_async():
+    bucket = TokenBucket(rate=20, capacity=1)
+
+    async def run():
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire_async() for _ in range(3)))
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) == pytest.approx(0.1, abs=0.06)
+
+
+def test_invalid_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_set_rate_keeps_the_tokens():
+    bucket = TokenBucket(rate=10, capacity=2)
+    bucket.set_rate(1)
+    assert bucket.rate == 1 and bucket.try_acquire() and bucket.try_acquire()
+    assert bucket.delay() == pytest.approx(1, abs=0.05)
+    with pytest.raises(ValueError):
+        bucket.set_rate(-1)
+
+
+def test_throttled_workers_do_not_wait():
+    bucket = TokenBucket(rate=50, capacity=1)
+    waits = list()
+    lock = threading.Lock()
+
+    def call(i):
+        # the token of the call was taken before it was submitted
+        start = time.monotonic()
+        bucket.acquire()
+        with lock:
+            waits.append(time.monotonic() - start)
+        return i
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = submit_throttled(executor, [(bucket, lambda i=i: call(i)) for i in range(10)], 4)
+        assert [fut.result() for fut in futures] == list(range(10))
+    # the rate is the same as with acquire() in the workers
+    assert time.monotonic() - start == pytest.approx(0.18, abs=0.08)
+    assert max(waits) < 0.01
+    assert bucket.metrics()['acquired'] == 10
+
+
+def test_throttled_calls_of_other_limiters_go_ahead():
+    slow = TokenBucket(rate=2, capacity=1)
+    fast = TokenBucket(rate=100, capacity=1)
+    finished = list()
+    calls = [(slow, lambda: finished.append('slow'))] * 2 + [(fast, lambda: finished.append('fast'))] * 3 \
+        + [(None, lambda: finished.append('free'))]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = submit_throttled(executor, calls, 2)
+        for fut in futures:
+            fut.result()
+    # the second slow call waits 0.5 s for its token, the others do not wait for it
+    assert finished[-1] == 'slow' and finished.count('fast') == 3
+
+
+def test_throttled_submission_stops():
+    bucket = TokenBucket(rate=20, capacity=1)
+    stopped = threading.Event()
+
+    def call():
+        stopped.set()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        futures = submit_throttled(executor, [(bucket, call)] * 5, 1, stop=stopped.is_set)
+    assert futures[0] is not None and futures[1:] == [None] * 4
+
+
+def test_limiters_are_shared_by_host_and_slowed_down():
+    limiter = get_limiter('test-ratelimit.example:8000', rate=10)
+    assert get_limiter('test-ratelimit.example:8000', rate=20) is limiter
+    assert limiter.rate == 10
+    assert get_limiter('test-ratelimit.example:8000', rate=5) is limiter
+    assert limiter.rate == 5
+    assert get_limiter('test-ratelimit.example:8001', rate=10) is not limiter
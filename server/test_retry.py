@@ -0,0 +1,169 @@
+"""Tests of the retries and circuit breakers of the web services.
+"""
+
+from stibium_server.bioservices.retry import (CircuitBreaker, CircuitOpenError,
+                                              call_with_retries, get_breaker)
+
+import threading
+import time
+
+import pytest
+
+
+class Flaky:
+    '''Fails the first failures calls, then returns 'ok' '''
+    def __init__(self, failures, error=IOError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error('failure {}'.format(self.calls))
+        return 'ok'
+
+
+def test_retries_until_success():
+    fn = Flaky(2)
+    assert call_with_retries(fn, retries=3, backoff=0.001) == 'ok'
+    assert fn.calls == 3
+
+
+def test_gives_up_after_the_retries():
+    fn = Flaky(10)
+    with pytest.raises(IOError, match='failure 3'):
+        call_with_retries(fn, retries=2, backoff=0.001)
+    assert fn.calls == 3
+
+
+def test_other_errors_are_not_retried():
+    fn = Flaky(1, error=KeyError)
+    with pytest.raises(KeyError):
+        call_with_retries(fn, retries=3, backoff=0.001, retry_on=(IOError,))
+    assert fn.calls == 1
+
+
+def test_failed_results_are_retried_and_the_last_returned():
+    results = iter([500, 503, 502])
+    assert call_with_retries(lambda: next(results), retries=2, backoff=0.001,
+                             is_failure=lambda status: status >= 500) == 502
+
+
+def test_retried_results_are_discarded():
+    results = iter([500, 503, 200])
+    discarded = list()
+    assert call_with_retries(lambda: next(results), retries=3, backoff=0.001,
+                             is_failure=lambda status: status >= 500,
+                             discard=discarded.append) == 200
+    assert discarded == [500, 503]
+    # the last failed result is returned, not discarded
+    results = iter([500, 503])
+    discarded.clear()
+    assert call_with_retries(lambda: next(results), retries=1, backoff=0.001,
+                             is_failure=lambda status: status >= 500,
+                             discard=discarded.append) == 503
+    assert discarded == [500]
+
+
+def test_breaker_counts_calls_not_attempts():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+    fn = Flaky(100)
+    with pytest.raises(IOError):
+        call_with_retries(fn, retries=3, backoff=0.001, breaker=breaker)
+    # one failed call, however many attempts
+    assert fn.calls == 4 and breaker.state == CircuitBreaker.CLOSED
+    # a call that succeeds after retries is not a failure
+    assert call_with_retries(Flaky(2), retries=3, backoff=0.001, breaker=breaker) == 'ok'
+    assert breaker._failures == 0
+
+
+def test_breaker_opens_and_fails_fast():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+    fn = Flaky(100)
+    for _ in range(2):
+        with pytest.raises(IOError):
+            call_with_retries(fn, retries=1, backoff=0.001, breaker=breaker)
+    assert fn.calls == 4 and breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        call_with_retries(fn, retries=5, backoff=0.001, breaker=breaker)
+    assert fn.calls == 4
+    assert 0 < error.value.retry_in <= 60
+
+
+def test_failed_probe_is_not_retried():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    fn = Flaky(100)
+    with pytest.raises(IOError):
+        call_with_retries(fn, retries=3, backoff=0.001, breaker=breaker)
+    assert fn.calls == 1 and breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_probe_closes_the_breaker():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and not breaker.is_open
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=0.05)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    # a single failure of the probe is enough
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_lost_probe_is_replaced():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    # the probe never reports back
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_one_probe_among_concurrent_callers():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    let_through = list()
+
+    def call():
+        try:
+            breaker.before_call()
+            let_through.append(True)
+        except CircuitOpenError:
+            pass
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(let_through) == 1
+
+
+def test_breakers_are_shared_by_name():
+    breaker = get_breaker('test-retry.example:8000')
+    assert get_breaker('test-retry.example:8000') is breaker
+    assert get_breaker('test-retry.example:8001') is not breaker
@@ -0,0 +1,145 @@
+"""Tests of the concurrent requests of the REST services.
+"""
+
+from stibium_server.bioservices.retry import CircuitOpenError
+from stibium_server.bioservices.services import REST
+from stibium_server.bioservices.uniprot import UniProt
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+from requests import ConnectionError, Response
+
+
+def response(content, status=200):
+    resp = Response()
+    resp.status_code = status
+    resp._content = content.encode('utf-8')
+    return resp
+
+
+def failing_service(barrier):
+    '''A service whose requests for keys starting with "bad" fail; all the calls wait for each
+    other, so that they overlap'''
+    service = REST('test', url='http://127.0.0.1:9', verbose=False)
+
+    def send(method, url, **kwargs):
+        barrier.wait(timeout=5)
+        key = url.rsplit('/', 1)[-1]
+        if key.startswith('bad'):
+            raise IOError(key)
+        return response(key)
+
+    service._send_idempotent = send
+    return service
+
+
+def test_get_async_errors_are_per_call():
+    barrier = threading.Barrier(4)
+    service = failing_service(barrier)
+
+    def call(keys):
+        errors = dict()
+        return service.get_async(keys, frmt='txt', errors=errors), errors
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(call, ['a', 'bad1'])
+        second = executor.submit(call, ['bad2', 'b'])
+        (results1, errors1), (results2, errors2) = first.result(), second.result()
+    assert results1 == ['a', None] and list(errors1) == ['bad1']
+    assert results2 == [None, 'b'] and list(errors2) == ['bad2']
+    assert not hasattr(service, 'last_errors')
+
+
+@pytest.mark.parametrize('threshold', [10, 1])
+def test_http_get_errors_on_both_paths(monkeypatch, threshold):
+    service = REST('test', url='http://127.0.0.1:12', verbose=False)
+    monkeypatch.setattr(service.settings, 'ASYNC_THRESHOLD', threshold)
+    monkeypatch.setattr(service.settings, 'MAX_RETRIES', 0)
+
+    def request(method, url, **kwargs):
+        # the errors are not a parameter of the request
+        assert 'errors' not in kwargs
+        key = url.rsplit('/', 1)[-1]
+        if key.startswith('bad'):
+            raise ConnectionError(key)
+        return response(key)
+
+    monkeypatch.setattr(service.session, 'request', request)
+    errors = dict()
+    assert service.http_get(['a', 'bad', 'b'], frmt='txt', errors=errors) == ['a', None, 'b']
+    assert list(errors) == ['bad'] and isinstance(errors['bad'], ConnectionError)
+
+
+def test_mapping_bulk_errors_are_per_call():
+    uniprot = UniProt(verbose=False)
+
+    def mapping_stream(fr, to, chunk):
+        for id_ in chunk:
+            if id_.startswith('bad'):
+                raise IOError(id_)
+            yield id_, id_.lower()
+
+    uniprot.mapping_stream = mapping_stream
+    errors = dict()
+    result = uniprot.mapping_bulk('ACC', 'ID', ['A', 'B', 'bad', 'C'], chunk_size=2,
+                                  errors=errors)
+    # the chunk with the failure is left out
+    assert dict(result) == {'A': ['a'], 'B': ['b']}
+    assert sorted(errors) == ['C', 'bad']
+    assert dict(uniprot.mapping_bulk('ACC', 'ID', ['A'])) == {'A': ['a']}
+
+
+def test_mapping_bulk_drops_partial_chunks():
+    uniprot = UniProt(verbose=False)
+
+    def mapping_stream(fr, to, chunk):
+        for id_ in chunk:
+            if id_.startswith('bad'):
+                raise IOError(id_)
+            yield id_, id_.lower()
+
+    uniprot.mapping_stream = mapping_stream
+    errors = dict()
+    # the second chunk fails after its first row was received
+    result = uniprot.mapping_bulk('ACC', 'ID', ['A', 'B', 'C', 'bad', 'D'], chunk_size=2,
+                                  errors=errors)
+    assert dict(result) == {'A': ['a'], 'B': ['b'], 'D': ['d']}
+    assert sorted(errors) == ['C', 'bad']
+
+
+def test_retried_streams_are_closed(monkeypatch):
+    service = REST('test', url='http://127.0.0.1:10', verbose=False)
+    responses = [response('busy', 503), response('busy', 503), response('rows')]
+    closed = list()
+    for resp in responses:
+        resp.close = lambda resp=resp: closed.append(resp)
+    sent = iter(responses)
+    # the session and the settings are shared by all the services
+    monkeypatch.setattr(service.session, 'request', lambda method, url, **kwargs: next(sent))
+    monkeypatch.setattr(service.settings, 'MAX_RETRIES', 3)
+    assert service._open_stream('GET', 'rows') is responses[2]
+    assert closed == responses[:2]
+
+
+def test_get_one_raises_network_errors(monkeypatch):
+    service = REST('test', url='http://127.0.0.1:11', verbose=False)
+    # the breaker of this host and port is created with the threshold of the first call
+    monkeypatch.setattr(service.settings, 'BREAKER_THRESHOLD', 1)
+    monkeypatch.setattr(service.settings, 'MAX_RETRIES', 1)
+    monkeypatch.setattr(service.settings, 'RETRY_BACKOFF', 0.001)
+    sent = list()
+
+    def request(method, url, **kwargs):
+        sent.append(url)
+        raise ConnectionError('refused')
+
+    monkeypatch.setattr(service.session, 'request', request)
+    # the error of the last attempt, not None as for an empty result
+    with pytest.raises(ConnectionError):
+        service.get_one('a', frmt='txt')
+    assert len(sent) == 2
+    with pytest.raises(CircuitOpenError):
+        service.get_one('a', frmt='txt')
+    assert len(sent) == 2
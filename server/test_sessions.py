@@ -0,0 +1,33 @@
+"""Tests of the shared connection pool.
+"""
+
+from stibium_server.bioservices.sessions import SessionPool, pool_parameters
+
+from types import SimpleNamespace
+
+
+def pool_maxsize(session):
+    return session.get_adapter('https://example.org')._pool_maxsize
+
+
+def test_configure_resizes_open_sessions():
+    pool = SessionPool(pool_maxsize=10)
+    session = pool.get()
+    adapter = session.get_adapter('https://example.org')
+    assert pool_maxsize(session) == 10
+    pool.configure(pool_maxsize=50)
+    # the services keep the session they got, it gets a new adapter
+    assert pool.get() is session and pool_maxsize(session) == 50
+    assert session.get_adapter('http://example.org') is session.get_adapter('https://example.org')
+    assert len(adapter.poolmanager.pools) == 0
+    new_adapter = session.get_adapter('https://example.org')
+    pool.configure(pool_maxsize=50)
+    assert session.get_adapter('https://example.org') is new_adapter
+
+
+def test_pool_holds_the_concurrent_requests():
+    settings = SimpleNamespace(POOL_CONNECTIONS=10, POOL_MAXSIZE=10, POOL_BLOCK=False,
+                               CONCURRENT=50)
+    assert pool_parameters(settings)['pool_maxsize'] == 50
+    settings.CONCURRENT = 4
+    assert pool_parameters(settings)['pool_maxsize'] == 10
@@ -0,0 +1,40 @@
+"""Tests of the process-wide configuration of the web services.
+"""
+
+from stibium_server.bioservices import settings
+from stibium_server.bioservices.settings import get_config, reload_config, update_config
+
+import threading
+
+
+class CountingLock(object):
+    """A lock that records the configuration published under it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.published = list()
+
+    def __enter__(self):
+        self._lock.acquire()
+
+    def __exit__(self, *args):
+        self.published.append(settings._config)
+        self._lock.release()
+
+
+def test_reload_with_values_publishes_once(monkeypatch):
+    lock = CountingLock()
+    monkeypatch.setattr(settings, '_config_lock', lock)
+    config = reload_config({'general.timeout': '45', 'general.max_retries': 2})
+    # the values are never missing from a published configuration
+    assert lock.published == [config]
+    assert get_config() is config
+    assert config.params['general.timeout'][0] == 45
+    assert config.params['general.max_retries'][0] == 2
+
+
+def test_reload_undoes_updates():
+    default = reload_config().params['general.timeout'][0]
+    update_config({'general.timeout': default + 1})
+    assert get_config().params['general.timeout'][0] == default + 1
+    assert reload_config().params['general.timeout'][0] == default
@@ -0,0 +1,93 @@
+"""Tests of the recording of web service exchanges and their replay by the stand-in server.
+"""
+
+from stibium_server.bioservices.sessions import get_session_pool
+from stibium_server.fixtures import FixtureRecorder, iter_exchanges
+from stibium_server.standin import StandInServer
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+
+
+class Origin(BaseHTTPRequestHandler):
+    '''Stands in for a web service: the search links to its own entries, the SOAP endpoint
+    echoes the request'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        host = 'http://{}:{}'.format(*self.server.server_address)
+        self._send('text/plain', 'results of {} at {}/entry/1'.format(self.path, host).encode())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self._send('text/xml', b'<reply>' + body + b'</reply>')
+
+    def _send(self, content_type, body):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fixtures(tmp_path):
+    '''A fixture file recorded from an origin server, and the URL of the origin'''
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Origin)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    origin = 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    path = str(tmp_path / 'fixtures.jsonl')
+    session = get_session_pool().get()
+    try:
+        with FixtureRecorder(path):
+            assert session.get(origin + '/search?query=glucose&limit=5').ok
+            assert session.post(origin + '/soap', data=b'<getLiteEntity/>').ok
+        # not recorded
+        session.get(origin + '/search?query=water')
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    return path, origin
+
+
+def test_record_and_replay(fixtures):
+    path, origin = fixtures
+    exchanges = list(iter_exchanges(path))
+    assert [(ex['method'], ex['target']) for ex in exchanges] == \
+        [('GET', '/search?limit=5&query=glucose'), ('POST', '/soap')]
+    assert exchanges[1]['body'] == b'<reply><getLiteEntity/></reply>'
+
+    session = get_session_pool().get()
+    with StandInServer(path) as standin:
+        # the order of the query parameters does not matter
+        response = session.get(standin.url + '/search?limit=5&query=glucose')
+        assert response.status_code == 200 and response.headers['Content-Type'] == 'text/plain'
+        # the links to the origin point to the stand-in
+        assert response.text == 'results of /search?query=glucose&limit=5 at {}/entry/1'.format(
+            standin.url)
+        assert session.post(standin.url + '/soap', data=b'<getLiteEntity/>').content == \
+            b'<reply><getLiteEntity/></reply>'
+        # requests are told apart by their body
+        assert session.post(standin.url + '/soap', data=b'<other/>').status_code == 404
+        assert session.get(standin.url + '/search?query=water').status_code == 404
+        assert (standin.requests, standin.errors, standin.misses) == (4, 0, 2)
+
+
+def test_injected_latency_and_errors(fixtures):
+    path, _ = fixtures
+    session = get_session_pool().get()
+    with StandInServer(path, latency=0.1, error_rate=1., seed=1) as standin:
+        start = time.monotonic()
+        response = session.get(standin.url + '/search?query=glucose&limit=5')
+        assert time.monotonic() - start >= 0.1
+        assert response.status_code == 503 and standin.errors == 1
+    with StandInServer(path, error_rate=0.5, seed=1) as standin:
+        statuses = [session.post(standin.url + '/soap', data=b'<getLiteEntity/>').status_code
+                    for _ in range(20)]
+        assert set(statuses) == {200, 503} and statuses.count(503) == standin.errors
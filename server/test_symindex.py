@@ -0,0 +1,100 @@
+"""Tests of the compact symbol index and its reverse index of usages.
+"""
+
+import pytest
+
+pytest.importorskip('stibium.types')
+
+from stibium_server.symindex import SymbolIndex
+
+from stibium.types import SrcPosition, SrcRange
+
+
+def src_range(line, column, end_column):
+    return SrcRange(SrcPosition(line, column), SrcPosition(line, end_column))
+
+
+def build(occurrences):
+    '''Index of (name, line, column) occurrences, added out of order'''
+    index = SymbolIndex()
+    for name, line, column in reversed(occurrences):
+        record = index.get(name) or index.add_symbol(name, '', 'Species',
+                                                     ('chebi/1',) if name == 'S1' else ())
+        index.add_occurrence(record, src_range(line, column, column + len(name)))
+    index.freeze()
+    return index
+
+
+def test_occurrences_are_in_document_order():
+    index = build([('S1', 1, 1), ('S2', 1, 7), ('k', 2, 1), ('S1', 2, 5), ('S2', 3, 1)])
+    assert len(index) == 5
+    assert [(record.name, span[:2]) for record, span in index.occurrences()] == \
+        [('S1', (1, 1)), ('S2', (1, 7)), ('k', (2, 1)), ('S1', (2, 5)), ('S2', (3, 1))]
+
+
+def test_reverse_index():
+    index = build([('S1', 1, 1), ('S2', 1, 7), ('k', 2, 1), ('S1', 2, 5), ('S2', 3, 1)])
+    s1, s2, k = index.get('S1'), index.get('S2'), index.get('k')
+    assert index.spans_of(s1) == [(1, 1, 1, 3), (2, 5, 2, 7)]
+    assert index.spans_of(s2) == [(1, 7, 1, 9), (3, 1, 3, 3)]
+    assert index.usage_count(k) == 1 and index.first_span(k) == (2, 1, 2, 2)
+    unused = SymbolIndex()
+    record = unused.add_symbol('x', '', 'Parameter')
+    unused.freeze()
+    assert unused.usage_count(record) == 0 and unused.first_span(record) is None
+    assert unused.spans_of(record) == []
+
+
+def test_reverse_index_after_edits():
+    # each version of a document gets its own index; the usages follow the edits
+    before = build([('S1', 1, 1), ('S2', 1, 7), ('S1', 2, 5)])
+    after = build([('S1', 1, 1), ('S2', 1, 7), ('S2', 2, 1), ('S1', 3, 5), ('S3', 3, 9)])
+    assert before.spans_of(before.get('S1')) == [(1, 1, 1, 3), (2, 5, 2, 7)]
+    assert after.spans_of(after.get('S1')) == [(1, 1, 1, 3), (3, 5, 3, 7)]
+    assert after.spans_of(after.get('S2')) == [(1, 7, 1, 9), (2, 1, 2, 3)]
+    assert after.usage_count(after.get('S3')) == 1 and before.get('S3') is None
+
+
+def test_symbol_at():
+    index = build([('S1', 1, 1), ('S2', 1, 7), ('k', 2, 1)])
+    assert index.symbol_at(1, 2)[0].name == 'S1'
+    assert index.symbol_at(1, 3) == (index.get('S1'), (1, 1, 1, 3))
+    assert index.symbol_at(1, 5) is None
+    assert index.symbol_at(2, 1)[0].name == 'k'
+    assert index.symbol_at(0, 1) is None
+
+
+def test_scopes_and_annotations():
+    index = SymbolIndex()
+    outer = index.add_symbol('S1', '', 'Species', ('chebi/1',))
+    inner = index.add_symbol('S1', 'm', 'Species', ('chebi/1', 'uniprot/P1'))
+    index.add_occurrence(outer, src_range(1, 1, 3))
+    index.add_occurrence(inner, src_range(3, 1, 3))
+    index.freeze()
+    assert index.get('S1') is outer and index.get('S1', 'm') is inner
+    # URIs and names are interned
+    assert outer.annotations[0] is inner.annotations[0]
+    assert index.annotation_uris() == ['chebi/1', 'uniprot/P1']
+    assert index.annotated_spans() == [(1, 1, 1, 3), (3, 1, 3, 3)]
+
+
+def test_hover_text_and_declarations():
+    index = SymbolIndex()
+    record = index.add_symbol('k1', 'm', 'Parameter', (), 'k1: parameter')
+    index.add_occurrence(record, src_range(2, 3, 5))
+    index.add_occurrence(record, src_range(4, 1, 3))
+    index.freeze()
+    assert record.help == 'k1: parameter' and record.declarations == ()
+
+
+def test_from_antfile_after_edits():
+    api = pytest.importorskip('stibium.api')
+    text = 'S1 -> S2; k*S1\nk = 1\nS1 = 2\n'
+    index = SymbolIndex.from_antfile(api.AntFile('', text))
+    assert index.usage_count(index.get('S1')) == 3
+    index = SymbolIndex.from_antfile(api.AntFile('', text.replace('k*S1', 'k*S2')))
+    assert index.usage_count(index.get('S1')) == 2
+    assert index.spans_of(index.get('S2')) == [(1, 7, 1, 9), (1, 13, 1, 15)]
+    # k is declared by its assignment
+    assert index.get('k').declarations == ((2, 1, 2, 2),)
+    assert index.get('k').help
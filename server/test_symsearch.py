@@ -0,0 +1,63 @@
+"""Tests of the fuzzy search of the workspace symbols.
+"""
+
+import pytest
+
+pytest.importorskip('stibium.api')
+
+from stibium_server.indexer import IndexedSymbol
+from stibium_server.symsearch import SymbolSearchIndex, score
+
+
+def symbol(name, kind='Species'):
+    return IndexedSymbol(name, kind, '', (0, 0, 0, len(name)), ())
+
+
+def names(results):
+    return [found.name for _, found in results]
+
+
+def test_score_order():
+    ranks = [score('gluc', name)
+             for name in ('gluc', 'glucose', 'glucose_6_phosphate', 'd_glucose', 'g_l_u_c')]
+    assert ranks == sorted(ranks, reverse=True) and len(set(ranks)) == 5
+    assert score('gluc', 'fructose') == 0
+
+
+def test_search():
+    index = SymbolSearchIndex()
+    index.update_file('a.ant', [symbol('glucose'), symbol('Glucose_6_P'), symbol('ATP')])
+    index.update_file('b.ant', [symbol('glucose'), symbol('d_glucose')])
+    assert len(index) == 5
+    results = index.search('GLUCOSE')
+    assert names(results) == ['glucose', 'glucose', 'Glucose_6_P', 'd_glucose']
+    assert sorted(path for path, found in results if found.name == 'glucose') == \
+        ['a.ant', 'b.ant']
+    assert names(index.search('atp')) == ['ATP']
+    assert index.search('xyz') == []
+
+
+def test_short_and_fuzzy_queries():
+    index = SymbolSearchIndex()
+    index.update_file('a.ant', [symbol('glucose'), symbol('galactose'), symbol('k1')])
+    assert names(index.search('k')) == ['k1']
+    # too short for trigrams, or no substring: found by the scan of the names with the same
+    # first character, prefixes and fewer gaps first
+    assert names(index.search('gl')) == ['glucose', 'galactose']
+    assert names(index.search('glcs')) == ['glucose', 'galactose']
+
+
+def test_updates_and_removal():
+    index = SymbolSearchIndex()
+    index.update_file('a.ant', [symbol('glucose')])
+    index.update_file('a.ant', [symbol('fructose')])
+    assert index.search('glucose') == [] and names(index.search('fructose')) == ['fructose']
+    index.update_file('a.ant', None)
+    assert len(index) == 0 and index.search('fructose') == []
+
+
+def test_limit_and_empty_query():
+    index = SymbolSearchIndex()
+    index.update_file('a.ant', [symbol('s{}'.format(i)) for i in range(50)])
+    assert len(index.search('s', limit=10)) == 10
+    assert names(index.search('', limit=3)) == ['s0', 's1', 's2']
@@ -0,0 +1,67 @@
+"""Tests of the shared analysis of the documents, against stibium's analyzer.
+"""
+
+import pytest
+
+pytest.importorskip('stibium.api')
+
+from stibium.api import AntFile
+from stibium.types import SrcPosition
+from stibium_server.utils import AntFileCache
+
+from pygls.workspace import Document
+
+
+MODEL = '''model m()
+  species S1, S2
+  J1: S1 -> S2; k1*S1
+  k1 = 0.1
+  S1 = 10; S2 = 0
+end
+'''
+
+
+def summary(issues):
+    return [(str(issue.range), issue.message, issue.severity) for issue in issues]
+
+
+def test_each_version_is_analyzed_once():
+    cache = AntFileCache()
+    doc = Document('file:///m.ant', MODEL, version=1)
+    analyzed = cache.get(doc)
+    assert cache.get(doc) is analyzed
+    doc = Document('file:///m.ant', MODEL.replace('k1 = 0.1', 'k1 = x'), version=2)
+    edited = cache.get(doc)
+    assert edited is not analyzed and edited.source == doc.source
+    # the same source under the same version, e.g. read again by another feature
+    assert cache.get(doc, doc.source) is edited
+    cache.discard(doc.uri)
+    assert cache.get(doc) is not edited
+
+
+def test_issues_match_antfile():
+    cache = AntFileCache()
+    texts = [MODEL, MODEL.replace('k1 = 0.1\n', ''), MODEL + 'J1: S2 -> S1; k2\n',
+             MODEL.replace('end\n', '')]
+    for version, text in enumerate(texts):
+        doc = Document('file:///m.ant', text, version=version)
+        assert summary(cache.get(doc).issues) == summary(AntFile(doc.path, text).get_issues())
+
+
+def test_features_read_the_index():
+    cache = AntFileCache()
+    doc = Document('file:///m.ant', MODEL + 'S1 identity "http://identifiers.org/chebi/CHEBI:17234"\n',
+                   version=1)
+    analyzed = cache.get(doc)
+    # the analyzer's objects are not kept
+    assert not hasattr(analyzed, 'antfile')
+    antfile = AntFile(doc.path, doc.source)
+    index = analyzed.index
+    record, span = index.symbol_at(3, 9)
+    assert record.name == 'S1' and span == (3, 7, 3, 9)
+    symbols, _ = antfile.symbols_at(SrcPosition(3, 9))
+    assert record.help == symbols[0].help_str()
+    locations, _ = antfile.goto(SrcPosition(3, 9))
+    assert [(loc.range.start.line, loc.range.start.column) for loc in locations] == \
+        [declaration[:2] for declaration in record.declarations]
+    assert record.annotations == ('http://identifiers.org/chebi/CHEBI:17234',)
@@ -0,0 +1,145 @@
+"""Tests of the paging of the annotation searches.
+"""
+
+from stibium_server.bioservices import uniprot as uniprot_module
+from stibium_server.webservices import PAGE_SIZE, WebServices
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+
+class UniProt:
+    '''Stands in for the UniProt service, with count results for any query'''
+    def __init__(self, count):
+        self.count = count
+        self.searches = list()
+
+    def search_stream(self, query, limit=None, offset=None, columns=None):
+        self.searches.append((limit, offset))
+        yield ['Entry', 'Entry name', 'Protein names', 'Gene names']
+        for i in range(offset or 0, min(self.count, (offset or 0) + limit)):
+            yield ['P{:05}'.format(i), 'E{}_HUMAN'.format(i), 'protein {}'.format(i),
+                   'G{}'.format(i)]
+
+
+def services_with(uniprot):
+    services = WebServices()
+    services.uniprot = uniprot
+    return services
+
+
+def test_uniprot_pages():
+    uniprot = UniProt(2 * PAGE_SIZE + 5)
+    services = services_with(uniprot)
+    first = services.annot_search_uniprot('kinase')
+    assert [item['id'] for item in first] == ['P{:05}'.format(i) for i in range(PAGE_SIZE)]
+    assert services.has_more_uniprot('kinase')
+    second = services.annot_search_uniprot('kinase', 1)
+    assert second[0]['id'] == 'P{:05}'.format(PAGE_SIZE) and len(second) == PAGE_SIZE
+    assert services.has_more_uniprot('kinase', 1)
+    last = services.annot_search_uniprot('kinase', 2)
+    assert len(last) == 5 and not services.has_more_uniprot('kinase', 2)
+    # one row more than a page, from the offset of the page
+    assert uniprot.searches == [(PAGE_SIZE + 1, None), (PAGE_SIZE + 1, PAGE_SIZE),
+                                (PAGE_SIZE + 1, 2 * PAGE_SIZE)]
+
+
+def test_uniprot_pages_are_cached():
+    uniprot = UniProt(PAGE_SIZE)
+    services = services_with(uniprot)
+    assert not services.is_cached('uniprot', 'kinase')
+    assert not services.has_more_uniprot('kinase')
+    services.prefetch('uniprot', ' Kinase ')
+    assert services.is_cached('uniprot', 'kinase')
+    assert len(services.annot_search_uniprot('kinase')) == PAGE_SIZE
+    assert not services.has_more_uniprot('kinase')
+    assert len(uniprot.searches) == 1
+
+
+def test_chebi_pages():
+    entities = [SimpleNamespace(chebiId='CHEBI:{}'.format(i),
+                                chebiAsciiName='glucose {}'.format(i))
+                for i in range(PAGE_SIZE + 3)]
+    services = WebServices()
+    services.chebi = SimpleNamespace(getLiteEntity=lambda query, maximumResults: entities)
+    assert len(services.annot_search_chebi('glucose')) == PAGE_SIZE
+    assert services.has_more_chebi('glucose')
+    assert len(services.annot_search_chebi('glucose', 1)) == 3
+    assert not services.has_more_chebi('glucose', 1)
+
+
+class SlowSearch(BaseHTTPRequestHandler):
+    '''Sends the header and first rows of a UniProt search, then the other rows once the test
+    releases them, in chunks like UniProt'''
+    protocol_version = 'HTTP/1.1'
+    FIRST, REST = 3, 4
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        rows = ['P{:05}\tE{}_HUMAN\tprotein {}\tG{}'.format(i, i, i, i)
+                for i in range(self.FIRST + self.REST)]
+        self._chunk(['Entry\tEntry name\tProtein names\tGene names'] + rows[:self.FIRST])
+        self.server.released.wait(5)
+        self.server.sent_rest = True
+        self._chunk(rows[self.FIRST:])
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _chunk(self, lines):
+        data = '\n'.join(lines).encode() + b'\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def slow_search():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), SlowSearch)
+    httpd.daemon_threads = True
+    httpd.released = threading.Event()
+    httpd.sent_rest = False
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.released.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def read_slowly(httpd, items, first):
+    '''Read items, releasing the rest of the response once the first ones are read; return
+    them, and whether each of them was read before the rest was sent'''
+    read = list()
+    early = list()
+    for item in items:
+        read.append(item)
+        early.append(not httpd.sent_rest)
+        if len(read) == first:
+            httpd.released.set()
+    return read, early
+
+
+def test_search_stream_is_incremental(slow_search):
+    uniprot = uniprot_module.UniProt(url='http://127.0.0.1:{}'.format(slow_search.server_port))
+    rows, early = read_slowly(slow_search, uniprot.search_stream('kinase', limit=10),
+                              SlowSearch.FIRST + 1)
+    # the header and first rows are there before the rest of the response is sent
+    assert early == [True] * (SlowSearch.FIRST + 1) + [False] * SlowSearch.REST
+    assert [row[0] for row in rows[1:]] == ['P{:05}'.format(i) for i in range(7)]
+
+
+def test_iter_search_uniprot_is_incremental(slow_search):
+    services = services_with(
+        uniprot_module.UniProt(url='http://127.0.0.1:{}'.format(slow_search.server_port)))
+    items, early = read_slowly(slow_search, services.iter_search_uniprot('kinase'),
+                               SlowSearch.FIRST)
+    assert early == [True] * SlowSearch.FIRST + [False] * SlowSearch.REST
+    assert [item['id'] for item in items] == ['P{:05}'.format(i) for i in range(7)]
+    # the complete page is cached
+    assert services.annot_search_uniprot('kinase') == items
@@ -0,0 +1,109 @@
+"""Tests of the workspace model: file summaries, import resolution and the dependency graph.
+"""
+
+import pytest
+
+pytest.importorskip('stibium.api')
+
+from stibium_server.workspace import FileSummary, WorkspaceModel
+
+import os
+
+
+def test_summary():
+    summary = FileSummary.from_text(
+        'import "lib.ant"\n'
+        '// import "commented.ant"\n'
+        'model *main()\n  S1 -> S2; k\nend\n'
+        'function f(x)\n  x\nend\n'
+        'module sub /* comment */ ()\nend\n'
+        'import "a \\"quoted\\".ant"\n')
+    assert [i.target for i in summary.imports] == ['lib.ant', 'a "quoted".ant']
+    assert summary.imports[0].range == (0, 0, 0, 16)
+    assert {name: d.kind for name, d in summary.definitions.items()} == \
+        {'main': 'model', 'f': 'function', 'sub': 'model'}
+    assert summary.definitions['main'].range == (2, 7, 2, 11)
+
+
+def test_interface_ignores_the_bodies():
+    before = FileSummary.from_text('import "a"\nmodel m()\n  x = 1\nend\n')
+    after = FileSummary.from_text('import "a"\nmodel m()\n  x = 2; y = x\nend\n')
+    renamed = FileSummary.from_text('import "a"\nmodel n()\nend\n')
+    assert before.interface() == after.interface() != renamed.interface()
+
+
+@pytest.fixture
+def files(tmp_path):
+    def write(name, text):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding='utf-8')
+        return WorkspaceModel.normalize(str(path))
+
+    return write
+
+
+def test_imports_resolve_relative_then_to_the_roots(tmp_path, files):
+    lib = files('lib/lib.ant', 'model lib()\nend\n')
+    local = files('src/lib.ant', 'model local()\nend\n')
+    main = files('src/main.ant', 'import "lib"\nimport "lib/lib.ant"\nimport "missing.ant"\n')
+    workspace = WorkspaceModel([str(tmp_path)])
+    assert workspace.imports(main) == [local, lib, None]
+    issues = workspace.import_issues(main)
+    assert [(issue.range[0], issue.is_error) for issue in issues] == [(2, True)]
+    assert "missing.ant" in issues[0].message
+
+
+def test_dependents_and_definitions(files):
+    base = files('base.ant', 'model base()\nend\n')
+    middle = files('middle.ant', 'import "base.ant"\nmodel middle()\nend\n')
+    top = files('top.ant', 'import "middle.ant"\n')
+    workspace = WorkspaceModel()
+    assert workspace.import_closure(top) == [middle, base]
+    assert workspace.dependents(base) == {middle, top}
+    assert workspace.find_definition(top, 'base') == \
+        (base, workspace.summary(base).definitions['base'])
+    assert workspace.find_definition(top, 'missing') is None
+
+
+def test_update_reports_the_dependents_of_interface_changes(files):
+    base = files('base.ant', 'model base()\nend\n')
+    top = files('top.ant', 'import "base.ant"\n')
+    workspace = WorkspaceModel()
+    workspace.imports(top)
+    workspace.summary(base)
+    # the open document takes precedence over the file on disk
+    assert workspace.update(base, 'model base()\n  x = 1\nend\n') == set()
+    assert workspace.update(base, 'model renamed()\nend\n') == {top}
+    assert workspace.find_definition(top, 'renamed')[0] == base
+    assert workspace.file_changed(base) == set()
+    # closing it goes back to the file on disk
+    assert workspace.close(base) == {top}
+    assert workspace.find_definition(top, 'base')[0] == base
+
+
+def test_files_changed_on_disk(files):
+    base = files('base.ant', 'model base()\nend\n')
+    top = files('top.ant', 'import "base.ant"\n')
+    workspace = WorkspaceModel()
+    assert workspace.find_definition(top, 'base')[0] == base
+    files('base.ant', 'model other()\nend\n')
+    os.utime(base, ns=(0, 0))
+    assert workspace.file_changed(base) == {top}
+    assert workspace.find_definition(top, 'other')[0] == base
+    os.remove(base)
+    assert workspace.file_changed(base) == {top}
+    assert workspace.imports(top) == [None]
+    # created again
+    files('base.ant', 'model base()\nend\n')
+    assert workspace.file_changed(base) == {top}
+    assert workspace.imports(top) == [base]
+
+
+def test_import_cycles(files):
+    a = files('a.ant', 'import "b.ant"\n')
+    files('b.ant', 'import "a.ant"\n')
+    workspace = WorkspaceModel()
+    issues = workspace.import_issues(a)
+    assert len(issues) == 1 and not issues[0].is_error
+    assert 'cycle' in issues[0].message
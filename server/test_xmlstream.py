@@ -0,0 +1,87 @@
+"""Tests of the streaming extraction of records from XML documents.
+"""
+
+from stibium_server.bioservices.xmlstream import iter_records
+
+import io
+
+
+UNIPROT = b'''<?xml version="1.0" encoding="UTF-8"?>
+<uniprot xmlns="http://uniprot.org/uniprot">
+<entry dataset="Swiss-Prot" version="12">
+  <accession>P12345</accession>
+  <accession>Q00001</accession>
+  <name>AATM_RABIT</name>
+  <protein>
+    <recommendedName><fullName>Aspartate aminotransferase</fullName></recommendedName>
+    <alternativeName><fullName>Transaminase A</fullName></alternativeName>
+  </protein>
+  <sequence length="430" mass="47409">MALLHSARVLSG</sequence>
+</entry>
+<entry dataset="TrEMBL" version="3">
+  <accession>A0A000</accession>
+  <protein><submittedName><fullName>Uncharacterized</fullName></submittedName></protein>
+</entry>
+</uniprot>
+'''
+
+FIELDS = {
+    'accession': 'accession',
+    'name': 'name',
+    'protein': 'protein/recommendedName/fullName',
+    'length': 'sequence@length',
+    'dataset': '@dataset',
+}
+
+
+def test_fields_of_each_record():
+    records = list(iter_records(io.BytesIO(UNIPROT), 'entry', FIELDS))
+    assert records == [
+        {'accession': 'P12345', 'name': 'AATM_RABIT', 'protein': 'Aspartate aminotransferase',
+         'length': '430', 'dataset': 'Swiss-Prot'},
+        {'accession': 'A0A000', 'name': None, 'protein': None, 'length': None,
+         'dataset': 'TrEMBL'},
+    ]
+
+
+def test_list_fields():
+    records = list(iter_records(io.BytesIO(UNIPROT), 'entry',
+                                {'accessions': 'accession', 'names': 'protein/fullName'},
+                                lists=['accessions', 'names']))
+    assert [record['accessions'] for record in records] == [['P12345', 'Q00001'], ['A0A000']]
+    # paths are exact: protein/fullName does not match protein/recommendedName/fullName
+    assert [record['names'] for record in records] == [[], []]
+
+
+def test_records_are_yielded_as_they_are_read():
+    entries = ''.join('<entry><accession>P{}</accession></entry>'.format(i)
+                      for i in range(1000))
+    source = io.BytesIO('<uniprot>{}</uniprot>'.format(entries).encode('utf-8'))
+    records = iter_records(source, 'entry', {'accession': 'accession'})
+    assert next(records) == {'accession': 'P0'}
+    count = 1
+    for record in records:
+        assert record == {'accession': 'P{}'.format(count)}
+        count += 1
+    assert count == 1000
+
+
+def test_soap_reply():
+    reply = b'''<?xml version="1.0"?>
+<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+<S:Body><getCompleteEntityByListResponse xmlns="https://www.ebi.ac.uk/webservices/chebi">
+<return><chebiId>CHEBI:17234</chebiId><chebiAsciiName>glucose</chebiAsciiName>
+<Synonyms><data>D-Glucose</data></Synonyms><Synonyms><data>Glc</data></Synonyms></return>
+<return><chebiId>CHEBI:15422</chebiId><chebiAsciiName>ATP</chebiAsciiName></return>
+</getCompleteEntityByListResponse></S:Body></S:Envelope>'''
+    records = list(iter_records(io.BytesIO(reply), 'return',
+                                {'id': 'chebiId', 'name': 'chebiAsciiName',
+                                 'synonyms': 'Synonyms/data'}, lists=['synonyms']))
+    assert records == [
+        {'id': 'CHEBI:17234', 'name': 'glucose', 'synonyms': ['D-Glucose', 'Glc']},
+        {'id': 'CHEBI:15422', 'name': 'ATP', 'synonyms': []},
+    ]
+
+
+def test_no_records():
+    assert list(iter_records(io.BytesIO(b'<uniprot/>'), 'entry', FIELDS)) == []
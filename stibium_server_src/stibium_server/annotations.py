@@ -0,0 +1,153 @@
+'''Background resolution of annotation URIs to the names of the annotated entities.
+
+The resolver collects every annotation URI of a document, groups the unknown ones by database
+and fetches them in batches (50 ChEBI ids per getCompleteEntityByList call, 100 UniProt
+accessions per search) on a small thread pool. Results go into a shared cache, so hover can show
+entity names without any network call of its own.
+'''
+
+from .cache import TTLCache
+from .symindex import SymbolIndex
+from .webservices import NetworkError, WebServices
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import logging
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote
+
+
+# e.g. http://identifiers.org/chebi/CHEBI:17234 or https://identifiers.org/CHEBI:17234
+IDENTIFIERS_RE = re.compile(r'^https?://identifiers\.org/(?:([\w.\-]+)/)?([^/\s]+)$')
+# e.g. urn:miriam:chebi:CHEBI%3A17234
+MIRIAM_RE = re.compile(r'^urn:miriam:([\w.\-]+):(\S+)$')
+
+# Entries that were not found are remembered for a shorter time
+NOT_FOUND_TTL = 3600
+
+# Returned by lookup() for URIs that were not fetched (yet)
+UNRESOLVED = object()
+
+
+def parse_annotation_uri(uri: str) -> Optional[Tuple[str, str]]:
+    '''Return the (database prefix, identifier) of an annotation URI, or None if it is not an
+    identifiers.org or MIRIAM URN.'''
+    match = IDENTIFIERS_RE.match(uri) or MIRIAM_RE.match(uri)
+    if match is None:
+        return None
+    prefix, id_ = match.group(1), unquote(match.group(2))
+    if prefix is None:
+        # compact identifiers.org form, where the prefix is part of the id
+        if ':' not in id_:
+            return None
+        prefix = id_.split(':', 1)[0]
+    return prefix.lower(), id_
+
+
+class AnnotationResolver:
+    '''Resolves annotation URIs to entity metadata in the background.
+
+    Only ChEBI and UniProt annotations are resolved; other URIs are ignored.
+    '''
+    CHEBI_BATCH = 50
+    UNIPROT_BATCH = 100
+
+    def __init__(self, services: WebServices, cache: TTLCache = None, max_workers: int = 4):
+        self.services = services
+        self.cache = cache if cache is not None else TTLCache(maxsize=20000, ttl=24 * 3600)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # (prefix, id) -> Future of the batch fetching it
+        self._pending: Dict[Tuple[str, str], Future] = dict()
+        self._lock = threading.Lock()
+
+    def lookup(self, uri: str):
+        '''Return the cached metadata of uri: a dict with 'id', 'name' and 'prefix', None if the
+        entity does not exist, or UNRESOLVED if it was not fetched (yet).'''
+        key = parse_annotation_uri(uri)
+        if key is None:
+            return UNRESOLVED
+        return self.cache.get(key, UNRESOLVED)
+
+    def is_resolved(self, uri: str) -> bool:
+        return self.lookup(uri) is not UNRESOLVED
+
+    def lookup_many(self, uris: List[str], budget: float = 0.):
+        '''Return the metadata of each of uris, as lookup() does.
+
+        Unresolved URIs are scheduled for resolution, and the call waits at most budget seconds
+        for them. Whatever is not resolved by then is returned as UNRESOLVED and will be in the
+        cache for the next call.
+        '''
+        if not all(self.is_resolved(uri) for uri in uris):
+            futures = self.resolve_uris(uris)
+            if futures and budget > 0:
+                wait(futures, timeout=budget)
+        return [self.lookup(uri) for uri in uris]
+
+    def resolve_document(self, index: SymbolIndex) -> List[Future]:
+        '''Schedule the resolution of all the annotations of the document.'''
+        return self.resolve_uris(index.annotation_uris())
+
+    def resolve_uris(self, uris: Iterable[str]) -> List[Future]:
+        '''Schedule the resolution of the given URIs that are neither cached nor being fetched.
+
+        Returns the futures of the batches that fetch them, including batches that were already
+        in flight.
+        '''
+        chebi_ids = list()
+        uniprot_ids = list()
+        futures = dict()
+        with self._lock:
+            for uri in uris:
+                key = parse_annotation_uri(uri)
+                if key is None or key in self.cache:
+                    continue
+                if key in self._pending:
+                    fut = self._pending[key]
+                    futures[id(fut)] = fut
+                    continue
+                if key[0] == 'chebi':
+                    chebi_ids.append(key[1])
+                elif key[0] == 'uniprot':
+                    uniprot_ids.append(key[1])
+
+            for prefix, ids, size, fetch in (
+                    ('chebi', chebi_ids, self.CHEBI_BATCH, self.services.chebi_entities),
+                    ('uniprot', uniprot_ids, self.UNIPROT_BATCH, self.services.uniprot_entries)):
+                for i in range(0, len(ids), size):
+                    batch = ids[i:i + size]
+                    fut = self._executor.submit(self._fetch_batch, prefix, batch, fetch)
+                    futures[id(fut)] = fut
+                    for id_ in batch:
+                        self._pending[(prefix, id_)] = fut
+        return list(futures.values())
+
+    def _fetch_batch(self, prefix: str, ids: List[str], fetch):
+        try:
+            entities = fetch(ids)
+        except NetworkError:
+            logging.info('Could not resolve %d %s annotations', len(ids), prefix)
+            entities = None
+        except Exception:
+            logging.exception('Error while resolving %s annotations', prefix)
+            entities = None
+
+        with self._lock:
+            if entities is not None:
+                found = dict()
+                for ent in entities:
+                    found[ent['id']] = ent
+                    # UniProt annotations may also use the entry name
+                    if 'entry_name' in ent:
+                        found[ent['entry_name']] = ent
+                for id_ in ids:
+                    ent = found.get(id_)
+                    if ent is None:
+                        self.cache.put((prefix, id_), None, ttl=NOT_FOUND_TTL)
+                    else:
+                        self.cache.put((prefix, id_), ent)
+            # on errors nothing is cached, so that the ids are fetched again next time
+            for id_ in ids:
+                self._pending.pop((prefix, id_), None)
+        return entities
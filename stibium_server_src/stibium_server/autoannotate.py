@@ -0,0 +1,108 @@
+'''Bulk search of annotation candidates for all the unannotated species of a model.
+
+Each (species, database) search is one job on a thread pool. The pool is only there to keep
+enough searches in flight: the request rate is bounded by the per-host rate limiters of
+bioservices, so a large model is searched as fast as the providers allow and no faster. The jobs
+are submitted as the limiters hand out tokens (see submit_throttled), so no worker sleeps on a
+limiter, and the searches of one database do not wait for the tokens of the other.
+Results go through WebServices, so they are cached (and prefetched searches are reused).
+'''
+
+from .bioservices.ratelimit import submit_throttled
+from .webservices import NetworkError, WebServices
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import functools
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+# Candidates returned per species and database
+CANDIDATES_PER_SPECIES = 5
+# Searches in flight; the actual rate is set by the rate limiters
+MAX_WORKERS = 8
+
+
+class AutoAnnotateJob:
+    '''Searches candidates for a list of species names in every database.
+
+    progress(done, total) is called after each search, from the worker threads, one call at a
+    time. cancel() may be called from any thread; searches that did not start yet are then
+    skipped.
+    '''
+    def __init__(self, services: WebServices, names: Iterable[str],
+                 databases: Iterable[str] = ('chebi', 'uniprot'),
+                 limit: int = CANDIDATES_PER_SPECIES, max_workers: int = MAX_WORKERS,
+                 progress: Optional[Callable[[int, int], None]] = None):
+        self.services = services
+        self.names = list(dict.fromkeys(names))
+        self.databases = tuple(databases)
+        self.limit = limit
+        self.max_workers = max_workers
+        self.progress = progress
+        self.errors = 0
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self) -> Dict[str, Dict[str, List[dict]]]:
+        '''Return the ranked candidates of each species, as {name: {database: [candidates]}}.
+
+        Species without any candidate are left out, and so are the species that were not
+        searched when the job is cancelled.
+        '''
+        jobs = [(name, database) for name in self.names for database in self.databases]
+        results = {name: dict() for name in self.names}
+        done = 0
+
+        def search(name, database):
+            # the progress is reported by the worker, as soon as the search is done
+            nonlocal done
+            candidates = self._search(database, name)
+            with self._lock:
+                if candidates:
+                    results[name][database] = candidates
+                done += 1
+                if self.progress is not None:
+                    self.progress(done, len(jobs))
+
+        limiters = {database: self._limiter(database) for database in self.databases}
+        # cached searches need no token
+        calls = [(None if self.services.is_cached(database, name) else limiters[database],
+                  functools.partial(search, name, database)) for name, database in jobs]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # the cancelled job submits no more
+            futures = submit_throttled(executor, calls, self.max_workers,
+                                       stop=lambda: self.cancelled)
+            wait([fut for fut in futures if fut is not None])
+        return {name: found for name, found in results.items() if found}
+
+    def _limiter(self, database: str):
+        try:
+            return self.services.limiter(database)
+        except NetworkError:
+            # the searches of database fail on their own
+            return None
+
+    def _search(self, database: str, name: str) -> Optional[List[dict]]:
+        if self.cancelled:
+            return None
+        try:
+            if database == 'chebi':
+                return self.services.annot_search_chebi(name)[:self.limit]
+            # the first page is what the dialog (and the prefetcher) cache
+            return list(self.services.iter_search_uniprot(name))[:self.limit]
+        except NetworkError:
+            pass
+        except Exception:
+            logging.exception('Error while searching %s for %r', database, name)
+        with self._lock:
+            self.errors += 1
+        return None
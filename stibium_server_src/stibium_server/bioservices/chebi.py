@@ -34,8 +34,10 @@
 
 
 """
+import io
 import logging
 from .services import WSDLService
+from .xmlstream import iter_records
 # from services import logger
 # logger.name = __name__
 
@@ -52,13 +54,15 @@ class ChEBI(WSDLService):
 
     """
     _url = "http://www.ebi.ac.uk/webservices/chebi/2.0/webservice?wsdl"
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, url=None):
         """.. rubric:: Constructor
 
         :param bool verbose:
+        :param str url: URL of the WSDL, if not the EBI one (e.g. a local
+            stand-in server, see :mod:`stibium_server.standin`)
 
         """
-        super(ChEBI, self).__init__(name="ChEBI", url=ChEBI._url,
+        super(ChEBI, self).__init__(name="ChEBI", url=url or ChEBI._url,
             verbose=verbose)
 
     def getCompleteEntity(self, chebiId):
@@ -178,6 +182,45 @@ chemical structures, using the ChEBI identifier.
         res = self.serv.getCompleteEntityByList(chebiIdList)
         return res
 
+    #: fields of the records of :meth:`iter_complete_entities` by default
+    entity_fields = {
+        "chebiId": "chebiId",
+        "chebiAsciiName": "chebiAsciiName",
+        "definition": "definition",
+        "entityStar": "entityStar",
+        "mass": "mass",
+        "smiles": "smiles",
+    }
+
+    def iter_complete_entities(self, chebiIdList, fields=None, lists=()):
+        """Streaming alternative to :meth:`getCompleteEntityByList`
+
+        Takes any number of identifiers, requests them 50 at a time and parses
+        each raw XML reply incrementally (see
+        :func:`~stibium_server.bioservices.xmlstream.iter_records`) instead of
+        building suds objects: only the requested fields of each entity are
+        kept.
+
+        :param list chebiIdList: ChEBI identifiers
+        :param dict fields: field name -> path of the value in the entity
+            element. Defaults to :attr:`entity_fields`.
+        :param lists: names of the fields that are lists of all the values
+        :return: a generator of dictionaries, one per entity found
+
+        ::
+
+            >>> parents = {"parents": "OntologyParents/chebiId"}
+            >>> for ent in ch.iter_complete_entities(ids, parents, lists=["parents"]):
+            ...     print(ent["parents"])
+
+        """
+        fields = fields or self.entity_fields
+        ids = list(chebiIdList)
+        for i in range(0, len(ids), 50):
+            reply = self.wsdl_call_xml("getCompleteEntityByList", ids[i:i + 50])
+            for record in iter_records(io.BytesIO(reply), "return", fields, lists):
+                yield record
+
     def getOntologyParents(self, chebiId):
         """Retrieves the ontology parents of an entity including the relationship type
 
@@ -0,0 +1,213 @@
+"""Thread-safe token-bucket rate limiting shared per host
+
+A :class:`TokenBucket` holds up to *capacity* tokens and refills at *rate*
+tokens per second. Each request takes one token. Callers that find the bucket
+empty reserve the next token under the lock and then sleep outside of it, so
+concurrent callers are served in order without holding the lock while waiting.
+
+Limiters are shared by host and port (see :func:`get_limiter`) so that several
+service instances talking to the same provider stay within its limits together.
+
+:meth:`TokenBucket.acquire` sleeps in the calling thread. Batches of calls run
+on a thread pool go through :func:`submit_throttled` instead: the submitting
+thread waits for the tokens and the workers only run calls whose token is
+already taken, so no worker is held while the limiter throttles.
+"""
+import asyncio
+import collections
+import threading
+import time
+
+__all__ = ["TokenBucket", "get_limiter", "submit_throttled"]
+
+
+class TokenBucket(object):
+    """Token bucket with burst capacity
+
+    :param float rate: number of tokens added per second
+    :param float capacity: maximum number of tokens (burst size). Defaults to
+        one second worth of tokens.
+    """
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        # tokens taken for the calls of the current thread by submit_throttled
+        self._prepaid = threading.local()
+
+        #: total number of seconds callers spent waiting for a token
+        self.throttled_time = 0.
+        #: number of acquisitions that had to wait
+        self.throttled_calls = 0
+        #: total number of tokens handed out
+        self.acquired = 0
+
+    def _refill(self, now):
+        elapsed = now - self._last
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._last = now
+
+    def _reserve(self, timeout=None):
+        """Take a token, possibly in advance; return the seconds to wait or None"""
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = 0. if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if timeout is not None and wait > timeout:
+                return None
+            self._tokens -= 1
+            self.acquired += 1
+            if wait > 0:
+                self.throttled_calls += 1
+                self.throttled_time += wait
+            return wait
+
+    def set_rate(self, rate):
+        """Change the rate; the tokens accumulated so far are kept"""
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+
+    def delay(self):
+        """Seconds until a token is available, without taking it"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0. if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def try_acquire(self):
+        """Take a token if one is available right now. Never blocks."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.acquired += 1
+                return True
+            return False
+
+    def acquire(self, timeout=None):
+        """Take a token, sleeping until it is available
+
+        :param float timeout: give up (and return False) if the token would
+            not be available within *timeout* seconds
+        :return: True if a token was acquired
+        """
+        prepaid = getattr(self._prepaid, 'count', 0)
+        if prepaid:
+            self._prepaid.count = prepaid - 1
+            return True
+        wait = self._reserve(timeout)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    async def acquire_async(self, timeout=None):
+        """Coroutine version of :meth:`acquire` that does not block the loop"""
+        wait = self._reserve(timeout)
+        if wait is None:
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+    def metrics(self):
+        """Return a dictionary with the throttling statistics"""
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'capacity': self.capacity,
+                'acquired': self.acquired,
+                'throttled_calls': self.throttled_calls,
+                'throttled_time': self.throttled_time,
+            }
+
+
+def _prepaid_call(limiter, fn):
+    def call():
+        limiter._prepaid.count = 1
+        try:
+            return fn()
+        finally:
+            limiter._prepaid.count = 0
+    return call
+
+
+def submit_throttled(executor, calls, max_in_flight, stop=None):
+    """Submit calls to *executor*, each once its rate limiter has a token for it
+
+    :param calls: iterable of ``(limiter, fn)`` pairs. *fn* is called without
+        arguments on a worker, and its first :meth:`TokenBucket.acquire` of
+        *limiter* in that thread uses the token taken here. *limiter* may be
+        None for calls that need no token, e.g. answered from a cache.
+    :param int max_in_flight: maximum number of calls submitted and not
+        finished, normally the number of workers of *executor*
+    :param stop: optional callable; once it returns True, no more calls are
+        submitted
+    :return: the futures of the calls, in the order of *calls*; None for the
+        calls that were not submitted
+
+    The calling thread waits for free workers and for the tokens. A call whose
+    limiter is empty does not hold back the calls of other limiters.
+    """
+    calls = list(calls)
+    futures = [None] * len(calls)
+    queues = collections.OrderedDict()
+    for i, (limiter, fn) in enumerate(calls):
+        queues.setdefault(limiter, collections.deque()).append((i, fn))
+    slots = threading.Semaphore(max_in_flight)
+    while queues:
+        slots.acquire()
+        if stop is not None and stop():
+            slots.release()
+            break
+        picked = None
+        wait = None
+        for limiter, queue in queues.items():
+            if limiter is None or limiter.try_acquire():
+                picked = limiter, queue
+                break
+            delay = limiter.delay()
+            wait = delay if wait is None else min(wait, delay)
+        if picked is None:
+            slots.release()
+            time.sleep(wait)
+            continue
+        limiter, queue = picked
+        i, fn = queue.popleft()
+        if not queue:
+            del queues[limiter]
+        if limiter is not None:
+            fn = _prepaid_call(limiter, fn)
+        futures[i] = executor.submit(fn)
+        futures[i].add_done_callback(lambda _: slots.release())
+    return futures
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host, rate, capacity=None):
+    """Return the :class:`TokenBucket` shared by all services of *host*
+
+    *host* is a host name, followed by ``:port`` when the URL has one.
+
+    The first caller for a host decides its rate and capacity. If a later
+    caller asks for a lower rate, the shared limiter is slowed down to it so
+    that the strictest limit of a provider is always honoured.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = TokenBucket(rate, capacity)
+            _limiters[host] = limiter
+        elif rate < limiter.rate:
+            limiter.set_rate(rate)
+        return limiter
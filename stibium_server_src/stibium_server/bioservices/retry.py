@@ -0,0 +1,147 @@
+"""Bounded retries with jittered backoff and per-service circuit breakers
+
+:func:`call_with_retries` retries an idempotent call a bounded number of
+times, sleeping a random ("full jitter") exponential backoff in between.
+A :class:`CircuitBreaker` counts consecutive failed calls of a service (a
+call fails once its retries are exhausted). Once the
+threshold is reached it opens and calls fail immediately with
+:class:`CircuitOpenError` instead of waiting out a timeout. After
+*reset_timeout* seconds a single half-open probe is let through; its outcome
+closes the breaker again or keeps it open for another period.
+"""
+import random
+import threading
+import time
+
+__all__ = ["CircuitBreaker", "CircuitOpenError", "call_with_retries",
+           "get_breaker"]
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit breaker is open"""
+    def __init__(self, name, retry_in):
+        self.name = name
+        self.retry_in = retry_in
+
+    def __str__(self):
+        return "service %s is unavailable (retry in %.1fs)" % (self.name, self.retry_in)
+
+
+class CircuitBreaker(object):
+    """Closed/open/half-open circuit breaker
+
+    :param str name: name of the protected service (used in errors)
+    :param int failure_threshold: consecutive failures that open the circuit
+    :param float reset_timeout: seconds to wait before a half-open probe
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.
+        self._probe_at = 0.
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise :class:`CircuitOpenError` if the call must not be attempted"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN:
+                retry_in = self._opened_at + self.reset_timeout - time.monotonic()
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+                # let exactly one probe through
+                self.state = self.HALF_OPEN
+                self._probe_at = time.monotonic()
+                return
+            # half-open: a probe is already in flight, unless it got lost
+            retry_in = self._probe_at + self.reset_timeout - time.monotonic()
+            if retry_in > 0:
+                raise CircuitOpenError(self.name, retry_in)
+            self._probe_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def _is_open(self):
+        return self.state != self.CLOSED
+    is_open = property(_is_open)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, failure_threshold=5, reset_timeout=30.):
+    """Return the :class:`CircuitBreaker` shared by all users of *name*"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+            _breakers[name] = breaker
+        return breaker
+
+
+def call_with_retries(fn, retries=3, backoff=0.2, max_backoff=2.,
+                      retry_on=(Exception,), is_failure=None, breaker=None,
+                      discard=None):
+    """Call *fn* and retry it on failure
+
+    Only use this with idempotent calls.
+
+    :param fn: callable without arguments
+    :param int retries: number of retries after the first attempt
+    :param float backoff: base delay; attempt *n* sleeps a random time up to
+        ``min(max_backoff, backoff * 2 ** n)``
+    :param retry_on: exception types that are retried. Others propagate.
+    :param is_failure: optional predicate on the return value of *fn*. Failed
+        results are retried; the last one is returned as is.
+    :param breaker: optional :class:`CircuitBreaker` consulted before every
+        attempt. While it is open no further attempt is made. A call that
+        fails after its last attempt counts as one failure, however many
+        attempts it made.
+    :param discard: optional callable on each failed result that is retried
+        rather than returned, e.g. to close a streamed response
+    """
+    attempt = 0
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        # the last attempt, or a half-open probe, which is not retried
+        last = attempt >= retries or (breaker is not None and breaker.is_open)
+        try:
+            result = fn()
+        except retry_on:
+            if last:
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+        else:
+            if is_failure is None or not is_failure(result):
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+            if last:
+                if breaker is not None:
+                    breaker.record_failure()
+                return result
+            if discard is not None:
+                discard(result)
+        time.sleep(random.uniform(0, min(max_backoff, backoff * 2 ** attempt)))
+        attempt += 1
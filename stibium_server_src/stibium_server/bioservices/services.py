@@ -19,6 +19,7 @@
 #$Id$
 """Modules with common tools to access web resources"""
 from __future__ import print_function
+import functools
 import os
 import sys
 import time
@@ -27,7 +28,11 @@ import platform
 import traceback
 import logging
 
-from .settings import BioServicesConfig
+from .settings import ServiceSettings
+from .sessions import get_session_pool, RequestsTransport
+from .ratelimit import get_limiter, submit_throttled
+from .retry import CircuitOpenError, call_with_retries, get_breaker
+from .xmlstream import iter_records
 
 # fixing compatiblity python 2 and 3 related to merging or urllib and urllib2 in python 3
 try:
@@ -116,13 +121,9 @@ class Service(object):
         self.name = name
         self.logging = Logging("bioservices:%s" % self.name, verbose)
 
+        # The URL is not probed here: an extra un-pooled request per service
+        # costs a full TCP/TLS handshake and errors surface on the first call
         self._url = url
-        try:
-            if self.url is not None:
-                urlopen(self.url)
-        except Exception as err:
-            if url_defined_later is False:
-                self.logging.warning("The URL (%s) provided cannot be reached." % self.url)
         self._easyXMLConversion = True
 
         # used by HGNC where some XML contains non-utf-8 characters !!
@@ -131,32 +132,43 @@ class Service(object):
         #self._fixing_encoding = "utf-8"
 
         self.devtools = DevTools()
-        self.settings = BioServicesConfig()
-
-        self._last_call = 0
+        # view of the shared configuration, loaded once per process
+        self.settings = ServiceSettings()
+
+        self._limiter = None
+
+    def _get_limiter(self):
+        if self._limiter is None:
+            self._limiter = get_limiter(self._get_host(), self.requests_per_sec)
+        return self._limiter
+    limiter = property(_get_limiter,
+            doc="token bucket shared by all services of the same host and port")
+
+    def _get_host(self):
+        # services of a provider on other ports, such as local stand-ins, are
+        # limited separately
+        parts = urlparse(self.url) if self.url else None
+        if parts is None or not parts.hostname:
+            return self.name
+        if parts.port is not None:
+            return "%s:%s" % (parts.hostname, parts.port)
+        return parts.hostname
+
+    def _get_breaker(self):
+        return get_breaker(self._get_host(),
+                           failure_threshold=self.settings.BREAKER_THRESHOLD,
+                           reset_timeout=self.settings.BREAKER_RESET)
+    breaker = property(_get_breaker,
+            doc="circuit breaker shared by all services of the same host and port")
 
     def _calls(self):
-        time_lapse = 1. / self.requests_per_sec
-        current_time = time.time()
-        dt = current_time - self._last_call
-        
-        if self._last_call == 0:
-            self._last_call = current_time
-            return
-        else:
-            self._last_call = current_time
-            if dt > time_lapse:
-                return
-            else:
-                time.sleep(time_lapse - dt)
-        
-
+        self.limiter.acquire()
 
     def _get_caching(self):
-        return self.settings.params['cache.on'][0]
+        return self.settings.CACHING
     def _set_caching(self, caching):
         self.devtools.check_param_in_list(caching, [True, False])
-        self.settings.params['cache.on'][0] = caching
+        self.settings.CACHING = caching
         # reset the session, which will be automatically created if we
         # access to the session attribute
         self._session = None
@@ -170,6 +182,7 @@ class Service(object):
         if url is not None:
             url = url.rstrip("/")
             self._url = url
+            self._limiter = None
     url = property(_get_url, _set_url, doc="URL of this service")
 
     def _get_easyXMLConversion(self):
@@ -250,16 +263,21 @@ class WSDLService(Service):
 
         self.logging.info("Initialising %s service (WSDL)" % self.name)
         self.CACHING = cache
+        self._suds_xml = None
 
         try:
             #: attribute to access to the methods provided by this WSDL service
             from suds.client import Client
             from suds.cache import ObjectCache
             oc = ObjectCache(self.settings.user_config_dir, days=0)
+            transport = RequestsTransport(get_session_pool(self.settings).get(),
+                limiter=self.limiter, breaker=self.breaker,
+                settings=self.settings)
             if self.CACHING is True:
-                self.suds = Client(self.url, cache=oc, cachingpolicy=1)
+                self.suds = Client(self.url, cache=oc, cachingpolicy=1,
+                                   transport=transport)
             else:
-                self.suds = Client(self.url)
+                self.suds = Client(self.url, transport=transport)
             # reference to the service
             self.serv = self.suds.service
             self._update_settings()
@@ -268,7 +286,27 @@ class WSDLService(Service):
             raise Exception
 
     def _update_settings(self):
-        self.TIMEOUT = self.settings.TIMEOUT
+        # the transport reads the timeout from the settings on each call;
+        # this only keeps the suds options consistent
+        self.suds.set_options(timeout=self.settings.TIMEOUT)
+
+    def wsdl_call_xml(self, method, *args):
+        """Call a method of the service and return the raw XML reply (bytes)
+
+        Unlike :attr:`serv`, the reply is not unmarshalled into suds objects,
+        so that large replies can be parsed incrementally, e.g. with
+        :func:`~stibium_server.bioservices.xmlstream.iter_records`. The
+        requests go through the same transport, rate limiter and circuit
+        breaker.
+        """
+        if self._suds_xml is None:
+            from suds.client import Client
+            self._suds_xml = Client(self.url, transport=self.suds.options.transport,
+                                    retxml=True, timeout=self.suds.options.timeout)
+        reply = getattr(self._suds_xml.service, method)(*args)
+        if isinstance(reply, str):
+            reply = reply.encode("utf-8")
+        return reply
 
     def wsdl_methods_info(self):
         methods = self.suds.wsdl.services[0].ports[0].methods.values()
@@ -309,7 +347,7 @@ class WSDLService(Service):
         return params
 
     def _get_timeout(self):
-        return self.suds.options.timeout
+        return self.settings.TIMEOUT
     def _set_timeout(self, value):
         self.suds.set_options(timeout=value)
         self.settings.TIMEOUT = value
@@ -342,12 +380,11 @@ class RESTbase(Service):
 
 
 import requests         # replacement for urllib2 (2-3 times faster)
+from concurrent.futures import ThreadPoolExecutor
 from requests.models import Response
 import requests_cache   # use caching wihh requests
-#import grequests        # use asynchronous requests with gevent
-# Note that grequests should be imported after requests_cache. Otherwise,
-# one should use a session instance when calling grequests.get, which we do
-# here below
+# asynchronous requests run on a thread pool (see REST._get_async); grequests
+# and gevent do not work under python3
 
 
 class REST(RESTbase):
@@ -431,7 +468,7 @@ class REST(RESTbase):
 
         self._session = None
 
-        self.settings.params['cache.on'][0] = cache
+        self.settings.CACHING = cache
 
         if self.CACHING:
             #import requests_cache
@@ -477,25 +514,20 @@ class REST(RESTbase):
     session = property(_get_session)
 
     def _create_session(self):
-        """Creates a normal session using HTTPAdapter
-        max retries is defined in the :attr:`MAX_RETRIES`
+        """Returns the shared keep-alive session of the connection pool
+        pool sizes and max retries are defined in the settings (see
+        :func:`~stibium_server.bioservices.sessions.get_session_pool`)
         """
-        self.logging.debug("Creating session (uncached version)")
-        self._session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(max_retries=self.settings.MAX_RETRIES)
-        #, pool_block=True does not work with asynchronous requests
-        self._session.mount('http://', adapter)
-        self._session.mount('https://', adapter)
+        self.logging.debug("Using pooled session (uncached version)")
+        self._session = get_session_pool(self.settings).get()
         return self._session
 
     def _create_cache_session(self):
-        """Creates a cached session using requests_cache package"""
-        self.logging.debug("Creating session (cache version)")
+        """Returns the shared cached session using requests_cache package"""
+        self.logging.debug("Using pooled session (cache version)")
         if not self._session:
-            #import requests_cache
-            self.logging.debug("No cached session created yet. Creating one")
-            self._session = requests_cache.CachedSession(self.CACHE_NAME,
-                         backend='sqlite', fast_save=self.settings.FAST_SAVE)
+            self._session = get_session_pool(self.settings).get(self.CACHE_NAME,
+                fast_save=self.settings.FAST_SAVE)
         return self._session
 
     def _get_timeout(self):
@@ -533,48 +565,105 @@ class REST(RESTbase):
     def _apply(self, iterable, fn, *args, **kwargs):
         return [fn(x, *args, **kwargs) for x in iterable if x is not None]
 
-    def _get_async(self, keys, frmt='json', params={}):
-        # does not work under pyhon3 so local import
-        import grequests
-        session = self._get_session()
-        try:
-            # build the requests
-            urls = self._get_all_urls(keys, frmt)
-            self.logging.debug("grequests.get processing")
-            rs = (grequests.get(url, session=session, params=params)  for key,url in zip(keys, urls))
-            # execute them
-            self.logging.debug("grequests.map call")
-            ret = grequests.map(rs, size=min(self.settings.CONCURRENT, len(keys)))
-            self.last_response = ret
-            self.logging.debug("grequests.map call done")
-            return ret
-        except Exception as err:
-            self.logging.warning("Error caught in async. " + err.message)
+    def _get_async(self, keys, frmt='json', params={}, **kargs):
+        """Fetch all *keys* concurrently on a thread pool
+
+        At most :attr:`settings.CONCURRENT` requests are in flight at once,
+        and each of them goes through the rate limiter, the retries and the
+        circuit breaker of :meth:`_send_idempotent`. The requests are
+        submitted as the limiter hands out tokens (see
+        :func:`~stibium_server.bioservices.ratelimit.submit_throttled`), so
+        the workers do not sleep on it.
+
+        :return: a list in the same order as *keys*. Each item is either the
+            :class:`requests.Response` or the exception raised for that key.
+        """
+        urls = list(self._get_all_urls(keys, frmt))
+        if len(urls) == 0:
             return []
 
+        # the errors of get_async are not a parameter of the requests
+        kargs.pop('errors', None)
+        kargs['params'] = params
+        kargs.setdefault('timeout', (self.settings.CONNECT_TIMEOUT, self.TIMEOUT))
+        kargs['proxies'] = self.proxies
+        kargs['cert'] = self.cert
+        if hasattr(self, 'authentication'):
+            kargs['auth'] = self.authentication
+
+        def fetch(url):
+            try:
+                return self._send_idempotent('GET', url, **kargs)
+            except Exception as err:
+                return err
+
+        workers = max(1, min(self.settings.CONCURRENT, len(urls)))
+        self.logging.debug("Fetching %s urls with %s workers" % (len(urls), workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # the futures are in the order of the keys
+            futures = submit_throttled(executor,
+                [(self.limiter, functools.partial(fetch, url)) for url in urls], workers)
+            ret = [fut.result() for fut in futures]
+        self.last_response = ret
+        return ret
+
     def _get_all_urls(self, keys, frmt=None):
         return ('%s/%s' % (self.url, query) for query in keys)
 
-    def get_async(self, keys, frmt='json', params={}, **kargs):
+    def get_async(self, keys, frmt='json', params={}, errors=None, **kargs):
+        """Concurrent version of :meth:`get_sync`
+
+        Failed keys are None in the returned list.
+
+        :param dict errors: if given, the exception of each failed key is
+            stored in it, keyed by the failed key. It belongs to the caller, so
+            concurrent calls on the same service do not mix their errors.
+        """
         ret = self._get_async(keys, frmt, params=params, **kargs)
-        return self._apply(ret, self._interpret_returned_request, frmt)
+        results = []
+        for key, res in zip(keys, ret):
+            if isinstance(res, Exception):
+                self.logging.warning("Request for %s failed: %s" % (key, res))
+                if errors is not None:
+                    errors[key] = res
+                results.append(None)
+                continue
+            res = self._interpret_returned_request(res, frmt)
+            try:
+                # for python 3 compatibility
+                res = res.decode()
+            except:
+                pass
+            results.append(res)
+        return results
 
     def get_sync(self, keys, frmt='json', **kargs):
         return [self.get_one(key, frmt=frmt, **kargs) for key in keys]
 
-    def http_get(self, query, frmt='json', params={}, **kargs):
+    def http_get(self, query, frmt='json', params={}, errors=None, **kargs):
         """
         * query is the suffix that will be appended to the main url attribute.
         * query is either a string or a list of strings.
         * if list is larger than ASYNC_THRESHOLD, use asynchronous call.
+        * for a list, failed keys are None and, if an *errors* dict is given,
+          their exceptions are stored in it as by :meth:`get_async`, on both
+          the synchronous and the asynchronous path.
         """
         if isinstance(query, list) and len(query) > self.settings.ASYNC_THRESHOLD:
             self.logging.debug("Running async call for a list")
-            return self.get_async(query, frmt, params=params, **kargs)
+            return self.get_async(query, frmt, params=params, errors=errors, **kargs)
 
         if isinstance(query, list) and len(query) <= self.settings.ASYNC_THRESHOLD:
             self.logging.debug("Running sync call for a list")
-            return [self.get_one(key, frmt, params=params, **kargs) for key in query]
+            results = []
+            for key in query:
+                try:
+                    results.append(self.get_one(key, frmt, params=params, **kargs))
+                except (CircuitOpenError, requests.ConnectionError, requests.Timeout) as err:
+                    if errors is not None:
+                        errors[key] = err
+                    results.append(None)
+            return results
             #return self.get_sync(query, frmt)
 
         # OTHERWISE
@@ -600,11 +689,38 @@ class REST(RESTbase):
 
         return self.get_one(query, frmt=frmt, params=params,  **kargs)
 
+    #: status codes of GET requests that are retried
+    retry_status = (500, 502, 503, 504)
+
+    def _send_idempotent(self, method, url, **kargs):
+        """Send a request with retries and through the circuit breaker
+
+        Connection errors, timeouts and :attr:`retry_status` responses are
+        retried up to :attr:`settings.MAX_RETRIES` times. Responses that are
+        retried are closed, so that streamed ones give their connection back
+        to the pool. While the service is down,
+        :class:`~stibium_server.bioservices.retry.CircuitOpenError` is raised
+        immediately.
+        """
+        def send():
+            self._calls()
+            return self.session.request(method, url, **kargs)
+        return call_with_retries(send, retries=self.settings.MAX_RETRIES,
+            backoff=self.settings.RETRY_BACKOFF,
+            retry_on=(requests.ConnectionError, requests.Timeout),
+            is_failure=lambda res: res.status_code in self.retry_status,
+            breaker=self.breaker, discard=lambda res: res.close())
+
     def get_one(self, query=None, frmt='json', params={}, **kargs):
         """
         if query starts with http:// do not use self.url
+
+        :raises: :class:`~stibium_server.bioservices.retry.CircuitOpenError`
+            while the service is down, and the connection error or timeout of
+            the last attempt once the retries are exhausted, so that callers
+            can tell them from an empty result. Other errors are logged and
+            None is returned.
         """
-        self._calls()
         url = self._build_url(query)
 
         if url.count('//') >1:
@@ -613,7 +729,7 @@ class REST(RESTbase):
         self.logging.debug(url)
         try:
             kargs['params'] = params
-            kargs['timeout'] = self.TIMEOUT
+            kargs['timeout'] = (self.settings.CONNECT_TIMEOUT, self.TIMEOUT)
             kargs['proxies'] = self.proxies
             kargs['cert'] = self.cert
             # Used only in biomart with cosmic database
@@ -622,7 +738,7 @@ class REST(RESTbase):
                 kargs['auth'] = self.authentication
 
             #res = self.session.get(url, **{'timeout':self.TIMEOUT, 'params':params})
-            res = self.session.get(url, **kargs)
+            res = self._send_idempotent('GET', url, **kargs)
 
             self.last_response = res
             res = self._interpret_returned_request(res, frmt)
@@ -632,11 +748,86 @@ class REST(RESTbase):
             except:
                 pass
             return res
+        except (CircuitOpenError, requests.ConnectionError, requests.Timeout) as err:
+            self.logging.warning("Query unsuccesful: %s" % err)
+            raise
         except Exception as err:
             self.logging.critical(err)
             self.logging.critical("""Query unsuccesful. Maybe too slow response.
     Consider increasing it with settings.TIMEOUT attribute {}""".format(self.settings.TIMEOUT))
 
+    def get_lines(self, query=None, params={}, **kargs):
+        """Stream a text response line by line
+
+        Unlike :meth:`get_one`, the body is not read at once: lines are
+        yielded (decoded, without line terminator) as they arrive from the
+        socket and the connection goes back to the pool when the generator is
+        exhausted or closed.
+
+        :raises: :class:`requests.RequestException` if the request fails or
+            the status is not OK
+        """
+        kargs['params'] = params
+        return self._stream_lines('GET', query, **kargs)
+
+    def post_lines(self, query=None, data=None, **kargs):
+        """Same as :meth:`get_lines` for a POST request
+
+        Only for POST requests that are queries (e.g. the UniProt mapping
+        service): unlike :meth:`post_one`, they are retried like GET requests.
+        """
+        kargs['data'] = data
+        return self._stream_lines('POST', query, **kargs)
+
+    def get_xml_records(self, query, tag, fields, lists=(), params={}, **kargs):
+        """Stream the records of an XML response
+
+        The response is parsed as it arrives with
+        :func:`~stibium_server.bioservices.xmlstream.iter_records`, which
+        yields a dictionary of the requested *fields* per *tag* element and
+        discards each element once read. Use it instead of :meth:`easyXML`
+        for large documents.
+
+        :raises: :class:`requests.RequestException` if the request fails or
+            the status is not OK
+        """
+        kargs['params'] = params
+        res = self._open_stream('GET', query, **kargs)
+        try:
+            # the raw stream skips the text decoding; gzip is still undone
+            res.raw.decode_content = True
+            for record in iter_records(res.raw, tag, fields, lists):
+                yield record
+        finally:
+            res.close()
+
+    def _stream_lines(self, method, query, **kargs):
+        res = self._open_stream(method, query, **kargs)
+        try:
+            for line in res.iter_lines():
+                yield line.decode('utf-8')
+        finally:
+            res.close()
+
+    def _open_stream(self, method, query, **kargs):
+        url = self._build_url(query)
+        self.logging.debug(url)
+        kargs['timeout'] = (self.settings.CONNECT_TIMEOUT, self.TIMEOUT)
+        kargs['proxies'] = self.proxies
+        kargs['cert'] = self.cert
+        kargs['stream'] = True
+        if hasattr(self, 'authentication'):
+            kargs['auth'] = self.authentication
+
+        res = self._send_idempotent(method, url, **kargs)
+        self.last_response = res
+        try:
+            res.raise_for_status()
+        except Exception:
+            res.close()
+            raise
+        return res
+
     def http_post(self, query, params=None, data=None,
                     frmt='xml', headers=None, files=None, content=None, **kargs):
         # query and frmt are bioservices parameters. Others are post parameters
@@ -676,7 +867,19 @@ class REST(RESTbase):
             url = '%s/%s' % (self.url, query)
         self.logging.debug(url)
         try:
-            res = self.session.post(url, **kargs)
+            # POST is not retried but still fails fast while the service is down
+            kargs.setdefault('timeout', (self.settings.CONNECT_TIMEOUT, self.TIMEOUT))
+            breaker = self.breaker
+            breaker.before_call()
+            try:
+                res = self.session.post(url, **kargs)
+            except (requests.ConnectionError, requests.Timeout):
+                breaker.record_failure()
+                raise
+            if res.status_code in self.retry_status:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
             self.last_response = res
             res = self._interpret_returned_request(res, frmt)
             try:
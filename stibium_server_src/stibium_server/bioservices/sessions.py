@@ -0,0 +1,243 @@
+"""Process-wide HTTP connection pool shared by the REST and WSDL services
+
+Every :class:`~stibium_server.bioservices.services.REST` instance used to
+create its own :class:`requests.Session`, and the SOAP services went through
+urllib without any connection reuse. The :class:`SessionPool` defined here
+hands out one keep-alive session per cache name so that repeated queries to
+the same EBI/UniProt hosts reuse open TCP/TLS connections.
+"""
+import io
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+import requests_cache
+
+from .retry import call_with_retries
+
+try:
+    from suds.transport import Transport, Reply, TransportError
+except ImportError:
+    Transport = object
+
+__all__ = ["SessionPool", "get_session_pool", "pool_parameters", "RequestsTransport"]
+
+
+class SessionPool(object):
+    """Thread-safe registry of pooled :class:`requests.Session` objects
+
+    :param int pool_connections: number of host pools to keep alive
+    :param int pool_maxsize: maximum number of connections kept per host
+    :param bool pool_block: if True, wait for a free connection instead of
+        opening (and discarding) a temporary one when a host pool is full
+    :param int max_retries: low-level connection retries of the adapter
+
+    Sessions are keyed by cache name; ``None`` is the uncached session.
+    """
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False,
+                 max_retries=0):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._hooks = []
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+
+    def configure(self, pool_connections=None, pool_maxsize=None,
+                  pool_block=None, max_retries=None):
+        """Change the pool parameters
+
+        Sessions that are already open get new adapters with the new
+        parameters (and their idle connections are closed), so that the
+        services holding them use the new pool sizes too. Nothing is done if
+        the parameters did not change.
+        """
+        with self._lock:
+            current = (self.pool_connections, self.pool_maxsize,
+                       self.pool_block, self.max_retries)
+            if pool_connections is not None:
+                self.pool_connections = pool_connections
+            if pool_maxsize is not None:
+                self.pool_maxsize = pool_maxsize
+            if pool_block is not None:
+                self.pool_block = pool_block
+            if max_retries is not None:
+                self.max_retries = max_retries
+            if current == (self.pool_connections, self.pool_maxsize,
+                           self.pool_block, self.max_retries):
+                return
+            for session in self._sessions.values():
+                self._mount(session)
+
+    def _new_adapter(self):
+        return HTTPAdapter(pool_connections=self.pool_connections,
+                           pool_maxsize=self.pool_maxsize,
+                           pool_block=self.pool_block,
+                           max_retries=self.max_retries)
+
+    def _mount(self, session):
+        # a single adapter per session, so that http and https share the
+        # same pool manager
+        previous = session.adapters.get('https://')
+        adapter = self._new_adapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if previous is not None:
+            # connections still in use are closed when they are released
+            previous.close()
+
+    def _new_session(self, cache_name, fast_save):
+        if cache_name is None:
+            session = requests.Session()
+        else:
+            session = requests_cache.CachedSession(cache_name,
+                backend='sqlite', fast_save=fast_save)
+        self._mount(session)
+        # HTTP/1.1 persistent connections; urllib3 does not pipeline requests
+        # but keeps the sockets open and reuses them in order
+        session.headers['Connection'] = 'keep-alive'
+        session.hooks['response'].extend(self._hooks)
+        return session
+
+    def add_response_hook(self, hook):
+        """Call *hook(response, \*\*kwargs)* on every response of every session
+
+        See the requests documentation on event hooks. This is used to record
+        exchanges with the web services (see :mod:`stibium_server.fixtures`).
+        """
+        with self._lock:
+            self._hooks.append(hook)
+            for session in self._sessions.values():
+                session.hooks['response'].append(hook)
+
+    def remove_response_hook(self, hook):
+        with self._lock:
+            self._hooks.remove(hook)
+            for session in self._sessions.values():
+                session.hooks['response'].remove(hook)
+
+    def get(self, cache_name=None, fast_save=True):
+        """Return the shared session for *cache_name*, creating it if needed"""
+        with self._lock:
+            session = self._sessions.get(cache_name)
+            if session is None:
+                session = self._new_session(cache_name, fast_save)
+                self._sessions[cache_name] = session
+            return session
+
+    def _close_all(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+    def close(self):
+        """Close all pooled connections"""
+        with self._lock:
+            self._close_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool_parameters(settings):
+    """Return the :class:`SessionPool` parameters for *settings*
+
+    A host pool keeps at least :attr:`settings.CONCURRENT` connections, so
+    that concurrent requests to one host don't open connections that are
+    dropped as soon as they are released.
+    """
+    # retries are done above the adapter, see retry.py
+    return dict(pool_connections=settings.POOL_CONNECTIONS,
+                pool_maxsize=max(settings.POOL_MAXSIZE, settings.CONCURRENT),
+                pool_block=settings.POOL_BLOCK)
+
+
+def get_session_pool(settings=None):
+    """Return the process-wide :class:`SessionPool`
+
+    The pool is created on first use from *settings* (a
+    :class:`~stibium_server.bioservices.settings.ServiceSettings`); later
+    calls ignore the argument and return the same pool. Use
+    :meth:`SessionPool.configure` with :func:`pool_parameters` to apply a
+    configuration change.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if settings is None:
+                _pool = SessionPool()
+            else:
+                _pool = SessionPool(**pool_parameters(settings))
+        return _pool
+
+
+class RequestsTransport(Transport):
+    """suds transport that sends SOAP requests through a pooled session
+
+    If a *limiter* (:class:`~stibium_server.bioservices.ratelimit.TokenBucket`)
+    is given, every SOAP call takes a token from it first. If a *breaker*
+    (:class:`~stibium_server.bioservices.retry.CircuitBreaker`) is given,
+    calls fail fast while the service is down and connection errors, timeouts
+    and gateway errors are retried up to *retries* times. The SOAP services
+    wrapped here (ChEBI) only expose read-only queries, so retrying the POST
+    requests is safe.
+
+    If *settings* (:class:`~stibium_server.bioservices.settings.ServiceSettings`)
+    are given, the timeouts and retries are read from them on each call
+    instead, so that configuration changes apply to existing clients.
+    """
+    retry_status = (502, 503, 504)
+
+    def __init__(self, session, limiter=None, breaker=None, retries=0,
+                 backoff=0.2, connect_timeout=None, settings=None):
+        Transport.__init__(self)
+        self.session = session
+        self.limiter = limiter
+        self.breaker = breaker
+        self.retries = retries
+        self.backoff = backoff
+        self.connect_timeout = connect_timeout
+        self.settings = settings
+
+    def _timeout(self):
+        if self.settings is not None:
+            return (self.settings.CONNECT_TIMEOUT, self.settings.TIMEOUT)
+        if self.connect_timeout is None:
+            return self.options.timeout
+        return (self.connect_timeout, self.options.timeout)
+
+    def _call(self, fn):
+        retries, backoff = self.retries, self.backoff
+        if self.settings is not None:
+            retries, backoff = self.settings.MAX_RETRIES, self.settings.RETRY_BACKOFF
+        return call_with_retries(fn, retries=retries, backoff=backoff,
+            retry_on=(requests.ConnectionError, requests.Timeout),
+            is_failure=lambda res: res.status_code in self.retry_status,
+            breaker=self.breaker, discard=lambda res: res.close())
+
+    def open(self, request):
+        # used by suds to fetch the WSDL and imported schemas
+        res = self._call(lambda: self.session.get(request.url,
+            headers=request.headers, timeout=self._timeout()))
+        if not res.ok:
+            raise TransportError(res.reason, res.status_code,
+                                 io.BytesIO(res.content))
+        return io.BytesIO(res.content)
+
+    def send(self, request):
+        def post():
+            if self.limiter is not None:
+                self.limiter.acquire()
+            return self.session.post(request.url, data=request.message,
+                                     headers=request.headers,
+                                     timeout=self._timeout())
+        res = self._call(post)
+        if res.status_code in (202, 204):
+            return None
+        if not res.ok:
+            # suds reads SOAP faults from the body of a 500 response
+            raise TransportError(res.reason, res.status_code,
+                                 io.BytesIO(res.content))
+        return Reply(res.status_code, res.headers, res.content)
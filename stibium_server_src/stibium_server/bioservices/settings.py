@@ -21,10 +21,12 @@ import os
 from easydev import DynamicConfigParser, underline
 import copy
 import shutil
+import threading
 
 import appdirs
 
-__all__ = ["defaultParams", "BioServicesConfig"]
+__all__ = ["defaultParams", "BioServicesConfig", "ServiceSettings", "get_config",
+           "reload_config", "update_config"]
 
 
 #TODO Move some contents to easydev.config_tools
@@ -35,9 +37,16 @@ __all__ = ["defaultParams", "BioServicesConfig"]
 defaultParams = {
     'user.email': ["unknown", (str), "email addresss that may be used in some utilities (e.g. EUtils)"],
     'general.timeout': [30, (int,float), ""],
-    'general.max_retries': [3, int, ''],
+    'general.connect_timeout': [5, (int,float), 'seconds to wait for a connection to be established'],
+    'general.max_retries': [3, int, 'number of retries of idempotent requests'],
+    'general.retry_backoff': [0.2, (int,float), 'base delay in seconds between two retries'],
+    'general.breaker_threshold': [5, int, 'consecutive failures after which a service is considered down'],
+    'general.breaker_reset': [30, (int,float), 'seconds before a service that is down is probed again'],
     'general.async_concurrent': [50, int, ''],
     'general.async_threshold': [10, int, 'when to switch to asynchronous requests'],
+    'general.pool_connections': [10, int, 'number of hosts kept in the shared connection pool'],
+    'general.pool_maxsize': [10, int, 'maximum number of keep-alive connections per host'],
+    'general.pool_block': [False, bool, 'wait for a free pooled connection instead of opening a new one'],
     'cache.tag_suffix': ["_bioservices_database",str, 'suffix to append for cache databases'],
     'cache.on': [False, bool, 'CACHING on/off'],
     'cache.fast': [True, bool, "FAST_SAVE option"],
@@ -169,14 +178,17 @@ class ConfigReadOnly(object):
         return sdir
 
     def _get_config_dir(self):
-        sdir = self.appdirs.user_config_dir
-        return self._get_and_create(sdir)
+        # the directory is checked (and created) once
+        if getattr(self, "_config_dir", None) is None:
+            self._config_dir = self._get_and_create(self.appdirs.user_config_dir)
+        return self._config_dir
     user_config_dir = property(_get_config_dir,
             doc="return directory of this configuration file")
 
     def _get_cache_dir(self):
-        sdir = self.appdirs.user_cache_dir
-        return self._get_and_create(sdir)
+        if getattr(self, "_cache_dir", None) is None:
+            self._cache_dir = self._get_and_create(self.appdirs.user_cache_dir)
+        return self._cache_dir
     user_cache_dir = property(_get_cache_dir,
             doc="return directory of the cache")
 
@@ -279,3 +291,148 @@ class BioServicesConfig(ConfigReadOnly):
     def _set_max_retries(self, max_retries):
         self.params['general.max_retries'][0] = max_retries
     MAX_RETRIES = property(_get_max_retries, _set_max_retries)
+
+    def _get_pool_connections(self):
+        return self.params['general.pool_connections'][0]
+    POOL_CONNECTIONS = property(_get_pool_connections)
+
+    def _get_pool_maxsize(self):
+        return self.params['general.pool_maxsize'][0]
+    POOL_MAXSIZE = property(_get_pool_maxsize)
+
+    def _get_pool_block(self):
+        return self.params['general.pool_block'][0]
+    POOL_BLOCK = property(_get_pool_block)
+
+    def _get_connect_timeout(self):
+        return self.params['general.connect_timeout'][0]
+    CONNECT_TIMEOUT = property(_get_connect_timeout)
+
+    def _get_retry_backoff(self):
+        return self.params['general.retry_backoff'][0]
+    RETRY_BACKOFF = property(_get_retry_backoff)
+
+    def _get_breaker_threshold(self):
+        return self.params['general.breaker_threshold'][0]
+    BREAKER_THRESHOLD = property(_get_breaker_threshold)
+
+    def _get_breaker_reset(self):
+        return self.params['general.breaker_reset'][0]
+    BREAKER_RESET = property(_get_breaker_reset)
+
+
+# The configuration shared by all the services of the process. It is replaced
+# as a whole (never modified in place) by reload_config and update_config, so
+# readers always see a consistent set of parameters.
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_config():
+    """Return the process-wide :class:`BioServicesConfig`
+
+    The user configuration file is read (and the configuration and cache
+    directories created) on the first call only.
+    """
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = BioServicesConfig()
+    return _config
+
+
+def _set_values(config, values):
+    # cast each value to the type of its parameter; unknown parameters raise a KeyError
+    for key, value in values.items():
+        cast = config.params[key][1]
+        if not isinstance(value, cast):
+            cast = cast[0] if isinstance(cast, tuple) else cast
+            value = cast(value)
+        config.params[key][0] = value
+
+
+def reload_config(values=None):
+    """Read the user configuration file again and return the new configuration
+
+    Values set with :func:`update_config` are lost.
+
+    :param dict values: optional values to set on top of the file, as in
+        :func:`update_config`. They are applied before the new configuration
+        is published, so services never see the file without them.
+    """
+    global _config
+    config = BioServicesConfig()
+    if values:
+        _set_values(config, values)
+    with _config_lock:
+        _config = config
+    return config
+
+
+def update_config(values):
+    """Change parameters of the process-wide configuration at runtime
+
+    :param dict values: new values by parameter name, e.g.
+        ``{"general.timeout": 60}``. Values are cast to the type of the
+        parameter; unknown parameters raise a KeyError.
+    :return: the new configuration, which all services use from now on
+    """
+    global _config
+    current = get_config()
+    with _config_lock:
+        config = copy.copy(current)
+        config.params = copy.deepcopy(current.params)
+        _set_values(config, values)
+        _config = config
+    return config
+
+
+class ServiceSettings(object):
+    """Settings of one service: a view of the process-wide configuration
+
+    Reading an alias such as TIMEOUT returns the current value of
+    :func:`get_config`, so configuration reloads and updates apply to existing
+    services. Setting an alias (e.g. ``service.settings.TIMEOUT = 100``)
+    overrides the value for this service only. Other attributes, such as
+    :attr:`params` or :attr:`user_config_dir`, are read from the shared
+    configuration.
+
+    Creating a ServiceSettings does no filesystem work.
+    """
+    _aliases = {
+        "CACHING": "cache.on",
+        "FAST_SAVE": "cache.fast",
+        "CONCURRENT": "general.async_concurrent",
+        "ASYNC_THRESHOLD": "general.async_threshold",
+        "TIMEOUT": "general.timeout",
+        "MAX_RETRIES": "general.max_retries",
+        "POOL_CONNECTIONS": "general.pool_connections",
+        "POOL_MAXSIZE": "general.pool_maxsize",
+        "POOL_BLOCK": "general.pool_block",
+        "CONNECT_TIMEOUT": "general.connect_timeout",
+        "RETRY_BACKOFF": "general.retry_backoff",
+        "BREAKER_THRESHOLD": "general.breaker_threshold",
+        "BREAKER_RESET": "general.breaker_reset",
+    }
+
+    def __init__(self):
+        object.__setattr__(self, "_overrides", {})
+
+    def __getattr__(self, name):
+        key = self._aliases.get(name)
+        if key is None:
+            return getattr(get_config(), name)
+        if key in self._overrides:
+            return self._overrides[key]
+        return get_config().params[key][0]
+
+    def __setattr__(self, name, value):
+        key = self._aliases.get(name)
+        if key is None:
+            raise AttributeError("%s cannot be set per service" % name)
+        self._overrides[key] = value
+
+    def reset(self, name):
+        """Remove the override of an alias, to use the shared value again"""
+        self._overrides.pop(self._aliases[name], None)
@@ -43,10 +43,15 @@
 
 """
 from __future__ import print_function
+import functools
 import types
 import io
 import sys
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+from .ratelimit import submit_throttled
 from .services import REST
 # from bioservices import logger
 # logger.name = __name__
@@ -272,12 +277,14 @@ class UniProt(REST):
         # Cross-references
         'database(db_abbrev)', 'database(EMBL)']
 
-    def __init__(self, verbose=False, cache=False):
+    def __init__(self, verbose=False, cache=False, url=None):
         """**Constructor**
 
         :param verbose: set to False to prevent informative messages
+        :param url: base URL of the service, if not the UniProt one (e.g. a
+            local stand-in server, see :mod:`stibium_server.standin`)
         """
-        super(UniProt, self).__init__(name="UniProt", url=UniProt._url,
+        super(UniProt, self).__init__(name="UniProt", url=url or UniProt._url,
                                       verbose=verbose, cache=cache)
         self.TIMEOUT = 100
 
@@ -328,36 +335,97 @@ class UniProt(REST):
             instead of just a string
         .. versionchanged:: 1.3.1:: use http_post instead of http_get. This is 3 times
             faster and allows queries with more than 600 entries in one go.
+        .. versionchanged:: the response is parsed as it is received (see
+            :meth:`mapping_stream`). Use :meth:`mapping_bulk` for thousands of
+            identifiers.
         """
-        url = 'mapping/'  # the slash matters
-
-        query = self.devtools.list2string(query, sep=" ", space=False)
-        # if isinstance(query, list):
-        #    query = " ".join(query)
-        params = {'from': fr, 'to': to, 'format': "tab", 'query': query}
-        result = self.http_post(url, frmt="txt", data=params)
-
         # changes in version 1.1.1 returns a dictionary instead of list
+        result_dict = defaultdict(list)
         try:
-            result = result.split()
-            del result[0]
-            del result[0]
-        except:
-            self.logging.warning("Results seems empty...returning empty dictionary.")
+            for key, value in self.mapping_stream(fr, to, query):
+                result_dict[key].append(value)
+        except Exception as err:
+            self.logging.warning("Mapping failed (%s)" % err)
             return {}
 
-        if len(result) == 0:
+        if len(result_dict) == 0:
+            self.logging.warning("Results seems empty...returning empty dictionary.")
             return {}
-        else:
-            # bug fix based on ticket #19 version 1.1.2
-            # the default dict set empty list for all keys by default
-            from collections import defaultdict
-            result_dict = defaultdict(list)
-
-            keys = result[0::2]
-            values = result[1::2]
-            for i, key in enumerate(keys):
-                result_dict[key].append(values[i])
+        return result_dict
+
+    def mapping_stream(self, fr="ID", to="KEGG_ID", query="P13368"):
+        """Generator version of :meth:`mapping`
+
+        Yields the (source identifier, mapped identifier) pairs as the rows of
+        the response arrive, without holding the whole response in memory.
+
+        :raises: :class:`requests.RequestException` if the request fails
+        """
+        url = 'mapping/'  # the slash matters
+        query = self.devtools.list2string(query, sep=" ", space=False)
+        params = {'from': fr, 'to': to, 'format': "tab", 'query': query}
+        lines = self.post_lines(url, data=params)
+        try:
+            # skip the header (From, To)
+            next(lines, None)
+            for line in lines:
+                fields = line.split("\t")
+                if len(fields) == 2:
+                    yield fields[0], fields[1]
+        finally:
+            lines.close()
+
+    def mapping_bulk(self, fr="ID", to="KEGG_ID", query=(), chunk_size=500,
+                     max_workers=None, errors=None):
+        """Map a large number of identifiers, in concurrent chunks
+
+        Same as :meth:`mapping` for thousands of identifiers: the list is split
+        into chunks of *chunk_size* identifiers that are mapped concurrently
+        (at most :attr:`settings.CONCURRENT` at once, submitted as the rate
+        limiter of the service hands out tokens). The rows of each response are
+        merged into the result once the whole chunk is received.
+
+        :param query: list of identifiers, or a string of identifiers
+            separated by spaces
+        :param dict errors: if given, the error of each identifier of the
+            chunks that failed is stored in it. It belongs to the caller, so
+            concurrent calls on the same service do not mix their errors.
+        :return: a dictionary with a list of mapped identifiers per identifier.
+            Chunks that failed are left out, including the rows received
+            before the failure.
+
+        ::
+
+            >>> u.mapping_bulk("ACC", "PDB_ID", accessions, chunk_size=200)
+        """
+        if isinstance(query, str):
+            query = query.split()
+        ids = list(dict.fromkeys(query))
+        chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+        result_dict = defaultdict(list)
+        lock = threading.Lock()
+
+        def map_chunk(chunk):
+            rows = list()
+            try:
+                rows.extend(self.mapping_stream(fr, to, chunk))
+            except Exception as err:
+                self.logging.warning("Mapping of %s identifiers failed (%s)" % (len(chunk), err))
+                if errors is not None:
+                    with lock:
+                        errors.update((id_, err) for id_ in chunk)
+                return
+            # identifiers are unique, so each key is only filled by one chunk
+            with lock:
+                for key, value in rows:
+                    result_dict[key].append(value)
+
+        workers = max(1, min(max_workers or self.settings.CONCURRENT, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = submit_throttled(executor,
+                [(self.limiter, functools.partial(map_chunk, chunk)) for chunk in chunks], workers)
+            for fut in futures:
+                fut.result()
         return result_dict
 
     def searchUniProtId(self, uniprot_id, frmt="xml"):
@@ -379,6 +447,8 @@ class UniProt(REST):
             >>> fasta = u.retrieve([u'P29317', u'Q5BKX8', u'Q8TCD6'], frmt='fasta')
             >>> print(fasta[0])
 
+        .. seealso:: :meth:`retrieve_records` to retrieve many entries in the
+            XML format
         """
         _valid_formats = ['txt', 'xml', 'rdf', 'gff', 'fasta']
         self.devtools.check_param_in_list(frmt, _valid_formats)
@@ -393,6 +463,50 @@ class UniProt(REST):
             res = res[0]
         return res
 
+    #: fields of the records of :meth:`retrieve_records` by default
+    entry_fields = {
+        "accession": "accession",
+        "entry_name": "name",
+        "protein_name": "protein/recommendedName/fullName",
+        "genes": "gene/name",
+        "organism": "organism/name",
+        "length": "sequence@length",
+        "dataset": "@dataset",
+    }
+
+    def retrieve_records(self, uniprot_ids, fields=None, lists=("genes",),
+                         chunk_size=100, database="uniprot"):
+        """Streaming alternative to :meth:`retrieve` with the XML format
+
+        Entries are requested *chunk_size* at a time and parsed as they arrive
+        (see :func:`~stibium_server.bioservices.xmlstream.iter_records`):
+        only the requested fields of each entry are kept, so thousands of
+        entries are retrieved in constant memory.
+
+        :param uniprot_ids: a valid UniProtKB accession or a list of them
+        :param dict fields: field name -> path of the value in the ``<entry>``
+            element. Defaults to :attr:`entry_fields`.
+        :param lists: names of the fields that are lists of all the values
+        :return: a generator of dictionaries, one per entry found
+
+        ::
+
+            >>> for entry in u.retrieve_records(["P43403", "P00958"]):
+            ...     print(entry["accession"], entry["protein_name"])
+            P43403 Tyrosine-protein kinase ZAP-70
+            P00958 Methionine--tRNA ligase, cytoplasmic
+
+        """
+        fields = fields or self.entry_fields
+        ids = self.devtools.to_list(uniprot_ids)
+        for i in range(0, len(ids), chunk_size):
+            query = " OR ".join("accession:" + id_ for id_ in ids[i:i + chunk_size])
+            params = self._search_params(query, "xml", None, False, None,
+                                         False, None, None)
+            for record in self.get_xml_records(database + "/", "entry", fields,
+                                               lists, params=params):
+                yield record
+
     """def _batch(self, entries):
         #TODO test and validation
         entries = self.devtools.list2string(entries)
@@ -496,7 +610,41 @@ class UniProt(REST):
         .. warning:: some columns although valid may not return anything, not even in
             the header: 'score', 'taxonomy', 'tools'. this is a uniprot feature,
             not bioservices.
+
+        .. seealso:: :meth:`search_stream` to process the rows as they arrive.
         """
+        params = self._search_params(query, frmt, columns, include, sort,
+                                     compress, limit, offset)
+        # res = s.request("/uniprot/?query=zap70+AND+organism:9606&format=xml", params)
+        res = self.http_get(database + "/", frmt="txt", params=params)
+        return res
+
+    def search_stream(self, query, columns=None, sort="score", limit=None,
+                      offset=None, database="uniprot"):
+        """Streaming version of :meth:`search` with the tab format
+
+        Rows are parsed while the response is being received, so the first
+        ones are available before the whole body is downloaded.
+
+        :return: a generator of rows, each being the list of column values.
+            The first row is the header.
+
+        ::
+
+            >>> for row in u.search_stream("zap70", columns="id,entry name", limit=3):
+            ...     print(row)
+            ['Entry', 'Entry name']
+            ['P43403', 'ZAP70_HUMAN']
+
+        """
+        params = self._search_params(query, "tab", columns, False, sort,
+                                     False, limit, offset)
+        for line in self.get_lines(database + "/", params=params):
+            if line:
+                yield line.split("\t")
+
+    def _search_params(self, query, frmt, columns, include, sort, compress,
+                       limit, offset):
         params = {}
 
         if frmt is not None:
@@ -542,9 +690,7 @@ class UniProt(REST):
 
         # + are interpreted and have a meaning.
         params['query'] = query.replace("+", " ")
-        # res = s.request("/uniprot/?query=zap70+AND+organism:9606&format=xml", params)
-        res = self.http_get(database + "/", frmt="txt", params=params)
-        return res
+        return params
 
     def quick_search(self, query, include=False, sort="score", limit=None):
         """a specialised version of :meth:`search`
@@ -611,9 +757,9 @@ class UniProt(REST):
         """Given a list of uniprot entries, this method returns a dataframe with all possible columns
 
 
-        :param entries: list of valid entry name. if list is too large (about
-            >200), you need to split the list
-        :param chunk:
+        :param entries: list of valid entry name.
+        :param nChunk: number of entries per search. The searches are made
+            concurrently and their results concatenated.
         :param limit: limit number of entries per identifier to 10. You can 
             set it to None to keep all entries but this will be very slow
         :return: dataframe with indices being the uniprot id (e.g. DIG1_YEAST)
@@ -627,36 +773,34 @@ class UniProt(REST):
             entries = [entries]
         else:
             entries = list(set(entries))
-        output = pd.DataFrame()
 
         self.logging.info("fetching information from uniprot for {} entries".format(len(entries)))
 
-        nChunk = min(nChunk, len(entries))
-        N, rest = divmod(len(entries), nChunk)
-        for i in range(0, N + 1):
-            this_entries = entries[i * nChunk:(i + 1) * nChunk]
-            if len(this_entries):
-                self.logging.info("uniprot.get_df {}/{}".format(i + 1, N))
-                query = "+or+".join(this_entries)
-                if organism:
-                    query += "+and+" + organism
-                res = self.search(query, frmt="tab",
-                                  columns=",".join(self._valid_columns),
-                                limit=limit)
-            else:
-                break
-            if len(res) == 0:
-                self.logging.warning("some entries %s not found" % entries)
-            else:
-                try:
-                    # python 2.X
-                    df = pd.read_csv(io.StringIO(unicode(res)), sep="\t")
-                except:
-                    df = pd.read_csv(io.StringIO(str(res)), sep="\t")
-                if isinstance(output, type(None)):
-                    output = df.copy()
-                else:
-                    output = output.append(df, ignore_index=True)
+        nChunk = max(1, min(nChunk, len(entries)))
+        chunks = [entries[i:i + nChunk] for i in range(0, len(entries), nChunk)]
+
+        def fetch(chunk):
+            query = "+or+".join(chunk)
+            if organism:
+                query += "+and+" + organism
+            return self.search(query, frmt="tab", columns=",".join(self._valid_columns),
+                               limit=limit)
+
+        # the chunks are fetched concurrently; the frames are concatenated once
+        # at the end rather than appended one by one, which copies the whole
+        # frame each time
+        frames = []
+        workers = max(1, min(self.settings.CONCURRENT, len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = submit_throttled(executor,
+                [(self.limiter, functools.partial(fetch, chunk)) for chunk in chunks], workers)
+            for i, res in enumerate(fut.result() for fut in futures):
+                self.logging.info("uniprot.get_df {}/{}".format(i + 1, len(chunks)))
+                if not res or not isinstance(res, str):
+                    self.logging.warning("some entries %s not found" % chunks[i])
+                    continue
+                frames.append(pd.read_csv(io.StringIO(res), sep="\t"))
+        output = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
         # you may end up with duplicated...
         output.drop_duplicates(inplace=True)
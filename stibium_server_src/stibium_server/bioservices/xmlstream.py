@@ -0,0 +1,92 @@
+"""Streaming extraction of records from large XML documents
+
+:func:`iter_records` reads an XML document incrementally with
+:func:`xml.etree.ElementTree.iterparse` and yields one small dictionary per
+record element (e.g. each ``<entry>`` of a UniProt XML document), holding only
+the requested fields. Each record element is cleared once it has been read, so
+memory use does not grow with the number of records, unlike
+:meth:`~stibium_server.bioservices.services.Service.easyXML` which builds the
+whole document tree.
+
+Fields are given as paths of local tag names (namespaces are ignored) relative
+to the record element, optionally ending with ``@attribute``::
+
+    {"accession": "accession",
+     "protein": "protein/recommendedName/fullName",
+     "length": "sequence@length"}
+"""
+from xml.etree.ElementTree import iterparse
+
+__all__ = ["iter_records"]
+
+
+def _local(tag):
+    # "{http://uniprot.org/uniprot}entry" -> "entry"
+    return tag.rsplit("}", 1)[-1]
+
+
+def _compile(fields):
+    compiled = []
+    for name, path in fields.items():
+        path, _, attribute = path.partition("@")
+        steps = tuple(step for step in path.split("/") if step)
+        compiled.append((name, steps, attribute or None))
+    return compiled
+
+
+def iter_records(source, tag, fields, lists=()):
+    """Yield a dictionary of *fields* for each *tag* element of an XML document
+
+    :param source: file name or binary file object, read incrementally
+    :param str tag: local name of the record elements, e.g. "entry"
+    :param dict fields: field name -> path of the value in the record
+    :param lists: names of the fields that collect all the matching values in
+        a list; other fields keep the first match, or None
+    """
+    compiled = _compile(fields)
+    lists = set(lists)
+    # tags from the record element down to the current element
+    stack = []
+    record = None
+    root = None
+    for event, elem in iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            if record is None:
+                if _local(elem.tag) == tag:
+                    record = {name: [] if name in lists else None for name in fields}
+                    stack = []
+                continue
+            stack.append(_local(elem.tag))
+            continue
+
+        # end event
+        if record is None:
+            continue
+        if not stack:
+            # end of the record element itself, which may hold attributes too
+            for name, steps, attribute in compiled:
+                if not steps and attribute and elem.get(attribute) is not None:
+                    if name in lists:
+                        record[name].append(elem.get(attribute))
+                    else:
+                        record[name] = elem.get(attribute)
+            yield record
+            record = None
+            elem.clear()
+            # drop the references the root keeps to the records already read
+            root.clear()
+            continue
+        path = tuple(stack)
+        for name, steps, attribute in compiled:
+            if steps != path:
+                continue
+            value = elem.get(attribute) if attribute else (elem.text or "").strip()
+            if value is None:
+                continue
+            if name in lists:
+                record[name].append(value)
+            elif record[name] is None:
+                record[name] = value
+        stack.pop()
@@ -0,0 +1,250 @@
+'''Compact concrete syntax tree stored in flat typed arrays over the source text.
+
+A Lark parse tree is a graph of Tree and Token objects, one Python object (with its own list of
+children, or its own copy of the text) per node. CompactTree stores the same tree as a handful of
+arrays indexed by node number, in pre-order:
+
+* kind: index into a table of interned node kinds (rule names and token types)
+* start, end: offsets of the node in the source text, which is kept once
+* parent: node number of the parent, -1 for the root
+* child_start, child_count: the children of node i are
+  children[child_start[i]:child_start[i] + child_count[i]]
+
+Token text is a slice of the source, taken only when asked for. NodeView objects give a tree-like
+API over a node number; they are created on demand and hold no data of their own.
+'''
+
+from array import array
+from bisect import bisect_right
+import sys
+from typing import Iterator, List, Optional
+
+
+_UNSET = 0xFFFFFFFF
+
+
+class NodeView:
+    '''Lightweight view of one node of a CompactTree.'''
+    __slots__ = ('tree', 'i')
+
+    def __init__(self, tree: 'CompactTree', i: int):
+        self.tree = tree
+        self.i = i
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and other.tree is self.tree and other.i == self.i
+
+    def __hash__(self):
+        return hash((id(self.tree), self.i))
+
+    def __repr__(self):
+        return 'NodeView({}, {}:{})'.format(self.kind, self.start, self.end)
+
+    @property
+    def kind(self) -> str:
+        return self.tree.kinds[self.tree.kind[self.i]]
+
+    @property
+    def is_token(self) -> bool:
+        return bool(self.tree.token[self.i])
+
+    @property
+    def start(self) -> int:
+        return self.tree.start[self.i]
+
+    @property
+    def end(self) -> int:
+        return self.tree.end[self.i]
+
+    @property
+    def text(self) -> str:
+        return self.tree.source[self.start:self.end]
+
+    @property
+    def parent(self) -> Optional['NodeView']:
+        parent = self.tree.parent[self.i]
+        return None if parent < 0 else NodeView(self.tree, parent)
+
+    @property
+    def children(self) -> List['NodeView']:
+        return [NodeView(self.tree, c) for c in self.tree.child_ids(self.i)]
+
+    def tokens(self) -> Iterator['NodeView']:
+        '''The tokens under this node, in source order.'''
+        tree = self.tree
+        # pre-order numbering: the descendants of i are numbered i + 1 to subtree_end(i) - 1
+        for j in range(self.i, tree.subtree_end(self.i)):
+            if tree.token[j]:
+                yield NodeView(tree, j)
+
+
+class CompactTree:
+    '''A concrete syntax tree in flat arrays; see the module documentation.'''
+    def __init__(self, source: str):
+        self.source = source
+        self.kinds: List[str] = list()
+        self._kind_ids = dict()
+        self.kind = array('H')
+        self.token = array('B')
+        self.start = array('I')
+        self.end = array('I')
+        self.parent = array('i')
+        self.child_start = array('I')
+        self.child_count = array('I')
+        self.children = array('I')
+        # end (exclusive) of the subtree of each node, in node numbers
+        self._subtree_end = array('I')
+
+    def __len__(self):
+        return len(self.kind)
+
+    @property
+    def root(self) -> NodeView:
+        return NodeView(self, 0)
+
+    def node(self, i: int) -> NodeView:
+        return NodeView(self, i)
+
+    def child_ids(self, i: int) -> array:
+        first = self.child_start[i]
+        return self.children[first:first + self.child_count[i]]
+
+    def subtree_end(self, i: int) -> int:
+        return self._subtree_end[i]
+
+    def kind_id(self, kind: str) -> int:
+        kind_id = self._kind_ids.get(kind)
+        if kind_id is None:
+            kind_id = len(self.kinds)
+            self.kinds.append(sys.intern(kind))
+            self._kind_ids[kind] = kind_id
+        return kind_id
+
+    def nodes_of_kind(self, kind: str) -> Iterator[NodeView]:
+        kind_id = self._kind_ids.get(kind)
+        if kind_id is None:
+            return
+        for i, k in enumerate(self.kind):
+            if k == kind_id:
+                yield NodeView(self, i)
+
+    def token_at(self, offset: int) -> Optional[NodeView]:
+        '''The token that contains offset, if any.'''
+        node = self.node_at(offset)
+        return node if node is not None and node.is_token else None
+
+    def node_at(self, offset: int) -> Optional[NodeView]:
+        '''The deepest node that contains offset.'''
+        if not len(self) or not self.start[0] <= offset < self.end[0]:
+            return None
+        i = 0
+        while True:
+            children = self.child_ids(i)
+            # children are in source order; find the last one starting at or before offset
+            starts = [self.start[c] for c in children]
+            k = bisect_right(starts, offset) - 1
+            if k < 0 or offset >= self.end[children[k]]:
+                return NodeView(self, i)
+            i = children[k]
+
+    @classmethod
+    def from_lark(cls, tree, source: str) -> 'CompactTree':
+        '''Convert a lark Tree (and its Tokens) parsed from source.'''
+        builder = CompactTreeBuilder(source)
+        # iterative, as model files can nest deeply enough to exceed the recursion limit
+        stack = [(tree, False)]
+        while stack:
+            node, closing = stack.pop()
+            if closing:
+                builder.finish()
+                continue
+            children = getattr(node, 'children', None)
+            if children is None:
+                start = getattr(node, 'start_pos', None)
+                if start is None:
+                    start = node.pos_in_stream
+                builder.token(node.type, start, node.end_pos)
+                continue
+            builder.open(str(node.data))
+            stack.append((node, True))
+            for child in reversed(children):
+                stack.append((child, False))
+        return builder.build()
+
+
+class CompactTreeBuilder:
+    '''Builds a CompactTree in pre-order: open() a node, add its tokens and children, finish() it.
+
+    Node spans need not be given: a node spans its first to its last token.
+    '''
+    def __init__(self, source: str):
+        self.tree = CompactTree(source)
+        self._open = list()
+
+    def _add(self, kind: str, is_token: bool, start: int, end: int) -> int:
+        tree = self.tree
+        i = len(tree.kind)
+        tree.kind.append(tree.kind_id(kind))
+        tree.token.append(is_token)
+        tree.start.append(start)
+        tree.end.append(end)
+        tree.parent.append(self._open[-1] if self._open else -1)
+        return i
+
+    def open(self, kind: str, start: int = None) -> int:
+        i = self._add(kind, False, _UNSET if start is None else start, 0)
+        self._open.append(i)
+        return i
+
+    def token(self, kind: str, start: int, end: int) -> int:
+        return self._add(kind, True, start, end)
+
+    def finish(self, end: int = None):
+        i = self._open.pop()
+        if end is not None:
+            self.tree.end[i] = end
+
+    def build(self) -> CompactTree:
+        while self._open:
+            self.finish()
+        tree = self.tree
+        n = len(tree.kind)
+
+        # spans, from the leaves up; parents always come before their children
+        for i in range(n - 1, 0, -1):
+            p = tree.parent[i]
+            if tree.start[i] < tree.start[p]:
+                tree.start[p] = tree.start[i]
+            if tree.end[i] > tree.end[p]:
+                tree.end[p] = tree.end[i]
+        for i in range(n):
+            if tree.start[i] == _UNSET:
+                # empty node
+                tree.start[i] = tree.end[i]
+
+        # children lists, grouped by parent
+        counts = array('I', bytes(4 * n))
+        for i in range(1, n):
+            counts[tree.parent[i]] += 1
+        starts = array('I', bytes(4 * n))
+        total = 0
+        for i in range(n):
+            starts[i] = total
+            total += counts[i]
+        children = array('I', bytes(4 * total))
+        filled = array('I', starts)
+        for i in range(1, n):
+            p = tree.parent[i]
+            children[filled[p]] = i
+            filled[p] += 1
+        tree.child_start = starts
+        tree.child_count = counts
+        tree.children = children
+
+        # subtree ends: a node's subtree ends where its last child's subtree ends
+        subtree_end = array('I', range(1, n + 1))
+        for i in range(n - 1, -1, -1):
+            if counts[i]:
+                subtree_end[i] = subtree_end[children[starts[i] + counts[i] - 1]]
+        tree._subtree_end = subtree_end
+        return tree
@@ -0,0 +1,112 @@
+'''Recording of web service exchanges to fixture files.
+
+A FixtureRecorder hooks into the shared connection pool of bioservices, so every REST and SOAP
+exchange made while it is active is appended to a JSON lines file. The file can then be replayed
+offline by the stand-in server of standin.py.
+
+Each line is one exchange:
+    {"method": "POST", "origin": "http://www.ebi.ac.uk", "target": "/webservices/...",
+     "body_sha1": "...", "status": 200, "content_type": "text/xml", "body": "<base64>"}
+'''
+
+from .bioservices.sessions import get_session_pool
+
+import base64
+import hashlib
+import json
+import threading
+from typing import Dict, Iterator, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+
+def body_digest(body) -> str:
+    '''SHA-1 of a request body (str, bytes or None).'''
+    if body is None:
+        body = b''
+    elif isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha1(body).hexdigest()
+
+
+def split_url(url: str) -> Tuple[str, str]:
+    '''Split url into its origin and a normalized target (path and sorted query).'''
+    parts = urlsplit(url)
+    target = parts.path or '/'
+    if parts.query:
+        target += '?' + urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return '{}://{}'.format(parts.scheme, parts.netloc), target
+
+
+def exchange_key(method: str, target: str, digest: str) -> Tuple[str, str, str]:
+    '''Key under which an exchange is looked up on replay.'''
+    return method.upper(), target, digest
+
+
+class FixtureRecorder:
+    '''Appends every exchange of the bioservices sessions to a fixture file.
+
+    Use as a context manager:
+
+        with FixtureRecorder('chebi.jsonl'):
+            services.annot_search_chebi('glucose')
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def start(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+        get_session_pool().add_response_hook(self._record)
+
+    def stop(self):
+        get_session_pool().remove_response_hook(self._record)
+        with self._lock:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _record(self, response, **kwargs):
+        request = response.request
+        origin, target = split_url(request.url)
+        # reads the whole body, also for streamed responses; they are still iterable afterwards
+        content = response.content
+        exchange = {
+            'method': request.method,
+            'origin': origin,
+            'target': target,
+            'body_sha1': body_digest(request.body),
+            'status': response.status_code,
+            'content_type': response.headers.get('Content-Type', 'text/plain'),
+            'body': base64.b64encode(content).decode('ascii'),
+        }
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(exchange) + '\n')
+                self._file.flush()
+        return response
+
+
+def iter_exchanges(path: str) -> Iterator[dict]:
+    '''Iterate over the exchanges of a fixture file, with decoded bodies.'''
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                exchange = json.loads(line)
+                exchange['body'] = base64.b64decode(exchange['body'])
+                yield exchange
+
+
+def load_fixtures(path: str) -> Dict[Tuple[str, str, str], dict]:
+    '''Load a fixture file into a dict keyed by exchange_key(). Later exchanges win.'''
+    return {
+        exchange_key(ex['method'], ex['target'], ex['body_sha1']): ex
+        for ex in iter_exchanges(path)
+    }
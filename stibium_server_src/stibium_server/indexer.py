@@ -0,0 +1,435 @@
+'''Background index of the symbols of all the Antimony files of the workspace.
+
+The analysis of stibium only covers open documents. The indexer covers every .ant file of the
+workspace folders with a cheaper, approximate extraction: the file is lexed with the fast lexer,
+grouped into a statement-level CompactTree (model blocks, statements, tokens) by outline(), and
+extract_symbols() reads the models, functions, species, compartments, reactions, parameters and
+annotations from the statements, without parsing expressions.
+
+WorkspaceIndexer scans the workspace on a background thread, a file at a time with a pause in
+between so that it does not compete with the requests of the user, and keeps the index on disk,
+keyed by path, mtime, size and content hash. On startup, files whose mtime and size did not change
+are not read again, and files whose content did not change are not extracted again; afterwards,
+only the files reported by file-watch events are indexed again.
+'''
+
+from .cst import CompactTree, CompactTreeBuilder
+from .lexer import COMMENT, NAME, NEWLINE, NUMBER, STRING, lex
+from .utils import LineIndex, LspRange
+
+import appdirs
+
+from collections import deque
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+# Extensions of the files that are indexed
+ANT_EXTENSIONS = ('.ant',)
+# Directories that are not scanned
+SKIPPED_DIRS = ('node_modules', '__pycache__')
+# Seconds to pause after indexing each file
+INDEX_PAUSE = 0.005
+# Seconds to wait after the last change before the index is saved to disk
+SAVE_DELAY = 2.
+# Bump when the format of the saved index or the extraction changes
+INDEX_VERSION = 1
+
+MODULE_KEYWORDS = ('model', 'module')
+FUNCTION_KEYWORD = 'function'
+END_KEYWORD = 'end'
+ARROWS = ('->', '=>')
+# declaration keywords and the kind of the names they declare
+DECLARATIONS = {'species': 'Species', 'compartment': 'Compartment', 'formula': 'Parameter'}
+MODIFIERS = ('const', 'var', 'substanceOnly')
+ANNOTATION_QUALIFIERS = frozenset((
+    'identity', 'is', 'hasPart', 'part', 'isPartOf', 'parthood', 'isVersionOf', 'version',
+    'hasVersion', 'isHomologTo', 'homolog', 'isDescribedBy', 'description', 'isEncodedBy',
+    'encoder', 'encodes', 'encodement', 'occursIn', 'container', 'hasProperty', 'property',
+    'isPropertyOf', 'propertyBearer', 'hasTaxon', 'taxon'))
+# a name declared with a stronger kind keeps it
+_KIND_RANK = {'Model': 5, 'Function': 5, 'Species': 4, 'Compartment': 4, 'Reaction': 3,
+              'Parameter': 1}
+# token kinds of the outline, by lexer kind; anything else is an OP
+_TOKEN_KINDS = {NAME: 'NAME', NUMBER: 'NUMBER', STRING: 'STRING'}
+
+
+class IndexedSymbol(NamedTuple):
+    name: str
+    kind: str
+    # name of the enclosing model, '' at the top level
+    scope: str
+    range: LspRange
+    annotations: Tuple[str, ...]
+
+
+def outline(text: str) -> CompactTree:
+    '''Group the tokens of text into model blocks and statements.
+
+    The tree has a 'file' root; 'model' and 'function' nodes for the blocks, whose first child
+    is the header statement; and 'statement' nodes whose children are NAME, NUMBER, STRING and
+    OP tokens. A statement ends at a newline or at a semicolon, except for the first semicolon
+    after the arrow of a reaction, which separates the rate law.
+    '''
+    builder = CompactTreeBuilder(text)
+    builder.open('file', 0)
+    blocks = 0
+    in_statement = arrow = rate = False
+    for kind, start, end in lex(text):
+        if kind == COMMENT:
+            continue
+        if kind == NEWLINE:
+            if in_statement:
+                builder.finish()
+                in_statement = False
+            continue
+        value = text[start:end]
+        if not in_statement:
+            if kind == NAME and value == END_KEYWORD and blocks:
+                builder.token('NAME', start, end)
+                builder.finish()
+                blocks -= 1
+                continue
+            if kind == NAME and (value in MODULE_KEYWORDS or value == FUNCTION_KEYWORD):
+                builder.open('function' if value == FUNCTION_KEYWORD else 'model', start)
+                blocks += 1
+            builder.open('statement', start)
+            in_statement, arrow, rate = True, False, False
+        if value == ';' and (not arrow or rate):
+            builder.finish(end)
+            in_statement = False
+            continue
+        if value == ';':
+            rate = True
+        elif value in ARROWS:
+            arrow = True
+        builder.token(_TOKEN_KINDS.get(kind, 'OP'), start, end)
+    return builder.build()
+
+
+class _Extraction:
+    def __init__(self, text: str):
+        self.lines = LineIndex(text)
+        self.symbols: Dict[Tuple[str, str], list] = dict()
+
+    def add(self, scope: str, name: str, kind: str, start: int, end: int):
+        key = (scope, name)
+        entry = self.symbols.get(key)
+        if entry is None:
+            self.symbols[key] = [kind, start, end, list()]
+        elif _KIND_RANK.get(kind, 0) > _KIND_RANK.get(entry[0], 0):
+            entry[0] = kind
+
+    def annotate(self, scope: str, name: str, start: int, end: int, uri: str):
+        self.add(scope, name, '', start, end)
+        self.symbols[(scope, name)][3].append(uri)
+
+    def result(self) -> List[IndexedSymbol]:
+        return [IndexedSymbol(name, kind or 'Unknown', scope, self.lines.lsp_range(start, end),
+                              tuple(annotations))
+                for (scope, name), (kind, start, end, annotations) in self.symbols.items()]
+
+
+def extract_symbols(text: str) -> List[IndexedSymbol]:
+    '''The symbols defined in text, with the range of their first occurrence.'''
+    tree = outline(text)
+    extraction = _Extraction(text)
+    for block in tree.root.children:
+        if block.kind == 'statement':
+            _statement(extraction, '', block)
+            continue
+        statements = [child for child in block.children if child.kind == 'statement']
+        if not statements:
+            continue
+        header = [token for token in statements[0].tokens() if token.kind == 'NAME']
+        if len(header) < 2:
+            continue
+        name = header[1]
+        extraction.add('', name.text, 'Function' if block.kind == 'function' else 'Model',
+                       name.start, name.end)
+        for statement in statements[1:]:
+            _statement(extraction, name.text, statement)
+    return extraction.result()
+
+
+def _statement(extraction: _Extraction, scope: str, statement):
+    tokens = list(statement.tokens())
+    values = [token.text for token in tokens]
+    kinds = [token.kind for token in tokens]
+    i = 0
+    while i < len(tokens) and values[i] in MODIFIERS:
+        i += 1
+    if i == len(tokens):
+        return
+
+    if values[i] in DECLARATIONS and kinds[i] == 'NAME':
+        kind = DECLARATIONS[values[i]]
+        expect_name = True
+        for token, value in zip(tokens[i + 1:], values[i + 1:]):
+            if value == ',':
+                expect_name = True
+            elif expect_name and token.kind == 'NAME':
+                extraction.add(scope, value, kind, token.start, token.end)
+                expect_name = False
+            elif value != '$':
+                expect_name = False
+        return
+
+    if (len(tokens) > i + 2 and kinds[i] == 'NAME' and values[i + 1] in ANNOTATION_QUALIFIERS
+            and kinds[i + 2] == 'STRING'):
+        for token in tokens[i + 2:]:
+            if token.kind == 'STRING':
+                extraction.annotate(scope, values[i], tokens[i].start, tokens[i].end,
+                                    token.text[1:-1])
+        return
+
+    arrow = next((j for j, value in enumerate(values) if value in ARROWS), None)
+    if arrow is not None:
+        start = i
+        if len(tokens) > i + 1 and kinds[i] == 'NAME' and values[i + 1] == ':':
+            extraction.add(scope, values[i], 'Reaction', tokens[i].start, tokens[i].end)
+            start = i + 2
+        for j in range(start, len(tokens)):
+            if values[j] == ';':
+                break
+            if kinds[j] == 'NAME':
+                extraction.add(scope, values[j], 'Species', tokens[j].start, tokens[j].end)
+        return
+
+    if len(tokens) > i + 1 and kinds[i] == 'NAME' and values[i + 1] in ('=', ':='):
+        extraction.add(scope, values[i], 'Parameter', tokens[i].start, tokens[i].end)
+
+
+class FileIndex(NamedTuple):
+    # (st_mtime_ns, st_size) of the indexed file, None for the text of an open document
+    stamp: Optional[Tuple[int, int]]
+    hash: str
+    symbols: List[IndexedSymbol]
+
+
+def _hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def default_index_path(roots: Iterable[str]) -> str:
+    '''Index file of a workspace, in the user cache directory'''
+    key = _hash('\n'.join(sorted(roots)).encode('utf-8'))[:16]
+    return os.path.join(appdirs.user_cache_dir('bio-ide'), 'index', key + '.json')
+
+
+class WorkspaceIndexer:
+    '''Indexes the Antimony files of the workspace folders in the background.
+
+    Listeners are called as listener(path, symbols) whenever the symbols of a file change, with
+    symbols None when the file is gone, from the indexer thread or from update_text().
+    '''
+    def __init__(self, index_path: str = None, pause: float = INDEX_PAUSE):
+        self.index_path = index_path
+        self.pause = pause
+        self.files: Dict[str, FileIndex] = dict()
+        self._listeners: List[Callable[[str, Optional[List[IndexedSymbol]]], None]] = list()
+        self._queue = deque()
+        self._queued = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._dirty = False
+        self._last_change = 0.
+
+    def add_listener(self, listener: Callable[[str, Optional[List[IndexedSymbol]]], None]):
+        self._listeners.append(listener)
+
+    def _notify(self, path: str, symbols: Optional[List[IndexedSymbol]]):
+        for listener in self._listeners:
+            try:
+                listener(path, symbols)
+            except Exception:
+                logging.exception('Error in index listener')
+
+    def start(self, roots: Iterable[str]):
+        '''Load the saved index and scan the roots for files that changed since'''
+        roots = [os.path.abspath(root) for root in roots]
+        if self.index_path is None:
+            self.index_path = default_index_path(roots)
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(roots,), name='indexer',
+                                            daemon=True)
+            self._thread.start()
+
+    def enqueue(self, path: str):
+        '''Index path again, e.g. after a file-watch event'''
+        path = os.path.normcase(os.path.abspath(path))
+        with self._cond:
+            if path not in self._queued:
+                self._queued.add(path)
+                self._queue.append(path)
+                self._cond.notify()
+
+    def update_text(self, path: str, text: str):
+        '''Index the text of an open document, which may differ from the file on disk'''
+        path = os.path.normcase(os.path.abspath(path))
+        digest = _hash(text.encode('utf-8'))
+        with self._cond:
+            current = self.files.get(path)
+            if current is not None and current.hash == digest:
+                return
+        symbols = extract_symbols(text)
+        with self._cond:
+            self.files[path] = FileIndex(None, digest, symbols)
+        self._notify(path, symbols)
+
+    def symbols(self, path: str) -> List[IndexedSymbol]:
+        entry = self.files.get(os.path.normcase(os.path.abspath(path)))
+        return entry.symbols if entry is not None else []
+
+    def all_symbols(self) -> Iterable[Tuple[str, IndexedSymbol]]:
+        for path, entry in list(self.files.items()):
+            for symbol in entry.symbols:
+                yield path, symbol
+
+    def _run(self, roots: List[str]):
+        try:
+            self._load()
+            for path in list(self.files):
+                self._notify(path, self.files[path].symbols)
+            for path in self._scan(roots):
+                self.enqueue(path)
+            # files that were indexed before and are gone
+            for path in list(self.files):
+                if not os.path.isfile(path):
+                    self.enqueue(path)
+        except Exception:
+            logging.exception('Error while scanning the workspace')
+        while True:
+            path = self._next()
+            if path is None:
+                self._save()
+                continue
+            try:
+                self._index_file(path)
+            except Exception:
+                logging.exception('Error while indexing %s', path)
+            time.sleep(self.pause)
+
+    def _next(self) -> Optional[str]:
+        '''Pop the next queued path; None when it is time to save the index'''
+        with self._cond:
+            while not self._queue:
+                if self._dirty:
+                    delay = self._last_change + SAVE_DELAY - time.monotonic()
+                    if delay <= 0:
+                        return None
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            path = self._queue.popleft()
+            self._queued.discard(path)
+            return path
+
+    @staticmethod
+    def _scan(roots: List[str]) -> Iterable[str]:
+        for root in roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames
+                               if not d.startswith('.') and d not in SKIPPED_DIRS]
+                for filename in filenames:
+                    if filename.endswith(ANT_EXTENSIONS):
+                        yield os.path.normcase(os.path.join(dirpath, filename))
+
+    def _index_file(self, path: str):
+        with self._cond:
+            current = self.files.get(path)
+        if current is not None and current.stamp is None:
+            # open; update_text() has the current text
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if current is not None:
+                with self._cond:
+                    if self.files.get(path) is not current:
+                        # opened or closed meanwhile
+                        return
+                    del self.files[path]
+                    self._changed()
+                self._notify(path, None)
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if current is not None and current.stamp == stamp:
+            return
+        with open(path, 'rb') as file:
+            data = file.read()
+        digest = _hash(data)
+        if current is not None and current.hash == digest:
+            # touched, not changed
+            symbols = current.symbols
+            changed = False
+        else:
+            symbols = extract_symbols(data.decode('utf-8', errors='replace'))
+            changed = True
+        with self._cond:
+            if self.files.get(path) is not current:
+                # opened or closed while the file was read; update_text() or the next
+                # indexing has the current symbols
+                return
+            self.files[path] = FileIndex(stamp, digest, symbols)
+            self._changed()
+        if changed:
+            self._notify(path, symbols)
+
+    def close(self, path: str):
+        '''The document was closed: index the file on disk again'''
+        path = os.path.normcase(os.path.abspath(path))
+        with self._cond:
+            current = self.files.get(path)
+            opened = current is not None and current.stamp is None
+            running = self._thread is not None
+            if opened and running:
+                # forget the text of the document, but keep its symbols until the file is indexed
+                self.files[path] = current._replace(stamp=(-1, -1))
+            elif opened:
+                # not started, so the file will not be indexed: forget the document
+                del self.files[path]
+        if not running:
+            if opened:
+                self._notify(path, None)
+            return
+        self.enqueue(path)
+
+    def _changed(self):
+        self._dirty = True
+        self._last_change = time.monotonic()
+
+    def _load(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return
+        if saved.get('version') != INDEX_VERSION:
+            return
+        for path, (stamp, digest, symbols) in saved['files'].items():
+            self.files[path] = FileIndex(tuple(stamp), digest, [
+                IndexedSymbol(name, kind, scope, tuple(range_), tuple(annotations))
+                for name, kind, scope, range_, annotations in symbols])
+
+    def _save(self):
+        with self._cond:
+            self._dirty = False
+            # the text of open documents is not saved; their files are indexed on startup
+            files = {path: [list(entry.stamp), entry.hash, [list(s) for s in entry.symbols]]
+                     for path, entry in self.files.items() if entry.stamp is not None}
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            temp_path = self.index_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({'version': INDEX_VERSION, 'files': files}, file)
+            os.replace(temp_path, self.index_path)
+        except OSError:
+            logging.exception('Could not save the workspace index to %s', self.index_path)
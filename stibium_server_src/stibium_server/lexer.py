@@ -0,0 +1,160 @@
+'''Fast lexer for Antimony.
+
+lex() is the lexer of the server's own cheap passes over a document (imports, outlines, the
+workspace index). It scans with a single compiled regular expression whose alternatives are the
+few classes of Antimony tokens, and stores the result compactly: a TokenArray is three typed
+arrays (kind, start and end offsets) over the source text, with no Token object per token.
+
+Antimony tokens are context-free, so lexing can restart at any line boundary; relex() uses that
+to re-lex only the lines around an edit and reuse the tokens of the rest of the text.
+server/test_lexer.py checks relex() against lex() on random edits.
+'''
+
+from array import array
+from bisect import bisect_left, bisect_right
+import re
+from typing import Iterator, Tuple
+
+
+# Antimony keywords, which are not valid names (e.g. for rename)
+KEYWORDS = frozenset((
+    'model', 'module', 'function', 'end', 'import', 'in', 'at', 'species', 'compartment',
+    'formula', 'const', 'var', 'substanceOnly', 'identity', 'is', 'hasPart', 'part', 'isPartOf',
+    'parthood', 'isVersionOf', 'version', 'hasVersion', 'isHomologTo', 'homolog',
+    'isDescribedBy', 'description', 'isEncodedBy', 'encoder', 'encodes', 'encodement',
+    'occursIn', 'container', 'hasProperty', 'property', 'isPropertyOf', 'propertyBearer',
+    'hasTaxon', 'taxon'))
+
+# token kinds
+NEWLINE = 0
+WS = 1
+COMMENT = 2
+NAME = 3
+NUMBER = 4
+STRING = 5
+OP = 6
+ERROR = 7
+
+# Operators and punctuation, longest first so that the alternation picks the longest match
+OPERATORS = ('->', '=>', ':=', '==', '!=', '<=', '>=', '&&', '||',
+             '+', '-', '*', '/', '^', '=', ';', ':', ',', '.', '(', ')', '<', '>', '!', '{',
+             '}', '[', ']', '$', '@', "'", '&', '|', '%')
+
+_TOKEN_RE = re.compile(r'''
+    (\r?\n)
+  | ([ \t\f]+)
+  | (//[^\r\n]*|\#[^\r\n]*|/\*.*?(?:\*/|\Z))
+  | ([A-Za-z_][A-Za-z0-9_]*)
+  | ((?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)
+  | ("(?:[^"\\\r\n]|\\[^\r\n])*")
+  | ({})
+  | (.)
+'''.format('|'.join(re.escape(op) for op in OPERATORS)), re.VERBOSE | re.DOTALL)
+
+# group number (lastindex) to kind
+_GROUP_KIND = (None, NEWLINE, WS, COMMENT, NAME, NUMBER, STRING, OP, ERROR)
+
+
+class TokenArray:
+    '''Tokens of a text, in order: the kind, start and end offsets of token i are kind[i],
+    start[i] and end[i]. Whitespace is not stored; newlines and comments are.'''
+    __slots__ = ('text', 'kind', 'start', 'end')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.kind = array('B')
+        self.start = array('I')
+        self.end = array('I')
+
+    def __len__(self):
+        return len(self.kind)
+
+    def __getitem__(self, i: int) -> Tuple[int, int, int]:
+        return self.kind[i], self.start[i], self.end[i]
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int]]:
+        return zip(self.kind, self.start, self.end)
+
+    def value(self, i: int) -> str:
+        return self.text[self.start[i]:self.end[i]]
+
+    def index_at(self, offset: int) -> int:
+        '''Index of the first token that ends after offset.'''
+        return bisect_right(self.end, offset)
+
+
+def lex(text: str, pos: int = 0, tokens: TokenArray = None, sync=None) -> TokenArray:
+    '''Lex text from pos (which must be at a token boundary) to the end, appending to tokens.
+
+    If given, sync(offset) is called after each newline; lexing stops when it returns True.
+    '''
+    if tokens is None:
+        tokens = TokenArray(text)
+    kinds, starts, ends = tokens.kind, tokens.start, tokens.end
+    match = _TOKEN_RE.match
+    end = len(text)
+    while pos < end:
+        m = match(text, pos)
+        kind = _GROUP_KIND[m.lastindex]
+        start, pos = pos, m.end()
+        if kind == WS:
+            continue
+        kinds.append(kind)
+        starts.append(start)
+        ends.append(pos)
+        if kind == NEWLINE and sync is not None and sync(pos):
+            break
+    return tokens
+
+
+def relex(tokens: TokenArray, text: str, start: int, old_end: int, new_end: int) -> TokenArray:
+    '''Lex text, in which text[start:new_end] replaced tokens.text[start:old_end].
+
+    Lexing restarts at the beginning of the line of the first token that contains or touches the
+    edit, and the tokens of the old text are reused from the first newline after the edit at
+    which the old and new streams agree. An unterminated block comment extends to the end of the
+    text, so an edit anywhere after its start touches it, and no old newline after it can be
+    reused: everything to the end is lexed again. Strings do not span lines.
+    '''
+    old = tokens
+    delta = new_end - old_end
+    # a token that ends at the edit may grow into it, e.g. a name or an unterminated comment
+    k = bisect_left(old.end, start)
+    first = old.start[k] if k < len(old) and old.start[k] < start else start
+    # back up to a line start that is also a token boundary in the old stream; a line start
+    # may be inside a token only for block comments
+    restart = text.rfind('\n', 0, first) + 1
+    k = old.index_at(restart)
+    while k < len(old) and old.start[k] < restart:
+        restart = text.rfind('\n', 0, old.start[k]) + 1
+        k = old.index_at(restart)
+
+    new = TokenArray(text)
+    new.kind = old.kind[:k]
+    new.start = old.start[:k]
+    new.end = old.end[:k]
+    resume = [None]
+
+    def sync(pos):
+        if pos < new_end:
+            return False
+        # a newline ending at pos - delta in the old stream?
+        old_pos = pos - delta
+        i = bisect_left(old.end, old_pos)
+        if i < len(old) and old.end[i] == old_pos and old.kind[i] == NEWLINE:
+            resume[0] = i + 1
+            return True
+        return False
+
+    lex(text, restart, new, sync)
+    i = resume[0]
+    if i is not None:
+        new.kind.extend(old.kind[i:])
+        if delta:
+            new.start.extend(s + delta for s in old.start[i:])
+            new.end.extend(e + delta for e in old.end[i:])
+        else:
+            new.start.extend(old.start[i:])
+            new.end.extend(old.end[i:])
+    return new
+
@@ -0,0 +1,229 @@
+'''In-memory store of the ChEBI ontology, for browsing broader and narrower terms.
+
+The ChEBI web service returns the parents or the children of one entity per SOAP call, so
+walking the hierarchy costs one round-trip per node. OntologyGraph keeps the nodes and typed
+edges in adjacency indexes instead, so ancestor and descendant queries run in memory. It is
+either loaded from an OBO dump of ChEBI (ftp://ftp.ebi.ac.uk/pub/databases/chebi/ontology/) or
+filled incrementally by ChEBIOntology, which fetches each missing node once.
+
+Edges go from child to parent and carry the relationship type as the web service names it
+("is a", "has role", "has part", ...). A relationship "X has part Y" is an edge X -> Y, as
+getOntologyParents(X) returns Y with type "has part".
+'''
+
+from .webservices import WebServices
+
+from collections import defaultdict, deque
+import gzip
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+
+# Relationships that make a term broader, for ancestor and descendant queries by default
+HIERARCHY_RELATIONS = ('is a',)
+
+
+def _relation_name(obo_name: str) -> str:
+    '''OBO relationship name to web service relationship name, e.g. has_role -> has role'''
+    return obo_name.replace('_', ' ')
+
+
+class OntologyGraph:
+    '''Nodes (ChEBI ids and names) and typed child -> parent edges, indexed both ways.
+
+    Nodes whose parents and children are all known are marked complete; for other nodes the
+    adjacency lists may be partial. The graph is thread-safe.
+    '''
+    def __init__(self):
+        self.names: Dict[str, str] = dict()
+        # id -> {(neighbor id, relationship)}
+        self._parents: Dict[str, Set[Tuple[str, str]]] = defaultdict(set)
+        self._children: Dict[str, Set[Tuple[str, str]]] = defaultdict(set)
+        self._complete: Set[str] = set()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, chebi_id: str):
+        return chebi_id in self.names
+
+    def add_node(self, chebi_id: str, name: Optional[str] = None):
+        with self._lock:
+            if name or chebi_id not in self.names:
+                self.names[chebi_id] = name or self.names.get(chebi_id, '')
+
+    def add_edge(self, child: str, parent: str, relation: str):
+        with self._lock:
+            self._parents[child].add((parent, relation))
+            self._children[parent].add((child, relation))
+
+    def mark_complete(self, chebi_id: str):
+        with self._lock:
+            self._complete.add(chebi_id)
+
+    def is_complete(self, chebi_id: str) -> bool:
+        return chebi_id in self._complete
+
+    def parents(self, chebi_id: str, relations: Optional[Iterable[str]] = None) \
+            -> List[Tuple[str, str]]:
+        '''Return the (parent id, relationship) of chebi_id, sorted by id.
+
+        relations restricts the relationship types; all of them by default.
+        '''
+        return self._neighbors(self._parents, chebi_id, relations)
+
+    def children(self, chebi_id: str, relations: Optional[Iterable[str]] = None) \
+            -> List[Tuple[str, str]]:
+        '''Return the (child id, relationship) of chebi_id, sorted by id.'''
+        return self._neighbors(self._children, chebi_id, relations)
+
+    def ancestors(self, chebi_id: str, relations: Iterable[str] = HIERARCHY_RELATIONS,
+                  expand: Callable[[str], None] = None) -> List[str]:
+        '''Return the ancestors of chebi_id, nearest first.
+
+        expand is called on each visited node before its parents are read, e.g. to fetch the
+        node if it is not complete.
+        '''
+        return self._walk(self._parents, chebi_id, relations, expand)
+
+    def descendants(self, chebi_id: str, relations: Iterable[str] = HIERARCHY_RELATIONS,
+                    expand: Callable[[str], None] = None) -> List[str]:
+        '''Return the descendants of chebi_id, nearest first.'''
+        return self._walk(self._children, chebi_id, relations, expand)
+
+    def _neighbors(self, index, chebi_id, relations):
+        relations = None if relations is None else set(relations)
+        with self._lock:
+            edges = list(index.get(chebi_id, ()))
+        return sorted(edge for edge in edges if relations is None or edge[1] in relations)
+
+    def _walk(self, index, start, relations, expand):
+        # breadth-first, so that nearer terms come first; the ontology may have cycles
+        seen = {start}
+        order = list()
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if expand is not None:
+                expand(node)
+            for neighbor, _ in self._neighbors(index, node, relations):
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    order.append(neighbor)
+                    queue.append(neighbor)
+        return order
+
+    def load_obo(self, path: str):
+        '''Load the terms of an OBO file (possibly gzipped), e.g. chebi_lite.obo.
+
+        All loaded terms are marked complete.
+        '''
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            self._load_obo_lines(f)
+
+    def _load_obo_lines(self, lines: Iterable[str]):
+        term = None
+
+        def flush():
+            if term is not None and term.get('id') and not term.get('obsolete'):
+                self.add_node(term['id'], term.get('name'))
+                for parent, relation in term['edges']:
+                    self.add_edge(term['id'], parent, relation)
+                self.mark_complete(term['id'])
+
+        with self._lock:
+            for line in lines:
+                line = line.strip()
+                if line.startswith('['):
+                    flush()
+                    term = {'edges': list()} if line == '[Term]' else None
+                    continue
+                if term is None or ':' not in line:
+                    continue
+                tag, value = line.split(':', 1)
+                # drop trailing comments, e.g. "is_a: CHEBI:24431 ! chemical entity"
+                value = value.split(' ! ', 1)[0].strip()
+                if tag == 'id':
+                    term['id'] = value
+                elif tag == 'name':
+                    term['name'] = value
+                elif tag == 'is_obsolete':
+                    term['obsolete'] = value == 'true'
+                elif tag == 'is_a':
+                    term['edges'].append((value, 'is a'))
+                elif tag == 'relationship':
+                    fields = value.split()
+                    if len(fields) >= 2:
+                        term['edges'].append((fields[1], _relation_name(fields[0])))
+            flush()
+
+
+class ChEBIOntology:
+    '''OntologyGraph that fetches the nodes it does not know from the ChEBI web service.
+
+    Each node is fetched at most once, with a single getCompleteEntity call that returns both its
+    parents and its children.
+    '''
+    # Maximum number of nodes fetched by one ancestor or descendant query
+    MAX_FETCH = 50
+
+    def __init__(self, services: WebServices, graph: OntologyGraph = None):
+        self.services = services
+        self.graph = graph if graph is not None else OntologyGraph()
+
+    def ensure(self, chebi_id: str):
+        '''Fetch chebi_id if the graph does not have all its edges. Raises NetworkError.'''
+        if self.graph.is_complete(chebi_id):
+            return
+        entity = self.services.chebi_ontology(chebi_id)
+        if entity is None:
+            # unknown id; don't ask again
+            self.graph.mark_complete(chebi_id)
+            return
+        graph = self.graph
+        graph.add_node(entity['id'], entity['name'])
+        for parent, name, relation in entity['parents']:
+            graph.add_node(parent, name)
+            graph.add_edge(entity['id'], parent, relation)
+        for child, name, relation in entity['children']:
+            graph.add_node(child, name)
+            graph.add_edge(child, entity['id'], relation)
+        graph.mark_complete(entity['id'])
+        graph.mark_complete(chebi_id)
+
+    def broader(self, chebi_id: str) -> List[dict]:
+        '''Return the parents of chebi_id as result objects with the relationship type.'''
+        self.ensure(chebi_id)
+        return self._items(self.graph.parents(chebi_id))
+
+    def narrower(self, chebi_id: str) -> List[dict]:
+        '''Return the children of chebi_id as result objects with the relationship type.'''
+        self.ensure(chebi_id)
+        return self._items(self.graph.children(chebi_id))
+
+    def ancestors(self, chebi_id: str, relations: Iterable[str] = HIERARCHY_RELATIONS) -> List[str]:
+        return self.graph.ancestors(chebi_id, relations, self._limited_ensure())
+
+    def descendants(self, chebi_id: str, relations: Iterable[str] = HIERARCHY_RELATIONS) \
+            -> List[str]:
+        return self.graph.descendants(chebi_id, relations, self._limited_ensure())
+
+    def _limited_ensure(self):
+        fetched = 0
+
+        def expand(chebi_id):
+            nonlocal fetched
+            if not self.graph.is_complete(chebi_id) and fetched < self.MAX_FETCH:
+                fetched += 1
+                self.ensure(chebi_id)
+        return expand
+
+    def _items(self, edges: List[Tuple[str, str]]) -> List[dict]:
+        return [{
+            'id': chebi_id,
+            'name': self.graph.names.get(chebi_id, ''),
+            'prefix': 'chebi',
+            'relation': relation,
+        } for chebi_id, relation in edges]
@@ -0,0 +1,137 @@
+'''Background prefetch of annotation candidates for the species that are not annotated yet.
+
+Annotating a species starts with a search for its name in the annotation dialog. When prefetch
+is enabled, the names of the unannotated species of every analyzed document are queued and
+searched in the background, so that the first search of the dialog is usually answered from
+WebServices.results_cache.
+
+Prefetching runs on a single thread at low priority: it makes at most PREFETCH_RATE searches
+per second, on top of the per-host rate limits of bioservices, and holds off for IDLE_DELAY
+seconds after each search made by the user.
+'''
+
+from .bioservices.ratelimit import TokenBucket
+from .symindex import SymbolIndex
+from .webservices import NetworkError, WebServices
+
+from stibium.types import SymbolType
+
+from collections import deque
+import logging
+import threading
+import time
+from typing import Iterable, List
+
+
+# Searches per second made by the prefetcher
+PREFETCH_RATE = 0.5
+# Seconds without user searches before prefetching resumes
+IDLE_DELAY = 5.
+# Maximum number of searches waiting to be prefetched; further names are dropped
+MAX_QUEUED = 200
+# Shorter names (S1, x, ...) are rarely meaningful queries
+MIN_QUERY_LENGTH = 3
+
+
+def unannotated_species_names(index: SymbolIndex,
+                              min_length: int = MIN_QUERY_LENGTH) -> List[str]:
+    '''Return the names of the species of the document that have no annotation, in order and
+    without duplicates.
+
+    Names shorter than min_length are left out; pass 0 to keep every name, e.g. when the user
+    asks for the species to be annotated (Na, K and O2 are worth a search then).
+    '''
+    names = dict()
+    for record in index.symbols:
+        if record.type == SymbolType.Species.name and not record.annotations:
+            names[record.name] = None
+    return [name for name in names if len(name) >= min_length]
+
+
+class Prefetcher:
+    '''Prefetches the search results of queued names into the result cache of services.
+
+    Disabled until enable() is called.
+    '''
+    def __init__(self, services: WebServices, databases: Iterable[str] = ('chebi', 'uniprot'),
+                 rate: float = PREFETCH_RATE, idle_delay: float = IDLE_DELAY):
+        self.services = services
+        self.databases = tuple(databases)
+        self.idle_delay = idle_delay
+        self.limiter = TokenBucket(rate, capacity=1)
+        self.enabled = False
+        self._queue = deque()
+        self._queued = set()
+        self._resume_at = 0.
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def enable(self):
+        with self._cond:
+            self.enabled = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def disable(self):
+        '''Stop prefetching and drop the queued names.'''
+        with self._cond:
+            self.enabled = False
+            self._queue.clear()
+            self._queued.clear()
+
+    def defer(self):
+        '''Hold off prefetching for a while; called on each search made by the user.'''
+        with self._cond:
+            self._resume_at = time.monotonic() + self.idle_delay
+
+    def prefetch_document(self, index: SymbolIndex):
+        '''Queue the unannotated species of the document, if prefetching is enabled.'''
+        if self.enabled:
+            self.enqueue(unannotated_species_names(index))
+
+    def enqueue(self, names: Iterable[str]):
+        with self._cond:
+            if not self.enabled:
+                return
+            for name in names:
+                for database in self.databases:
+                    key = (database, name.strip().lower())
+                    if (key in self._queued or len(self._queue) >= MAX_QUEUED
+                            or self.services.is_cached(database, name)):
+                        continue
+                    self._queued.add(key)
+                    self._queue.append((database, name))
+            self._cond.notify()
+
+    def _next(self):
+        '''Wait until prefetching is enabled, idle and has something queued, and pop it.'''
+        with self._cond:
+            while True:
+                if not self.enabled or not self._queue:
+                    self._cond.wait()
+                    continue
+                delay = self._resume_at - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                database, name = self._queue.popleft()
+                self._queued.discard((database, name.strip().lower()))
+                return database, name
+
+    def _run(self):
+        while True:
+            database, name = self._next()
+            self.limiter.acquire()
+            # the user may have searched for it in the meantime
+            if self.services.is_cached(database, name):
+                continue
+            try:
+                self.services.prefetch(database, name)
+            except NetworkError:
+                # don't insist while the service is unreachable
+                logging.info('Prefetch of %s %r failed', database, name)
+                self.defer()
+            except Exception:
+                logging.exception('Error while prefetching %s %r', database, name)
@@ -0,0 +1,74 @@
+'''Local ranking of annotation search candidates.
+
+The web services return candidates in their own relevance order, which favors long names with
+many matching words. For annotation, the best candidate is usually the one whose name is the
+query itself, so candidates are re-scored locally from how well their name matches the query,
+with the service's own score and the ChEBI star rating as tie-breakers.
+'''
+
+import re
+from typing import Iterable, List
+
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+EXACT_WEIGHT = 1000.
+PREFIX_WEIGHT = 400.
+TOKEN_WEIGHT = 200.
+COVERAGE_WEIGHT = 100.
+SUBSTRING_WEIGHT = 100.
+STAR_WEIGHT = 20.
+SEARCH_SCORE_WEIGHT = 10.
+LENGTH_PENALTY = 1.
+
+
+def _tokens(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def score_candidate(query: str, name: str, search_score: float = 0., stars: int = 0) -> float:
+    '''Score how well the candidate called name matches query. Higher is better.'''
+    query = query.strip().lower()
+    lname = name.lower()
+    score = 0.
+    if lname == query:
+        score += EXACT_WEIGHT
+    elif lname.startswith(query):
+        score += PREFIX_WEIGHT
+    elif query in lname:
+        score += SUBSTRING_WEIGHT
+
+    query_tokens = _tokens(query)
+    if query_tokens:
+        name_tokens = _tokens(lname)
+        name_token_set = set(name_tokens)
+        matched = sum(1 for tok in query_tokens if tok in name_token_set)
+        score += TOKEN_WEIGHT * matched / len(query_tokens)
+        # prefer names that have few words besides the query
+        if name_tokens:
+            score += COVERAGE_WEIGHT * matched / len(name_tokens)
+
+    score += STAR_WEIGHT * (stars or 0)
+    score += SEARCH_SCORE_WEIGHT * (search_score or 0.)
+    score -= LENGTH_PENALTY * len(name)
+    return score
+
+
+def rank_chebi(query: str, entities: Iterable) -> List[dict]:
+    '''Rank the LiteEntity objects returned by ChEBI.getLiteEntity for query.
+
+    Returns all of them, best first, as result objects for the annotation dialog.
+    '''
+    scored = list()
+    for ent in entities:
+        name = str(ent.chebiAsciiName)
+        stars = int(getattr(ent, 'entityStar', 0) or 0)
+        search_score = float(getattr(ent, 'searchScore', 0.) or 0.)
+        scored.append((score_candidate(query, name, search_score, stars), {
+            'id': str(ent.chebiId),
+            'name': name,
+            'prefix': 'chebi',
+        }))
+    # sort is stable, so equal scores keep the order of the service
+    scored.sort(key=lambda pair: -pair[0])
+    return [item for _, item in scored]
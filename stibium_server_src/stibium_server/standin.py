@@ -0,0 +1,173 @@
+'''Local stand-in HTTP server that replays recorded web service exchanges.
+
+The server answers the requests of the ChEBI (SOAP, including its WSDL) and UniProt (REST)
+clients from a fixture file written by fixtures.FixtureRecorder. The original service URLs found
+in the recorded bodies, such as the SOAP address of the WSDL, are rewritten to point to the
+stand-in. Latency and errors can be injected to exercise timeouts, retries and the circuit
+breakers offline.
+
+Run it standalone with:
+    python -m stibium_server.standin fixtures.jsonl --port 8765 --latency 0.2 --error-rate 0.05
+'''
+
+from .bioservices.chebi import ChEBI
+from .fixtures import body_digest, exchange_key, load_fixtures, split_url
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, like the real services
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.standin.handle(self)
+
+    def do_POST(self):
+        self.server.standin.handle(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer:
+    '''Replays the exchanges of a fixture file over HTTP.
+
+    latency: seconds added to every response; jitter: maximum random extra latency;
+    error_rate: probability of answering 503 instead of the recorded response.
+    '''
+    def __init__(self, fixtures_path: str, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0., jitter: float = 0., error_rate: float = 0.,
+                 seed: Optional[int] = None):
+        self.fixtures = load_fixtures(fixtures_path)
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+        self._bodies = dict()
+        #: number of requests answered, and how many of them were injected errors or unknown
+        self.requests = 0
+        self.errors = 0
+        self.misses = 0
+
+    @property
+    def url(self) -> str:
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def service_urls(self) -> dict:
+        '''Keyword arguments for WebServices that point it to this server.'''
+        parts = urlsplit(ChEBI._url)
+        return {
+            'chebi_url': '{}{}?{}'.format(self.url, parts.path, parts.query),
+            'uniprot_url': self.url,
+        }
+
+    def start(self) -> str:
+        '''Start serving in a background thread and return the base URL.'''
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.standin = self
+        self.port = self._httpd.server_address[1]
+        self._rewrite_bodies()
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _rewrite_bodies(self):
+        netlocs = {urlsplit(ex['origin']).netloc for ex in self.fixtures.values()}
+        base = self.url.encode('ascii')
+        for key, ex in self.fixtures.items():
+            body = ex['body']
+            for netloc in netlocs:
+                for scheme in (b'http://', b'https://'):
+                    body = body.replace(scheme + netloc.encode('ascii'), base)
+            self._bodies[key] = body
+
+    def _draw(self):
+        with self._lock:
+            return self._random.random()
+
+    def _count(self, attr: str):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def handle(self, handler: BaseHTTPRequestHandler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else None
+        _, target = split_url('http://standin' + handler.path)
+        key = exchange_key(handler.command, target, body_digest(body))
+
+        delay = self.latency + self.jitter * self._draw()
+        if delay > 0:
+            time.sleep(delay)
+
+        self._count('requests')
+        if self.error_rate > 0 and self._draw() < self.error_rate:
+            self._count('errors')
+            self._send(handler, 503, 'text/plain', b'injected error')
+            return
+
+        exchange = self.fixtures.get(key)
+        if exchange is None:
+            self._count('misses')
+            self._send(handler, 404, 'text/plain',
+                       'no fixture for {} {}'.format(handler.command, target).encode('utf-8'))
+            return
+        self._send(handler, exchange['status'], exchange['content_type'], self._bodies[key])
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, content_type: str, body: bytes):
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded web service exchanges')
+    parser.add_argument('fixtures', help='fixture file written by FixtureRecorder')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0., help='seconds added to each response')
+    parser.add_argument('--jitter', type=float, default=0., help='maximum random extra latency')
+    parser.add_argument('--error-rate', type=float, default=0., help='probability of a 503')
+    args = parser.parse_args()
+
+    standin = StandInServer(args.fixtures, args.host, args.port, args.latency, args.jitter,
+                            args.error_rate)
+    standin.start()
+    print('Serving {} exchanges on {}'.format(len(standin.fixtures), standin.url))
+    for name, url in standin.service_urls().items():
+        print('  {}: {}'.format(name, url))
+    try:
+        standin._thread.join()
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+'''Compact, read-only index of the symbols of a document.
+
+The analyzer of stibium keeps a QName, a Name node and SrcRange/SrcPosition objects for every
+occurrence of every name, each a regular Python object with its own __dict__. The server only
+needs a few facts about them: where each name occurs, what it is and how it is annotated. A
+SymbolIndex stores exactly that, compactly, and is what the server features query:
+
+* names, scopes, types and annotation URIs are interned strings, shared by all the occurrences
+  and all the indexes;
+* each symbol is one SymbolRecord with __slots__, which also keeps its hover text and the spans
+  of its declarations;
+* occurrences are rows of array-backed integer columns (symbol, start and end line and column),
+  sorted by position, rather than one object per occurrence;
+* a reverse index lists the occurrence rows of each symbol, so that finding all the usages of
+  a symbol (references, highlight, rename) does not scan the occurrences of the others.
+
+An index is built once per document version from its AntFile, which is then dropped (see
+AntFileCache): the analyzer's objects are not kept for any document.
+'''
+
+from stibium.api import AntFile
+from stibium.types import SrcPosition, SrcRange
+
+from array import array
+from bisect import bisect_right
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# (start line, start column, end line, end column), 1-based like SrcPosition
+Span = Tuple[int, int, int, int]
+
+
+def _intern(text) -> str:
+    return sys.intern(str(text)) if text is not None else ''
+
+
+def _span(range_: SrcRange) -> Span:
+    return (range_.start.line, range_.start.column, range_.end.line, range_.end.column)
+
+
+class SymbolRecord:
+    '''A symbol of the document: a name in a scope.'''
+    __slots__ = ('id', 'name', 'scope', 'type', 'annotations', 'help', 'declarations')
+
+    def __init__(self, id_: int, name: str, scope: str, type_: str, annotations: Tuple[str, ...],
+                 help_: str = ''):
+        self.id = id_
+        self.name = name
+        self.scope = scope
+        self.type = type_
+        self.annotations = annotations
+        # the hover text of the symbol
+        self.help = help_
+        # spans of the declarations of the symbol in the document, as for go to definition
+        self.declarations: Tuple[Span, ...] = ()
+
+    def __repr__(self):
+        return 'SymbolRecord({!r}, {!r}, {!r})'.format(self.scope, self.name, self.type)
+
+
+class SymbolIndex:
+    '''Symbols of a document and the spans of all their occurrences.'''
+    def __init__(self):
+        self.symbols: List[SymbolRecord] = list()
+        self._by_key: Dict[Tuple[str, str], SymbolRecord] = dict()
+        # occurrence columns, sorted by start position once frozen
+        self._symbol = array('I')
+        self._start_line = array('I')
+        self._start_col = array('I')
+        self._end_line = array('I')
+        self._end_col = array('I')
+        # start positions packed into one sortable integer, for bisect
+        self._starts = array('Q')
+        # reverse index: the occurrence rows of symbol i are
+        # _usage_rows[_usage_start[i]:_usage_start[i + 1]], in document order
+        self._usage_start = array('I', [0])
+        self._usage_rows = array('I')
+
+    @classmethod
+    def from_antfile(cls, antfile: AntFile, path: str = '') -> 'SymbolIndex':
+        '''Index of the symbols of antfile, the analysis of the file at path'''
+        index = cls()
+        table = antfile.analyzer.table
+        for qname in table.get_all_qnames():
+            key = (_intern(getattr(qname, 'scope', '')), _intern(qname.name.text))
+            record = index._by_key.get(key)
+            if record is None:
+                symbols = table.get(qname)
+                type_ = symbols[0].type.name if symbols else ''
+                help_ = _intern(symbols[0].help_str()) if symbols else ''
+                annotations = tuple(_intern(a.get_uri()) for a in antfile.get_annotations(qname))
+                record = index.add_symbol(key[1], key[0], type_, annotations, help_)
+            index.add_occurrence(record, qname.name.range)
+        index.freeze()
+        # every occurrence of a symbol goes to the same declarations; ask from the first one
+        for record in index.symbols:
+            span = index.first_span(record)
+            if span is None:
+                continue
+            locations, _ = antfile.goto(SrcPosition(span[0], span[1]))
+            record.declarations = tuple(_span(loc.range) for loc in locations if loc.path == path)
+        return index
+
+    def add_symbol(self, name: str, scope: str, type_: str, annotations: Tuple[str, ...] = (),
+                   help_: str = '') -> SymbolRecord:
+        record = SymbolRecord(len(self.symbols), _intern(name), _intern(scope), _intern(type_),
+                              annotations, help_)
+        self.symbols.append(record)
+        self._by_key[(record.scope, record.name)] = record
+        return record
+
+    def add_occurrence(self, record: SymbolRecord, range_: SrcRange):
+        line, column, end_line, end_column = _span(range_)
+        self._symbol.append(record.id)
+        self._start_line.append(line)
+        self._start_col.append(column)
+        self._end_line.append(end_line)
+        self._end_col.append(end_column)
+
+    def freeze(self):
+        '''Sort the occurrences by position; call once all of them are added.'''
+        order = sorted(range(len(self._symbol)),
+                       key=lambda i: (self._start_line[i], self._start_col[i]))
+        for name in ('_symbol', '_start_line', '_start_col', '_end_line', '_end_col'):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, (column[i] for i in order)))
+        self._starts = array('Q', (self._pack(line, col)
+                                   for line, col in zip(self._start_line, self._start_col)))
+
+        counts = array('I', bytes(4 * len(self.symbols)))
+        for symbol_id in self._symbol:
+            counts[symbol_id] += 1
+        self._usage_start = array('I', [0])
+        for count in counts:
+            self._usage_start.append(self._usage_start[-1] + count)
+        filled = array('I', self._usage_start[:-1])
+        self._usage_rows = array('I', bytes(4 * len(self._symbol)))
+        for i, symbol_id in enumerate(self._symbol):
+            self._usage_rows[filled[symbol_id]] = i
+            filled[symbol_id] += 1
+
+    @staticmethod
+    def _pack(line: int, column: int) -> int:
+        return (line << 32) | column
+
+    def __len__(self):
+        return len(self._symbol)
+
+    def get(self, name: str, scope: str = '') -> Optional[SymbolRecord]:
+        return self._by_key.get((scope, name))
+
+    def span(self, i: int) -> Span:
+        return (self._start_line[i], self._start_col[i], self._end_line[i], self._end_col[i])
+
+    def occurrences(self) -> Iterator[Tuple[SymbolRecord, Span]]:
+        '''All the occurrences of all the symbols, in document order.'''
+        for i, symbol_id in enumerate(self._symbol):
+            yield self.symbols[symbol_id], self.span(i)
+
+    def first_span(self, record: SymbolRecord) -> Optional[Span]:
+        '''Span of the first occurrence of record, if any.'''
+        start = self._usage_start[record.id]
+        if start == self._usage_start[record.id + 1]:
+            return None
+        return self.span(self._usage_rows[start])
+
+    def usage_count(self, record: SymbolRecord) -> int:
+        return self._usage_start[record.id + 1] - self._usage_start[record.id]
+
+    def spans_of(self, record: SymbolRecord) -> List[Span]:
+        '''Spans of the occurrences of record, in document order.'''
+        rows = self._usage_rows[self._usage_start[record.id]:self._usage_start[record.id + 1]]
+        return [self.span(i) for i in rows]
+
+    def symbol_at(self, line: int, column: int) -> Optional[Tuple[SymbolRecord, Span]]:
+        '''The symbol occurring at the given (1-based) position, and the span of the occurrence.'''
+        i = bisect_right(self._starts, self._pack(line, column)) - 1
+        if i < 0:
+            return None
+        span = self.span(i)
+        if (line, column) > (span[2], span[3]):
+            return None
+        return self.symbols[self._symbol[i]], span
+
+    def annotated_spans(self) -> List[Span]:
+        '''Spans of all the occurrences of annotated symbols (as antimony.getAnnotated).'''
+        return [span for record, span in self.occurrences() if record.annotations]
+
+    def annotation_uris(self) -> List[str]:
+        '''All the annotation URIs of the document, in order and without duplicates.'''
+        uris = dict()
+        for record in self.symbols:
+            for uri in record.annotations:
+                uris[uri] = None
+        return list(uris)
@@ -0,0 +1,163 @@
+'''Fuzzy search of the symbols of the workspace, for workspace/symbol.
+
+SymbolSearchIndex holds the symbols of every indexed file (see indexer.py) and answers queries
+with the top-k ranked matches:
+
+* each distinct name gets an id, and the ids of the names containing each trigram (three
+  consecutive characters, case-insensitively) are kept in a posting array per trigram, so that a
+  query of three or more characters only looks at the names in the shortest posting list of its
+  trigrams;
+* shorter queries, and fuzzy queries whose characters are not contiguous in the names ("glcs"
+  for "glucose"), fall back to a scan of the names that start with the same character, within the
+  time budget of the search.
+
+Names are ranked: exact match, then prefix, then substring (earlier is better), then subsequence
+(fewer gaps is better); shorter names first among equals.
+
+The index is updated a file at a time, as the indexer reports changes. Name ids and postings are
+never removed; names that no longer have any symbol are skipped.
+'''
+
+from .indexer import IndexedSymbol
+
+from array import array
+import heapq
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+# Default number of results
+SEARCH_LIMIT = 100
+# Default time budget of a search, in seconds
+SEARCH_BUDGET = 0.05
+# Check the time budget every this many candidates
+_BUDGET_CHECK = 1024
+
+
+def _trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def score(query: str, name: str) -> int:
+    '''Rank of name for the lowercase query; 0 if it does not match'''
+    if name == query:
+        return 1000
+    position = name.find(query)
+    if position == 0:
+        return 800 - min(len(name), 100)
+    if position > 0:
+        return 600 - min(position, 50) - min(len(name), 100) // 2
+    # subsequence
+    gaps = 0
+    i = 0
+    for char in query:
+        j = name.find(char, i)
+        if j < 0:
+            return 0
+        if j > i:
+            gaps += 1
+        i = j + 1
+    return max(1, 300 - 10 * gaps - min(len(name), 100) // 2)
+
+
+class SymbolSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # name id -> lowercase name
+        self._names: List[str] = list()
+        self._name_ids: Dict[str, int] = dict()
+        # name id -> (path, symbol) of the symbols with that name
+        self._symbols: List[List[Tuple[str, IndexedSymbol]]] = list()
+        self._postings: Dict[str, array] = dict()
+        # first character -> ids of the names that start with it
+        self._by_first: Dict[str, array] = dict()
+        self._files: Dict[str, List[IndexedSymbol]] = dict()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _name_id(self, name: str) -> int:
+        lower = name.lower()
+        name_id = self._name_ids.get(lower)
+        if name_id is None:
+            name_id = len(self._names)
+            self._names.append(sys.intern(lower))
+            self._name_ids[lower] = name_id
+            self._symbols.append(list())
+            for trigram in _trigrams(lower):
+                posting = self._postings.get(trigram)
+                if posting is None:
+                    posting = self._postings[trigram] = array('I')
+                posting.append(name_id)
+            self._by_first.setdefault(lower[:1], array('I')).append(name_id)
+        return name_id
+
+    def update_file(self, path: str, symbols: Optional[List[IndexedSymbol]]):
+        '''Replace the symbols of path; None removes the file'''
+        with self._lock:
+            for symbol in self._files.pop(path, ()):
+                entries = self._symbols[self._name_ids[symbol.name.lower()]]
+                entries[:] = [entry for entry in entries if entry[0] != path]
+                self._count -= 1
+            if symbols is None:
+                return
+            self._files[path] = symbols
+            for symbol in symbols:
+                self._symbols[self._name_id(symbol.name)].append((path, symbol))
+                self._count += 1
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT,
+               budget: float = SEARCH_BUDGET) -> List[Tuple[str, IndexedSymbol]]:
+        '''The (path, symbol) of the best matches of query, best first.
+
+        Returns what was found within budget seconds.
+        '''
+        query = query.strip().lower()
+        deadline = time.perf_counter() + budget
+        with self._lock:
+            if not query:
+                return self._first_symbols(limit)
+            scored = dict()
+            self._collect(query, self._trigram_candidates(query), scored, deadline)
+            if len(scored) < limit and time.perf_counter() < deadline:
+                self._collect(query, self._by_first.get(query[0], ()), scored, deadline)
+            best = heapq.nlargest(limit, scored.items(),
+                                  key=lambda item: (item[1], -len(self._names[item[0]])))
+            results = list()
+            for name_id, _ in best:
+                results.extend(self._symbols[name_id])
+                if len(results) >= limit:
+                    break
+            return results[:limit]
+
+    def _trigram_candidates(self, query: str):
+        trigrams = _trigrams(query)
+        if not trigrams:
+            return ()
+        postings = [self._postings.get(trigram) for trigram in trigrams]
+        if any(posting is None for posting in postings):
+            # no name contains the query; fuzzy matches come from the scan
+            return ()
+        return min(postings, key=len)
+
+    def _collect(self, query: str, candidates, scored: Dict[int, int], deadline: float):
+        names, symbols = self._names, self._symbols
+        for count, name_id in enumerate(candidates):
+            if count % _BUDGET_CHECK == 0 and count and time.perf_counter() > deadline:
+                return
+            if name_id in scored or not symbols[name_id]:
+                continue
+            rank = score(query, names[name_id])
+            if rank:
+                scored[name_id] = rank
+
+    def _first_symbols(self, limit: int) -> List[Tuple[str, IndexedSymbol]]:
+        results = list()
+        for path, symbols in self._files.items():
+            results.extend((path, symbol) for symbol in symbols[:limit - len(results)])
+            if len(results) >= limit:
+                break
+        return results
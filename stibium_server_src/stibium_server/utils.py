@@ -1,3 +1,6 @@
+from .cache import TTLCache
+from .symindex import Span, SymbolIndex
+
 from pygls.workspace import Document
 from stibium.api import AntCompletion, AntCompletionKind, AntFile, Completer
 from stibium.analysis import AntTreeAnalyzer, get_qname_at_position
@@ -7,6 +10,10 @@ from stibium.types import SrcLocation, SrcPosition, SrcRange
 
 from pygls.types import CompletionItem, CompletionItemKind, CompletionList, CompletionParams, InsertTextFormat, Position, Range, TextDocumentPositionParams
 
+from array import array
+from bisect import bisect_left, bisect_right
+import re
+from typing import Tuple
 
 
 def sb_position(position: Position):
@@ -28,5 +35,152 @@ def pygls_range(srcrange: SrcRange):
     return Range(pygls_position(srcrange.start), pygls_position(srcrange.end))
 
 
-def get_antfile(document: Document):
+# 0-based start line, start character, end line and end character, in UTF-16 code units (LSP)
+LspRange = Tuple[int, int, int, int]
+
+
+def pygls_lsp_range(range_: LspRange) -> Range:
+    return Range(Position(range_[0], range_[1]), Position(range_[2], range_[3]))
+
+
+_NEWLINE = re.compile('\n')
+# characters outside the Basic Multilingual Plane, which take two UTF-16 code units
+_ASTRAL = re.compile('[\U00010000-\U0010ffff]')
+
+
+class LineIndex:
+    '''Line starts of a text, for conversions between offsets, LSP positions (0-based line and
+    UTF-16 character) and stibium positions (1-based line and column, in code points).
+
+    Built once per version of a document (see AnalyzedDocument.lines). The two kinds of columns
+    only differ on lines with characters outside the BMP, whose columns are recorded too, so a
+    conversion is a bisect at most.
+    '''
+    __slots__ = ('_starts', '_astral')
+
+    def __init__(self, text: str):
+        self._starts = array('I', [0])
+        self._starts.extend(m.end() for m in _NEWLINE.finditer(text))
+        # 0-based line -> code point columns of its astral characters
+        self._astral = dict()
+        for m in _ASTRAL.finditer(text):
+            line = bisect_right(self._starts, m.start()) - 1
+            self._astral.setdefault(line, array('I')).append(m.start() - self._starts[line])
+
+    def __len__(self):
+        return len(self._starts)
+
+    def utf16_column(self, line: int, column: int) -> int:
+        '''UTF-16 column of the 0-based code point column of the 0-based line'''
+        astral = self._astral.get(line)
+        if astral is None:
+            return column
+        return column + bisect_left(astral, column)
+
+    def code_point_column(self, line: int, character: int) -> int:
+        '''Code point column of the 0-based UTF-16 column of the 0-based line'''
+        astral = self._astral.get(line)
+        if astral is None:
+            return character
+        for k, column in enumerate(astral):
+            if character <= column + k:
+                return character - k
+            if character == column + k + 1:
+                # between the two halves of a surrogate pair
+                return column + 1
+        return character - len(astral)
+
+    def offset(self, position: Position) -> int:
+        line = min(position.line, len(self._starts) - 1)
+        return self._starts[line] + self.code_point_column(line, position.character)
+
+    def position(self, offset: int) -> Position:
+        line = bisect_right(self._starts, offset) - 1
+        return Position(line, self.utf16_column(line, offset - self._starts[line]))
+
+    def sb_position(self, position: Position) -> SrcPosition:
+        return SrcPosition(position.line + 1,
+                           self.code_point_column(position.line, position.character) + 1)
+
+    def pygls_position(self, srcpos: SrcPosition) -> Position:
+        line = srcpos.line - 1
+        return Position(line, self.utf16_column(line, srcpos.column - 1))
+
+    def pygls_range(self, srcrange: SrcRange) -> Range:
+        return Range(self.pygls_position(srcrange.start), self.pygls_position(srcrange.end))
+
+    def lsp_range(self, start: int, end: int) -> LspRange:
+        '''LSP range of the text between two offsets'''
+        start_pos, end_pos = self.position(start), self.position(end)
+        return (start_pos.line, start_pos.character, end_pos.line, end_pos.character)
+
+    def lsp_span(self, span: Span) -> LspRange:
+        '''Convert a SymbolIndex span to 0-based lines and UTF-16 columns'''
+        line, column, end_line, end_column = span
+        return (line - 1, self.utf16_column(line - 1, column - 1),
+                end_line - 1, self.utf16_column(end_line - 1, end_column - 1))
+
+
+class AnalyzedDocument:
+    '''A version of a document: its source, its compact SymbolIndex and its issues, taken from
+    its AntFile, and its LineIndex, built on first use. Everything in it is of the same version.
+
+    The AntFile itself is not kept: its parse tree and symbol table hold several objects per
+    occurrence of every name, and the features only need what the index records.
+    '''
+    __slots__ = ('stamp', 'source', 'index', 'issues', '_lines')
+
+    def __init__(self, stamp, source: str, antfile: AntFile, path: str = ''):
+        self.stamp = stamp
+        self.source = source
+        self.index = SymbolIndex.from_antfile(antfile, path)
+        self.issues = antfile.get_issues()
+        self._lines = None
+
+    @property
+    def lines(self) -> LineIndex:
+        if self._lines is None:
+            self._lines = LineIndex(self.source)
+        return self._lines
+
+
+class AntFileCache:
+    '''Parsed and analyzed documents, so that each version of a document is analyzed once and
+    shared by diagnostics, hover, completion and the other features.
+
+    Entries are keyed by URI and stamped with the document version and a hash of its source, so
+    a stale analysis is never returned. A feature takes the AnalyzedDocument and reads
+    everything from it, so that it all comes from the same version.
+    '''
+    def __init__(self, maxsize: int = 32):
+        self._cache = TTLCache(maxsize=maxsize)
+
+    def _entry(self, key, stamp, path, source) -> AnalyzedDocument:
+        entry = self._cache.get(key)
+        if entry is None or entry.stamp != stamp:
+            entry = AnalyzedDocument(stamp, source, AntFile(path, source), path)
+            self._cache.put(key, entry)
+        return entry
+
+    def get(self, document: Document, source: str = None) -> AnalyzedDocument:
+        '''Analysis of the document, or of source if it is the text of the document that the
+        caller already read'''
+        if source is None:
+            source = document.source
+        return self._entry(document.uri, (document.version, hash(source)), document.path, source)
+
+    def get_text(self, text: str) -> AnalyzedDocument:
+        '''Analysis of a text that is not an open document'''
+        return self._entry(('text', hash(text)), text, '', text)
+
+    def discard(self, uri: str):
+        self._cache.pop(uri)
+
+
+antfile_cache = AntFileCache()
+
+
+def get_antfile(document: Document) -> AntFile:
+    '''A new AntFile of the document, for the features that need the parse tree (completion).
+    It is not cached, see AnalyzedDocument.'''
     return AntFile(document.path, document.source)
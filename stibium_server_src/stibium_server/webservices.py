@@ -4,87 +4,227 @@ Author: Gary Geng
 '''
 
 from .bioservices.chebi import ChEBI
+from .bioservices.retry import CircuitOpenError
 from .bioservices.uniprot import UniProt
+from .cache import TTLCache
+from .ranking import rank_chebi
 
-from io import StringIO
 from urllib.error import URLError
+from requests import RequestException
 
-from typing import Text
-import csv
+from typing import List, Text
 
 
 class NetworkError(Exception):
     pass
 
 
+# Number of results per page of the annotation dialog
+PAGE_SIZE = 20
+# Number of ChEBI candidates fetched (and ranked) per query
+CHEBI_CANDIDATES = 100
+
+
+# Errors raised by the services when the remote host cannot be reached. An open circuit breaker
+# means the service failed repeatedly and is not even tried.
+_CONNECTION_ERRORS = (URLError, RequestException, CircuitOpenError)
+
+
 class WebServices:
     '''Wrapper class that allows querying a couple of Bio webservices for annotation'''
-    def __init__(self):
+    def __init__(self, chebi_url: str = None, uniprot_url: str = None):
+        '''chebi_url and uniprot_url override the URLs of the services, e.g. to use a local
+        stand-in server (see standin.py).'''
+        self.chebi_url = chebi_url
+        self.uniprot_url = uniprot_url
         self.chebi = None
         self.uniprot = None
+        # ranked candidates per (database, normalized query)
+        self.results_cache = TTLCache(maxsize=256, ttl=3600)
 
     def init_chebi(self):
         if self.chebi is None:
             try:
-                self.chebi = ChEBI()
+                self.chebi = ChEBI(url=self.chebi_url)
             except Exception:
                 raise NetworkError
 
     def init_uniprot(self):
         if self.uniprot is None:
             try:
-                self.uniprot = UniProt()
+                self.uniprot = UniProt(url=self.uniprot_url)
             except Exception:
                 raise NetworkError
 
-    def annot_search_chebi(self, query: str):
-        self.init_chebi()
-        # TODO do we want to change searchCategory and maybe THREE STARS?
+    def annot_search_chebi(self, query: str, page: int = 0):
+        '''Return one page of the ChEBI candidates for query, best first.
+
+        The full candidate set of a query is ranked locally and cached, so further pages are
+        served without another SOAP call.
+        '''
         if query.strip() == '':
             return list()
 
+        key = ('chebi', query.strip().lower())
+        results = self.results_cache.get(key)
+        if results is None:
+            results = self._search_chebi(query)
+            self.results_cache.put(key, results)
+        return results[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+
+    def has_more_chebi(self, query: str, page: int = 0) -> bool:
+        '''Whether the cached candidates of query go beyond the given page.'''
+        results = self.results_cache.get(('chebi', query.strip().lower()))
+        return results is not None and len(results) > (page + 1) * PAGE_SIZE
+
+    def _search_chebi(self, query: str):
+        self.init_chebi()
+        # TODO do we want to change searchCategory and maybe THREE STARS?
         try:
-            results = self.chebi.getLiteEntity(query, maximumResults=100)
-        except URLError:
+            results = self.chebi.getLiteEntity(query, maximumResults=CHEBI_CANDIDATES)
+        except _CONNECTION_ERRORS:
             raise NetworkError
 
         # no result
-        if isinstance(results, str):
+        if isinstance(results, str) or not results:
             return list()
-        # sort by length as well. TODO should I do this?
-        results.sort(key=lambda e: e.searchScore * -10000 + len(e.chebiAsciiName))
-        results = results[:20]
-        return [{
-            'id': res.chebiId,
-            'name': res.chebiAsciiName,
-            'prefix': 'chebi'
-        } for res in results]
-
-    def annot_search_uniprot(self, query: str):
-        self.init_uniprot()
+        return rank_chebi(query, results)
 
+    def annot_search_uniprot(self, query: str, page: int = 0):
+        return list(self.iter_search_uniprot(query, page))
+
+    def iter_search_uniprot(self, query: str, page: int = 0):
+        '''Generator version of annot_search_uniprot that yields each result of the page as
+        soon as its row is received.
+
+        UniProt ranks the results itself, so each page is a search from its offset. Complete pages
+        are cached, so a repeated (or prefetched) query is answered without a request.
+        '''
         if query.strip() == '':
+            return
+
+        key = ('uniprot', query.strip().lower(), page)
+        cached = self.results_cache.get(key)
+        if cached is not None:
+            yield from cached[0]
+            return
+
+        self.init_uniprot()
+        results = list()
+        has_more = False
+        # one row more than the page tells whether there is a next one
+        rows = self._iter_uniprot_rows(query, PAGE_SIZE + 1, page * PAGE_SIZE)
+        try:
+            for item in rows:
+                if len(results) == PAGE_SIZE:
+                    has_more = True
+                    break
+                results.append(item)
+                yield item
+        finally:
+            rows.close()
+        self.results_cache.put(key, (results, has_more))
+
+    def has_more_uniprot(self, query: str, page: int = 0) -> bool:
+        '''Whether UniProt has results for query beyond the given page, once it is fetched.'''
+        cached = self.results_cache.get(('uniprot', query.strip().lower(), page))
+        return cached is not None and cached[1]
+
+    def limiter(self, database: str):
+        '''The rate limiter that the searches of database go through'''
+        if database == 'chebi':
+            self.init_chebi()
+            return self.chebi.limiter
+        self.init_uniprot()
+        return self.uniprot.limiter
+
+    def is_cached(self, database: str, query: str) -> bool:
+        '''Whether the first page of results of query is in the result cache.'''
+        query = query.strip().lower()
+        if database == 'chebi':
+            return ('chebi', query) in self.results_cache
+        return ('uniprot', query, 0) in self.results_cache
+
+    def prefetch(self, database: str, query: str):
+        '''Run the search for query only to fill the result cache.'''
+        if database == 'chebi':
+            self.annot_search_chebi(query)
+        else:
+            for _ in self.iter_search_uniprot(query):
+                pass
+
+    def chebi_entities(self, chebi_ids: List[str]):
+        '''Fetch the ids and names of ChEBI entities, 50 per call.
+
+        The SOAP replies are parsed incrementally for these two fields only.
+        '''
+        self.init_chebi()
+        if not chebi_ids:
             return list()
 
+        fields = {'id': 'chebiId', 'name': 'chebiAsciiName'}
+        try:
+            entities = list(self.chebi.iter_complete_entities(chebi_ids, fields))
+        except _CONNECTION_ERRORS:
+            raise NetworkError
+
+        for ent in entities:
+            ent['prefix'] = 'chebi'
+        return entities
+
+    def chebi_ontology(self, chebi_id: str):
+        '''Fetch the name and the ontology parents and children of a ChEBI entity in one call.
+
+        Returns a dict with 'id', 'name', and 'parents' and 'children' as lists of
+        (id, name, relationship type), or None if there is no such entity.
+        '''
+        self.init_chebi()
         try:
-            result_str = self.uniprot.search(query, limit=20, columns='id,entry name,protein names,genes')
-        except URLError:
+            entity = self.chebi.getCompleteEntity(chebi_id)
+        except _CONNECTION_ERRORS:
             raise NetworkError
 
-        assert isinstance(result_str, str)
-        result_f = StringIO(result_str)
-        reader = csv.reader(result_f, delimiter='\t')
-        objects = list()
-        # Skip header
-        next(reader, None)
-        for row in reader:
-            id_, entry_name, protein_names, genes = row
-            objects.append({
-                'id': id_,
-                'name': protein_names,
-                'entry_name': entry_name,
-                'protein_names': protein_names,
-                'genes': genes,
-                'prefix': 'uniprot',
-            })
-        return objects
+        if not entity or isinstance(entity, str):
+            return None
+
+        def items(data):
+            return [(str(item.chebiId), str(item.chebiName), str(item.type))
+                    for item in (data or list())]
+        return {
+            'id': str(entity.chebiId),
+            'name': str(entity.chebiAsciiName),
+            'parents': items(getattr(entity, 'OntologyParents', None)),
+            'children': items(getattr(entity, 'OntologyChildren', None)),
+        }
+
+    def uniprot_entries(self, accessions: List[str]):
+        '''Fetch the UniProt entries of a list of accessions (or entry names) with a single
+        search.'''
+        self.init_uniprot()
+        if not accessions:
+            return list()
+
+        # id: matches exactly the accession or the entry name
+        query = ' OR '.join('id:' + acc for acc in accessions)
+        return list(self._iter_uniprot_rows(query, len(accessions)))
+
+    def _iter_uniprot_rows(self, query: str, limit: int, offset: int = None):
+        rows = self.uniprot.search_stream(query, limit=limit, offset=offset or None,
+                                          columns='id,entry name,protein names,genes')
+        try:
+            # Skip header
+            next(rows, None)
+            for row in rows:
+                id_, entry_name, protein_names, genes = row
+                yield {
+                    'id': id_,
+                    'name': protein_names,
+                    'entry_name': entry_name,
+                    'protein_names': protein_names,
+                    'genes': genes,
+                    'prefix': 'uniprot',
+                }
+        except _CONNECTION_ERRORS:
+            raise NetworkError
+        finally:
+            rows.close()
@@ -0,0 +1,298 @@
+'''Cross-file view of the workspace: imports, the dependency graph between files, and a summary
+of what each file defines.
+
+Each AntFile is analyzed in isolation from its own text. The WorkspaceModel adds what is needed
+across files, without parsing or analyzing the imported files:
+
+* a FileSummary per file, extracted with the fast lexer: its import statements and the models
+  and functions it defines (which other files may use as submodels);
+* import statements resolved to paths, relative to the importing file and then to the workspace
+  folders, as a graph between files with the reverse (dependents) edges;
+* summaries of files that are not open are read from disk when needed, and kept until the file
+  changes on disk (by mtime and size).
+
+When an open document changes, only its summary is recomputed, and only if its imports or its
+exported names changed are its dependents to be checked again (see update()).
+'''
+
+from .lexer import COMMENT, NAME, STRING, lex
+from .utils import LineIndex, LspRange
+
+from collections import deque
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+
+# keywords that start the definition of a module
+MODULE_KEYWORDS = ('model', 'module')
+FUNCTION_KEYWORD = 'function'
+IMPORT_KEYWORD = 'import'
+# extensions tried for imports that name a file without one
+IMPORT_EXTENSIONS = ('.ant', '.txt')
+
+_ESCAPE = re.compile(r'\\(.)')
+
+
+class Import(NamedTuple):
+    target: str
+    range: LspRange
+
+
+class Definition(NamedTuple):
+    name: str
+    kind: str
+    range: LspRange
+
+
+class ImportIssue(NamedTuple):
+    range: LspRange
+    message: str
+    is_error: bool
+
+
+class FileSummary:
+    '''What other files need to know about a file: what it imports and what it defines.'''
+    __slots__ = ('imports', 'definitions')
+
+    def __init__(self, imports: List[Import], definitions: Dict[str, Definition]):
+        self.imports = imports
+        self.definitions = definitions
+
+    @classmethod
+    def from_text(cls, text: str) -> 'FileSummary':
+        tokens = lex(text)
+        lines = LineIndex(text)
+        imports = list()
+        definitions = dict()
+        # significant tokens only; comments don't separate a keyword from its name
+        significant = [(kind, start, end) for kind, start, end in tokens if kind != COMMENT]
+        for i, (kind, start, end) in enumerate(significant[:-1]):
+            if kind != NAME:
+                continue
+            word = text[start:end]
+            next_kind, next_start, next_end = significant[i + 1]
+            if word == IMPORT_KEYWORD and next_kind == STRING:
+                target = _ESCAPE.sub(r'\1', text[next_start + 1:next_end - 1])
+                imports.append(Import(target, lines.lsp_range(start, next_end)))
+            elif word in MODULE_KEYWORDS or word == FUNCTION_KEYWORD:
+                if text[next_start:next_end] == '*' and i + 2 < len(significant):
+                    # model *main(): the main model of the file
+                    next_kind, next_start, next_end = significant[i + 2]
+                if next_kind == NAME:
+                    name = text[next_start:next_end]
+                    kind = 'function' if word == FUNCTION_KEYWORD else 'model'
+                    definitions.setdefault(name, Definition(
+                        name, kind, lines.lsp_range(next_start, next_end)))
+        return cls(imports, definitions)
+
+    def interface(self):
+        '''What dependents depend on: the imported files and the defined names'''
+        return (tuple(i.target for i in self.imports), frozenset(self.definitions))
+
+
+def _disk_stamp(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class WorkspaceModel:
+    '''Summaries of the workspace files and the import graph between them.
+
+    Files are identified by their normalized absolute path. Open documents are updated with
+    update() and take precedence over the files on disk until close() is called.
+    '''
+    def __init__(self, roots: Iterable[str] = ()):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self._lock = threading.RLock()
+        self._summaries: Dict[str, FileSummary] = dict()
+        # disk stamp of the summaries read from disk, None for open documents
+        self._stamps = dict()
+        self._imports: Dict[str, List[Optional[str]]] = dict()
+        self._dependents: Dict[str, Set[str]] = dict()
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def set_roots(self, roots: Iterable[str]):
+        with self._lock:
+            self.roots = [os.path.abspath(root) for root in roots]
+            # imports may resolve differently now
+            for path in list(self._summaries):
+                self._link(path)
+
+    def update(self, path: str, text: str) -> Set[str]:
+        '''Update the summary of an open document from its text.
+
+        Return the files that depend on it, directly or not, if its interface changed, so that
+        they can be checked again; an empty set otherwise.
+        '''
+        path = self.normalize(path)
+        summary = FileSummary.from_text(text)
+        with self._lock:
+            return self._changed(path, self._set(path, summary, None), summary)
+
+    def close(self, path: str) -> Set[str]:
+        '''The document was closed: use the file on disk again; see update() for the result.'''
+        path = self.normalize(path)
+        summary = self._read(path)
+        with self._lock:
+            return self._changed(path, self._set(path, summary, _disk_stamp(path)), summary)
+
+    def file_changed(self, path: str) -> Set[str]:
+        '''A file changed, was created or was deleted on disk; see update() for the result.'''
+        path = self.normalize(path)
+        with self._lock:
+            if path in self._summaries and self._stamps.get(path) is None:
+                # open; the editor has the current text
+                return set()
+        summary = self._read(path)
+        with self._lock:
+            dependents = self.dependents(path)
+            old = self._set(path, summary, _disk_stamp(path))
+            if (old is None) != (summary is None):
+                # created or deleted: the imports of the other files may resolve differently
+                for other in list(self._summaries):
+                    if other != path:
+                        self._link(other)
+                return dependents | self.dependents(path)
+            return self._changed(path, old, summary)
+
+    def _changed(self, path: str, old: Optional[FileSummary],
+                 new: Optional[FileSummary]) -> Set[str]:
+        if old is not None and new is not None and old.interface() == new.interface():
+            return set()
+        return self.dependents(path)
+
+    def _set(self, path: str, summary: Optional[FileSummary], stamp) -> Optional[FileSummary]:
+        '''Replace the summary of path, and return the old one'''
+        old = self._summaries.get(path)
+        if summary is None:
+            self._summaries.pop(path, None)
+            self._stamps.pop(path, None)
+        else:
+            self._summaries[path] = summary
+            self._stamps[path] = stamp
+        self._link(path)
+        return old
+
+    @staticmethod
+    def _read(path: str) -> Optional[FileSummary]:
+        try:
+            with open(path, encoding='utf-8', errors='replace') as file:
+                return FileSummary.from_text(file.read())
+        except OSError:
+            return None
+        except Exception:
+            logging.exception('Could not summarize %s', path)
+            return None
+
+    def _load(self, path: str) -> Optional[FileSummary]:
+        '''Summary of path, read from disk if it is not known or changed on disk'''
+        summary = self._summaries.get(path)
+        if summary is not None:
+            stamp = self._stamps.get(path)
+            if stamp is None or stamp == _disk_stamp(path):
+                return summary
+        self._set(path, self._read(path), _disk_stamp(path))
+        return self._summaries.get(path)
+
+    def _link(self, path: str):
+        '''Recompute the import edges of path'''
+        for target in self._imports.pop(path, ()):
+            if target is not None:
+                self._dependents.get(target, set()).discard(path)
+        summary = self._summaries.get(path)
+        if summary is None:
+            return
+        targets = [self.resolve_import(path, i.target) for i in summary.imports]
+        self._imports[path] = targets
+        for target in targets:
+            if target is not None:
+                self._dependents.setdefault(target, set()).add(path)
+
+    def resolve_import(self, path: str, target: str) -> Optional[str]:
+        '''Path of the file imported by the statement import "target" of the file at path'''
+        bases = [os.path.dirname(path)] + self.roots
+        names = [target] + [target + ext for ext in IMPORT_EXTENSIONS
+                            if not os.path.splitext(target)[1]]
+        for base in bases:
+            for name in names:
+                candidate = os.path.join(base, name)
+                if os.path.isfile(candidate):
+                    return self.normalize(candidate)
+        return None
+
+    def summary(self, path: str) -> Optional[FileSummary]:
+        with self._lock:
+            return self._load(self.normalize(path))
+
+    def imports(self, path: str) -> List[Optional[str]]:
+        '''Resolved imports of path, in order; None for the ones that could not be resolved'''
+        path = self.normalize(path)
+        with self._lock:
+            self._load(path)
+            return list(self._imports.get(path, ()))
+
+    def import_closure(self, path: str) -> List[str]:
+        '''The files imported by path, directly or not, nearest first'''
+        path = self.normalize(path)
+        seen = {path}
+        order = list()
+        queue = deque([path])
+        with self._lock:
+            while queue:
+                current = queue.popleft()
+                self._load(current)
+                for target in self._imports.get(current, ()):
+                    if target is not None and target not in seen:
+                        seen.add(target)
+                        order.append(target)
+                        queue.append(target)
+        return order
+
+    def dependents(self, path: str) -> Set[str]:
+        '''The known files that import path, directly or not'''
+        path = self.normalize(path)
+        result = set()
+        with self._lock:
+            stack = [path]
+            while stack:
+                for dependent in self._dependents.get(stack.pop(), ()):
+                    if dependent not in result and dependent != path:
+                        result.add(dependent)
+                        stack.append(dependent)
+        return result
+
+    def find_definition(self, path: str, name: str) -> Optional[Tuple[str, Definition]]:
+        '''The model or function called name defined in the import closure of path'''
+        with self._lock:
+            for target in self.import_closure(path):
+                summary = self._summaries.get(target)
+                if summary is not None and name in summary.definitions:
+                    return target, summary.definitions[name]
+        return None
+
+    def import_issues(self, path: str) -> List[ImportIssue]:
+        '''Unresolved imports and import cycles of path'''
+        path = self.normalize(path)
+        issues = list()
+        with self._lock:
+            summary = self._load(path)
+            if summary is None:
+                return issues
+            targets = self._imports.get(path, ())
+            for statement, target in zip(summary.imports, targets):
+                if target is None:
+                    issues.append(ImportIssue(statement.range, "Cannot find imported file '{}'"
+                                              .format(statement.target), True))
+                elif target == path or path in self.import_closure(target):
+                    issues.append(ImportIssue(statement.range, "Import cycle: '{}' imports this "
+                                              'file'.format(statement.target), False))
+        return issues